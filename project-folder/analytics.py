@@ -0,0 +1,130 @@
+'''Community activity trends for the admin analytics page, read from the rollup tables'''
+'''
+Counting signups, events or messages per day over the source tables would scan
+them on every chart (creation_date is TEXT, without an index). Instead, the
+triggers in db_conn.setup_database add 1 to an hourly and a daily rollup row
+in the same transaction as every write, and a chart only reads the rows of
+its range: at most MAX_BUCKETS buckets per dimension, whatever the size of the
+tables.
+
+METRICS (dimension in parentheses):
+signups:          new users and organizations (user / org)
+events:           events created (event_type)
+items_listed:     items published for exchange (item_type)
+items_exchanged:  exchange requests accepted (item_type of the item)
+messages:         messages sent to or by an organization (org_id)
+
+Granularities: hour (hourly rows, kept HOURLY_RETENTION_DAYS), day, week
+(summed from the daily rows, labelled by their Monday). Buckets follow the
+timestamps stored in the rows, which SQLite writes in UTC.
+'''
+
+from datetime import datetime, timedelta
+#CUSTOM MODULES
+import db_operator
+
+METRICS = {
+    'signups': 'Signups',
+    'events': 'Events created',
+    'items_listed': 'Items listed',
+    'items_exchanged': 'Items exchanged',
+    'messages': 'Messages per organization',
+}
+GRANULARITIES = {
+    # name: (bucket length, strftime format, longest range in days)
+    'hour': (timedelta(hours=1), '%Y-%m-%d %H', 14),
+    'day': (timedelta(days=1), '%Y-%m-%d', 366),
+    'week': (timedelta(weeks=1), '%Y-%m-%d', 3 * 366),
+}
+MAX_DIMENSIONS = 10          # the smaller dimensions are summed into OTHER
+OTHER = 'otros'
+HOURLY_RETENTION_DAYS = 90   # hourly rows older than this are pruned, daily rows stay
+
+
+def _buckets(granularity, days):
+    """Every bucket label of the last `days` days, oldest first (the current one included)."""
+    step, fmt, _ = GRANULARITIES[granularity]
+    now = datetime.utcnow()
+    if granularity == 'hour':
+        current = now.replace(minute=0, second=0, microsecond=0)
+    elif granularity == 'week':
+        current = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        current = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    count = max(1, int(timedelta(days=days) / step))
+    return [(current - step * offset).strftime(fmt) for offset in range(count - 1, -1, -1)]
+
+
+def _dimension_labels(metric, dimensions):
+    if metric != 'messages':
+        return {dimension: dimension for dimension in dimensions}
+    labels = {}
+    for dimension in dimensions:
+        org = db_operator.get_org_by_id(int(dimension)) if dimension.isdigit() else None
+        labels[dimension] = org['name'] if org else f"Organización {dimension}"
+    return labels
+
+
+def series(metric, granularity='day', days=30, max_dimensions=MAX_DIMENSIONS):
+    """
+    Zero-filled time series of one metric, one series per dimension.
+
+    Args:
+        metric (str): One of METRICS.
+        granularity (str): One of GRANULARITIES.
+        days (int): How far back, capped per granularity.
+        max_dimensions (int): Largest dimensions kept, the rest are summed into OTHER.
+
+    Returns:
+        dict: {'metric', 'granularity', 'buckets': [labels], 'series': [{'dimension', 'label',
+               'values', 'total'}], 'total'}, or None on database error.
+
+    Raises:
+        ValueError: On an unknown metric or granularity.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+    days = max(1, min(int(days), GRANULARITIES[granularity][2]))
+
+    buckets = _buckets(granularity, days)
+    rows = db_operator.get_activity_rollup(metric, granularity, buckets[0], buckets[-1])
+    if rows is None:
+        return None
+
+    position = {bucket: index for index, bucket in enumerate(buckets)}
+    values = {}
+    for bucket, dimension, value in rows:
+        if bucket in position:
+            values.setdefault(dimension, [0] * len(buckets))[position[bucket]] += value
+
+    ranked = sorted(values, key=lambda dimension: sum(values[dimension]), reverse=True)
+    kept, folded = ranked[:max_dimensions], ranked[max_dimensions:]
+    if folded:
+        other = [sum(column) for column in zip(*(values[dimension] for dimension in folded))]
+        if OTHER in values and OTHER in kept:
+            other = [a + b for a, b in zip(other, values[OTHER])]
+            kept.remove(OTHER)
+        values[OTHER] = other
+        kept.append(OTHER)
+
+    labels = _dimension_labels(metric, [dimension for dimension in kept if dimension != OTHER])
+    labels[OTHER] = 'Otros'
+    result_series = [
+        {'dimension': dimension, 'label': labels[dimension], 'values': values[dimension], 'total': sum(values[dimension])}
+        for dimension in kept
+    ]
+    return {
+        'metric': metric,
+        'granularity': granularity,
+        'buckets': buckets,
+        'series': result_series,
+        'total': sum(entry['total'] for entry in result_series),
+    }
+
+
+def prune_hourly():
+    """Drops the hourly rollups past HOURLY_RETENTION_DAYS. Returns the rows deleted, None on error."""
+    before = (datetime.utcnow() - timedelta(days=HOURLY_RETENTION_DAYS)).strftime('%Y-%m-%d %H')
+    return db_operator.prune_hourly_rollups(before)
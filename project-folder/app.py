@@ -1,14 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, make_response
 import logic
 import os
+import hashlib
+import zlib
+import rate_limiter
+import heatmap
+import response_cache
+import session_store
+import outbox
+import scheduler
+import profiling
+import analytics
 from logic import socketio
 from functools import wraps # Import wraps for decorators
 
 # --- Flask App Setup ---
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24)) 
+# The session cookie only carries an opaque id, the data lives in session_store
+app.session_interface = session_store.ServerSideSessionInterface()
 
+# Server-Timing header and slow-query log
+profiling.init_app(app)
 socketio.init_app(app)
+outbox.init_app(app, socketio)
+scheduler.init(socketio)
 
 # --- Decorators for Route Protection ---
 
@@ -43,11 +59,124 @@ def org_login_required(f):
     return decorated_function
 
 
+def rate_limited(limit_name):
+    """Decorator to answer bursts with HTTP 429 before the route touches the database."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            result = rate_limiter.check(limit_name, entity_type=session.get('entity_type'),
+                                        entity_id=session.get('entity_id'), remote_addr=request.remote_addr)
+            if result['status'] != 'success':
+                headers = {'Retry-After': str(result['retry_after'])}
+                if request.is_json:
+                    return jsonify(result), 429, headers
+                return result['message'], 429, headers
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def cached_page(*tags, ttl=None):
+    """
+    Decorator to serve public GET pages to anonymous visitors from response_cache.
+    Logged-in visitors (personal navbar, notifications) always get a fresh render,
+    and so does a request with pending flash messages. tags are the invalidation
+    groups the page depends on (see response_cache.py).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            auth_state = session.get('entity_type', 'anonymous')
+            if not response_cache.ENABLED or auth_state != 'anonymous' or '_flashes' in session:
+                return f(*args, **kwargs)
+
+            key = response_cache.make_key(request.endpoint, kwargs, request.args.items(multi=True), auth_state, tags)
+            entry = response_cache.get(key) if key else None
+            if entry:
+                response = Response(entry['body'], status=entry['status'], content_type=entry['content_type'])
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            # Redirects, errors and renders that flashed something are not shared
+            if key and response.status_code == 200 and not session.modified and not response.is_streamed:
+                response_cache.put(key, {
+                    'status': response.status_code,
+                    'content_type': response.content_type,
+                    'body': response.get_data(as_text=True)
+                }, ttl)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated_function
+    return decorator
+
+
+# --- Conditional GET helpers (map layer) ---
+
+def map_layer_etag(*parts):
+    """
+    Strong ETag for a map response: map_points change counter + whatever selects the
+    representation (query string, encoding). None if the counter can't be read.
+    """
+    version = logic.get_map_layer_version()
+    if version is None:
+        return None
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12]
+    return f"map-{version}-{digest}"
+
+def heatmap_etag(*parts):
+    """Same as map_layer_etag for the admin heatmap tiles, versioned by rebuild."""
+    version = logic.get_heatmap_version()
+    if version is None:
+        return None
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:12]
+    return f"heatmap-{version}-{digest}"
+
+def with_etag(response, etag):
+    """Adds the ETag and asks clients to revalidate on every use (cheap thanks to 304s)."""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    """Returns a 304 response if the client already has this version, else None."""
+    if etag and request.if_none_match.contains(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+def gzip_stream(chunks):
+    """Compresses a text generator on the fly into a single gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def current_entity():
+    """
+    Profile of the logged-in visitor, read through the entity cache (the session only
+    keeps the ids). None for anonymous visitors. Admins logged in from /admin/login
+    have no user row, only the name stored at login.
+    """
+    entity_type = session.get('entity_type')
+    if entity_type == 'admin' and 'admin_id' in session:
+        return {'name': session.get('name')}
+    if entity_type and session.get('entity_id'):
+        return logic.get_session_entity_logic(session['entity_id'], entity_type)
+    return None
+
+
 # --- Template Context Processor ---
-# This makes the 'session' object available in all templates automatically.
+# This makes the 'session' object and the logged-in profile available in all templates automatically.
 @app.context_processor
 def inject_session():
-    return dict(session=session)
+    unread_notifications = 0
+    if session.get('entity_type') == 'user':
+        # Single primary-key lookup on notification_counters
+        unread_notifications = logic.get_unread_notifications_count_logic(session['entity_id'])
+    return dict(session=session, current_entity=current_entity(), unread_notifications=unread_notifications)
 
 
 # --- Basic Routes ---
@@ -92,8 +221,9 @@ def register_user():
 @app.route('/register/org', methods=['GET', 'POST'])
 @user_login_required # Use decorator to ensure a user is logged in
 def register_org():
-    creator_student_code = session.get('student_code')
-    creator_email = session.get('email')
+    creator = current_entity() or {}
+    creator_student_code = creator.get('student_code')
+    creator_email = creator.get('email')
     if not creator_student_code:
         flash("No se pudo identificar al usuario conectado.", "error")
         return redirect(url_for('login'))
@@ -130,20 +260,12 @@ def login():
 
         if result['status'] == 'success':
             session.clear()
+            session.rotate()
             session['entity_id'] = result['entity_id']
             session['entity_type'] = result['entity_type']
-            session['name'] = result['name']
-            session['nickname'] = result.get('nickname', '')
-            session['student_code'] = result.get('student_code', '')
-            session['email'] = result['email']
-            session['career'] = result.get('career', '')
-            session['interests'] = result.get('interests', '')
-            session['description'] = result.get('description', '')
-            session['points'] = result.get('points', 0)
-            session['photo'] = result.get('photo', '')
 
             if result['entity_type'] == 'admin':
-                flash(f"¡Inicio de sesión de administrador exitoso para {session['name']}!", 'success')
+                flash(f"¡Inicio de sesión de administrador exitoso para {result['name']}!", 'success')
                 return redirect(url_for('admin_dashboard'))
             
             if result['entity_type'] == 'user':
@@ -170,17 +292,11 @@ def login_org():
         
         if result['status'] == 'success':
             session.clear()
+            session.rotate()
             session['entity_id'] = result['entity_id']
             session['entity_type'] = 'organization'
-            session['name'] = result['name']
-            session['email'] = result['email']
-            session['description'] = result.get('description', '')
-            session['interests'] = result.get('interests', '')
-            session['points'] = result.get('points', 0)
-            session['creator_student_code'] = result.get('creator_student_code', '')
-            session['photo'] = result.get('photo', '')
-
-            flash(f"¡Inicio de sesión de organización exitoso para {session['name']}!", 'success')
+
+            flash(f"¡Inicio de sesión de organización exitoso para {result['name']}!", 'success')
             return redirect(url_for('index'))
         else:
             flash(result['message'], result['status'])
@@ -188,6 +304,25 @@ def login_org():
     
     return render_template('login_org.html')
 
+@app.route('/verify/<token>')
+def verify_email(token):
+    result = logic.verify_email_logic(token)
+    flash(result['message'], result['status'])
+    if result['status'] == 'success':
+        return redirect(url_for('login'))
+    return redirect(url_for('resend_verification'))
+
+@app.route('/verify/resend')
+def resend_verification():
+    return render_template('resend_verification.html')
+
+@app.route('/verify/resend', methods=['POST'])
+@rate_limited('verification_resend')
+def resend_verification_post():
+    result = logic.resend_verification_logic(request.form.get('email'))
+    flash(result['message'], result['status'])
+    return redirect(url_for('login'))
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -201,30 +336,22 @@ def profile():
     entity_id = None
     entity_type = session.get('entity_type')
     
+    profile_data = current_entity() or {}
+
     if entity_type == 'user':
         entity_id = session.get('entity_id')
         
         user_data = {
-            'name': session.get('name'),
-            'email': session.get('email'),
-            'student_code': session.get('student_code'),
-            'career': session.get('career'),
-            'interests': session.get('interests'),
-            'points': session.get('points', 0),
-            'photo': session.get('photo', '')
+            'name': profile_data.get('name'),
+            'email': profile_data.get('email'),
+            'student_code': profile_data.get('student_code'),
+            'career': profile_data.get('career') or '',
+            'interests': profile_data.get('interests') or '',
+            'points': profile_data.get('points', 0),
+            'photo': profile_data.get('photo', '')
         }
         
-        fresh_user_data = logic.get_entity_by_id(entity_id, entity_type)
-        if fresh_user_data:
-            if not user_data['career'] or user_data['career'] == 'None':
-                user_data['career'] = fresh_user_data.get('career', '')
-            if not user_data['interests'] or user_data['interests'] == 'None':
-                user_data['interests'] = fresh_user_data.get('interests', '')
-            session['career'] = fresh_user_data.get('career', '')
-            session['interests'] = fresh_user_data.get('interests', '')
-            session.modified = True
-        
-        points = session.get('points', 0)
+        points = user_data['points']
         user_orgs = []
         
         badges = []
@@ -248,12 +375,12 @@ def profile():
         entity_id = session.get('entity_id')
         
         org_data = {
-            'name': session.get('name'),
-            'email': session.get('email'),
-            'description': session.get('description'),
-            'interests': session.get('interests'),
-            'points': session.get('points', 0),
-            'photo': session.get('photo', '')
+            'name': profile_data.get('name'),
+            'email': profile_data.get('email'),
+            'description': profile_data.get('description'),
+            'interests': profile_data.get('interests'),
+            'points': profile_data.get('points', 0),
+            'photo': profile_data.get('photo', '')
         }
         
         members = []
@@ -307,57 +434,32 @@ def update_profile():
             if request.form.get('interests'):
                 new_data['interests'] = request.form.get('interests')
         
+        # The profile shown afterwards is read again through the entity cache, nothing to patch here
         result = logic.update_my_profile_logic(entity_id, entity_type, new_data)
         flash(result['message'], result['status'])
         
-        if result['status'] == 'success':
-            if 'name' in new_data:
-                session['name'] = new_data['name']
-            if entity_type == 'user':
-                if 'nickname' in new_data:
-                    session['nickname'] = new_data['nickname']
-                if 'career' in new_data:
-                    session['career'] = new_data['career']
-                if 'interests' in new_data:
-                    session['interests'] = new_data['interests']
-            elif entity_type == 'organization':
-                if 'description' in new_data:
-                    session['description'] = new_data['description']
-                if 'interests' in new_data:
-                    session['interests'] = new_data['interests']
-            session.modified = True
-        
         return redirect(url_for('profile'))
     
+    profile_data = current_entity() or {}
     if entity_type == 'user':
         data = {
-            'name': session.get('name'),
-            'nickname': session.get('nickname'),
-            'email': session.get('email'),
-            'student_code': session.get('student_code'),
-            'career': session.get('career'),
-            'interests': session.get('interests'),
-            'points': session.get('points', 0)
+            'name': profile_data.get('name'),
+            'nickname': profile_data.get('nickname'),
+            'email': profile_data.get('email'),
+            'student_code': profile_data.get('student_code'),
+            'career': profile_data.get('career'),
+            'interests': profile_data.get('interests'),
+            'points': profile_data.get('points', 0)
         }
         
-        result = logic.get_entity_by_id(entity_id, entity_type)
-        if result['status'] == 'success' and 'data' in result:
-            db_data = result['data']
-            if 'email' in db_data and not data['email']:
-                data['email'] = db_data['email']
-            if 'career' in db_data and not data['career']:
-                data['career'] = db_data['career']
-            if 'interests' in db_data and not data['interests']:
-                data['interests'] = db_data['interests']
-        
         return render_template('update_profile.html', entity_type=entity_type, data=data)
     else:
         data = {
-            'name': session.get('name'),
-            'email': session.get('email'),
-            'description': session.get('description'),
-            'interests': session.get('interests'),
-            'points': session.get('points', 0)
+            'name': profile_data.get('name'),
+            'email': profile_data.get('email'),
+            'description': profile_data.get('description'),
+            'interests': profile_data.get('interests'),
+            'points': profile_data.get('points', 0)
         }
         
         return render_template('update_profile.html', entity_type=entity_type, data=data)
@@ -435,6 +537,7 @@ def search_users():
 
 # --- Organization Routes ---
 @app.route('/search_orgs')
+@cached_page('orgs')
 def search_orgs():
     query = request.args.get('q', '')
     interests = request.args.get('interests', '')
@@ -519,6 +622,7 @@ def leave_org(org_id):
     return redirect(url_for('search_orgs'))
 
 @app.route('/organization/<int:org_id>')
+@cached_page('orgs')
 def view_org_profile(org_id):
     result = logic.get_entity_by_id(org_id, 'org')
     
@@ -560,10 +664,12 @@ def create_event():
         event_datetime = request.form.get('event_datetime')
         location = request.form.get('location')
         event_type = request.form.get('event_type')
+        latitude = request.form.get('latitude')
+        longitude = request.form.get('longitude')
 
         result = logic.create_event_logic(
             organizer_id, organizer_type, title, description, 
-            event_datetime, location, event_type
+            event_datetime, location, event_type, latitude, longitude
         )
 
         flash(result['message'], result['status'])
@@ -587,19 +693,26 @@ def delete_event(event_id):
     return redirect(url_for('search_events'))
 
 @app.route('/events/search')
+@cached_page('events')
 def search_events():
     query = request.args.get('q', '')
     location = request.args.get('location', '')
     event_type = request.args.get('event_type', '')
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
+    near_lat = request.args.get('near_lat', '')
+    near_lng = request.args.get('near_lng', '')
+    radius_km = request.args.get('radius_km', '')
     
     result = logic.search_events_logic(
         query=query,
         location=location,
         event_type=event_type,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        near_lat=near_lat,
+        near_lng=near_lng,
+        radius_km=radius_km
     )
     
     if result['status'] == 'success':
@@ -611,7 +724,10 @@ def search_events():
             location=location,
             event_type=event_type,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            near_lat=near_lat,
+            near_lng=near_lng,
+            radius_km=radius_km
         )
     else:
         flash(result['message'], result['status'])
@@ -622,7 +738,10 @@ def search_events():
             location=location,
             event_type=event_type,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            near_lat=near_lat,
+            near_lng=near_lng,
+            radius_km=radius_km
         )
 
 @app.route('/event/participants/<int:event_id>')
@@ -670,9 +789,9 @@ def view_event_participants(event_id):
 
 @app.route('/event/register/<int:event_id>', methods=['POST'])
 @user_login_required
+@rate_limited('event_register')
 def register_for_event(event_id):
     entity_id = session.get('entity_id')
-    entity_type = session.get("entity_type")
     if not entity_id:
         flash("No se pudo identificar la sesión de usuario.", "error")
         return redirect(url_for('login'))
@@ -680,12 +799,6 @@ def register_for_event(event_id):
     result = logic.register_for_event_logic(entity_id, event_id)
     flash(result['message'], result['status'])
 
-    if result['status'] == 'success':
-         user_data = logic.get_entity_by_id(entity_id, entity_type)
-         if user_data['status'] == 'success':
-             session['points'] = user_data['data'].get('points', session.get('points'))
-             session.modified = True
-
     return redirect(url_for('search_events'))
 
 @app.route('/event/leave/<int:event_id>', methods=['POST'])
@@ -734,6 +847,7 @@ def mark_attendance():
     return redirect(url_for('view_event_participants', event_id=event_id))
 
 @app.route('/event/<int:event_id>')
+@cached_page('events')
 def view_event_detail(event_id):
     result = logic.search_events_logic(event_id=event_id)
     
@@ -756,6 +870,7 @@ def view_event_detail(event_id):
 
 # --- Item Routes ---
 @app.route('/search/items')
+@cached_page('items')
 def search_items():
     search_term = request.args.get('q', '')
     item_type = request.args.get('item_type', '')
@@ -817,7 +932,6 @@ def view_item_detail(item_id):
 @app.route('/item/add', methods=['GET', 'POST'])
 def add_item():
     owner_id = session.get('entity_id')
-    owner_type = session.get('entity_type') 
 
     if request.method == 'POST':
         name = request.form.get('name')
@@ -831,12 +945,6 @@ def add_item():
         )
 
         flash(result['message'], result['status'])
-        
-        if result['status'] == 'success':
-             user_data = logic.get_entity_by_id(owner_id, owner_type)
-             if user_data['status'] == 'success':
-                 session['points'] = user_data['data'].get('points', session.get('points')) 
-                 session.modified = True 
 
         return redirect(url_for('search_items'))
 
@@ -857,6 +965,7 @@ def delete_my_item(item_id):
 
 @app.route('/item/request/<int:item_id>', methods=['POST'])
 @user_login_required
+@rate_limited('item_request')
 def request_item(item_id):
     requester_id = session.get('entity_id')
     if not requester_id:
@@ -903,9 +1012,64 @@ def reject_exchange(exchange_id):
 # --- Map Routes ---
 
 @app.route('/map')
+@cached_page(ttl=3600)
 def view_map():
-    map_points = logic.get_map_points()
-    return render_template('view_map.html', map_points=map_points)
+    # Points are loaded per viewport from /api/map/points
+    return render_template('view_map.html')
+
+@app.route('/api/map/points')
+def api_map_points():
+    etag = map_layer_etag(request.path, request.query_string)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    result = logic.get_map_points_in_bbox_logic(request.args.get('bbox'), request.args.get('type'))
+    if result['status'] != 'success':
+        return jsonify(result), 400
+    return with_etag(jsonify(result), etag)
+
+@app.route('/api/map/points.geojson')
+def api_map_geojson():
+    """Whole map layer as GeoJSON, streamed (gzipped when accepted) and only re-sent when it changes."""
+    point_type = request.args.get('type') or None
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = map_layer_etag(request.path, point_type, 'gzip' if use_gzip else 'identity')
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    chunks = logic.iter_map_layer_geojson(point_type)
+    response = Response(
+        stream_with_context(gzip_stream(chunks) if use_gzip else chunks),
+        mimetype='application/geo+json'
+    )
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return with_etag(response, etag)
+
+@app.route('/api/map/clusters')
+def api_map_clusters():
+    etag = map_layer_etag(request.path, request.query_string)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    result = logic.get_map_clusters_logic(
+        request.args.get('bbox'), request.args.get('zoom'), request.args.get('type')
+    )
+    if result['status'] != 'success':
+        return jsonify(result), 400
+    return with_etag(jsonify(result), etag)
+
+@app.route('/api/map/nearest')
+def api_map_nearest():
+    result = logic.get_nearest_map_points_logic(
+        request.args.get('lat'), request.args.get('lng'),
+        request.args.get('k', 5), request.args.get('type')
+    )
+    if result['status'] != 'success':
+        return jsonify(result), 400
+    return jsonify(result)
 
 @app.route('/map/add', methods=['GET', 'POST'])
 @login_required
@@ -950,6 +1114,7 @@ def add_map_point():
     return render_template('add_map_point.html')
 
 @app.route('/save_map_point', methods=['POST'])
+@rate_limited('save_map_point')
 def save_map_point():
     if request.method == 'POST':
         data = request.json
@@ -959,7 +1124,7 @@ def save_map_point():
             'point_type': data.get('point_type'),
             'latitude': data.get('latitude'),
             'longitude': data.get('longitude'),
-            'added_by': session.get('name', 'Anonymous'),
+            'added_by': (current_entity() or {}).get('name', 'Anonymous'),
             'creator_id': session.get('entity_id', 1)
         }
         
@@ -1059,9 +1224,10 @@ def admin_login():
         
         if result['status'] == 'success':
             session.clear()
+            session.rotate()
             session['entity_type'] = 'admin'
             session['admin_id'] = result['admin_id']
-            session['name'] = result['name']
+            session['name'] = result['name']  # admins have no cached row, the name is all the navbar needs
             
             flash("¡Inicio de sesión de administrador exitoso!", "success")
             return redirect(url_for('admin_dashboard'))
@@ -1080,24 +1246,18 @@ def admin_logout():
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    users_count = logic.get_users_count()
-    orgs_count = logic.get_orgs_count()
-    events_count = logic.get_events_count()
-    items_count = logic.get_items_count()
-    
-    all_users = logic.users_view()
-    all_orgs = logic.orgs_view()
-    
-    top_orgs = logic.get_top_orgs_by_points(limit=5)
-
-    return render_template('admin/dashboard.html',
-                          users_count=users_count,
-                          orgs_count=orgs_count,
-                          events_count=events_count,
-                          items_count=items_count,
-                          all_users=all_users,
-                          all_orgs=all_orgs,
-                          top_orgs=top_orgs)
+    result = logic.get_admin_stats_logic(
+        top_n=5,
+        users_before=request.args.get('users_before', type=int),
+        users_after=request.args.get('users_after', type=int),
+        orgs_before=request.args.get('orgs_before', type=int),
+        orgs_after=request.args.get('orgs_after', type=int),
+        page_size=10
+    )
+    if result['status'] != 'success':
+        flash(result['message'], result['status'])
+        return render_template('admin/dashboard.html', stats=None)
+    return render_template('admin/dashboard.html', stats=result['data'])
 
 @app.route('/admin/users')
 @admin_required
@@ -1258,38 +1418,230 @@ def admin_delete_achievement(achievement_id):
 @app.route('/admin/stats')
 @admin_required
 def admin_stats():
-    stats = {
-        'total_users': logic.get_users_count(),
-        'total_orgs': logic.get_orgs_count(),
-        'total_events': logic.get_events_count(),
-        'total_items': logic.get_items_count(),
-        'users': logic.users_view(),
-        'orgs': logic.orgs_view(),
-        'top_orgs': logic.get_top_orgs_by_points(limit=10)
-    }
-    
-    return render_template('admin/stats.html', stats=stats)
+    result = logic.get_admin_stats_logic(
+        top_n=10,
+        users_before=request.args.get('users_before', type=int),
+        users_after=request.args.get('users_after', type=int),
+        orgs_before=request.args.get('orgs_before', type=int),
+        orgs_after=request.args.get('orgs_after', type=int),
+        page_size=50
+    )
+    if result['status'] != 'success':
+        flash(result['message'], result['status'])
+        return redirect(url_for('admin_dashboard'))
+    return render_template('admin/stats.html', stats=result['data'])
+
+@app.route('/admin/stats/refresh', methods=['POST'])
+@admin_required
+def admin_refresh_stats():
+    result = logic.refresh_stats_snapshot_logic()
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_stats'))
+
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    return render_template('admin/analytics.html',
+                           metrics=analytics.METRICS,
+                           granularities=list(analytics.GRANULARITIES))
+
+@app.route('/admin/api/analytics/<metric>')
+@admin_required
+def admin_analytics_series(metric):
+    """Chart data of one metric, read from the activity rollups (see analytics.py)."""
+    result = logic.get_activity_analytics_logic(
+        metric,
+        granularity=request.args.get('granularity', 'day'),
+        days=request.args.get('days', 30, type=int)
+    )
+    if result['status'] != 'success':
+        return jsonify(result), 400
+    return jsonify(result)
+
+@app.route('/admin/export')
+@admin_required
+def admin_exports():
+    result = logic.get_export_options_logic()
+    return render_template('admin/exports.html', options=result['data'])
+
+@app.route('/admin/export/<dataset>')
+@admin_required
+def admin_export_dataset(dataset):
+    """Streams a dataset as CSV or Parquet, never holding more than one batch in memory."""
+    columns = [column.strip() for value in request.args.getlist('columns') for column in value.split(',') if column.strip()]
+    result = logic.export_dataset_logic(
+        dataset,
+        fmt=request.args.get('format', 'csv'),
+        columns=columns,
+        since=request.args.get('since'),
+        until=request.args.get('until')
+    )
+    if result['status'] != 'success':
+        flash(result['message'], result['status'])
+        return redirect(url_for('admin_exports'))
+    export = result['data']
+    response = Response(stream_with_context(export['chunks']), mimetype=export['mimetype'])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export["filename"]}"'
+    return response
 
 @app.route('/admin/update_org_points', methods=['GET', 'POST'])
 @admin_required
 def admin_update_org_points():
     if request.method == 'POST':
-        result = logic.update_org_points_from_members_logic()
+        # Recomputing every organization is slow, the scheduler runs it in the background
+        result = logic.run_job_logic('org_points')
         flash(result['message'], result['status'])
-        
-        if result['status'] == 'success' and 'updated_orgs' in result:
-            updated_orgs = result['updated_orgs']
-            return render_template('admin/org_points_updated.html', updated_orgs=updated_orgs)
+        return redirect(url_for('admin_jobs'))
         
     return render_template('admin/update_org_points.html')
 
+@app.route('/admin/jobs')
+@admin_required
+def admin_jobs():
+    result = logic.get_jobs_logic()
+    if result['status'] != 'success':
+        flash(result['message'], result['status'])
+        return redirect(url_for('admin_dashboard'))
+    return render_template('admin/jobs.html', jobs=result['data'])
+
+@app.route('/admin/api/jobs')
+@admin_required
+def admin_jobs_status():
+    """Job states and progress, polled by the admin jobs page."""
+    result = logic.get_jobs_logic()
+    if result['status'] != 'success':
+        return jsonify(result), 500
+    return jsonify(result)
+
+@app.route('/admin/jobs/<job_name>/run', methods=['POST'])
+@admin_required
+def admin_run_job(job_name):
+    result = logic.run_job_logic(job_name)
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_jobs'))
+
+@app.route('/admin/moderation', methods=['GET', 'POST'])
+@admin_required
+def admin_moderation():
+    if request.method == 'POST':
+        term = request.form.get('term', '')
+        action = request.form.get('action', 'mask')
+        result = logic.admin_add_moderation_term_logic(term, action)
+        flash(result['message'], result['status'])
+        return redirect(url_for('admin_moderation'))
+
+    result = logic.admin_get_moderation_terms_logic()
+    return render_template('admin/moderation.html', terms=result.get('data', []))
+
+@app.route('/admin/moderation/<int:term_id>/delete', methods=['POST'])
+@admin_required
+def admin_delete_moderation_term(term_id):
+    result = logic.admin_delete_moderation_term_logic(term_id)
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_moderation'))
+
+@app.route('/admin/users/import', methods=['GET', 'POST'])
+@admin_required
+def admin_import_users():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            flash("Selecciona un archivo para importar.", "error")
+            return redirect(url_for('admin_import_users'))
+        result = logic.admin_import_users_logic(upload.stream, upload.filename)
+        flash(result['message'], result['status'])
+        # The report is rendered right away, it is too big for the session
+        return render_template('admin/import_users.html', **result.get('data', {}))
+
+    return render_template('admin/import_users.html')
+
+@app.route('/admin/campus-places', methods=['GET', 'POST'])
+@admin_required
+def admin_campus_places():
+    if request.method == 'POST':
+        result = logic.admin_add_campus_place_logic(
+            request.form.get('name', ''),
+            request.form.get('latitude'),
+            request.form.get('longitude')
+        )
+        flash(result['message'], result['status'])
+        return redirect(url_for('admin_campus_places'))
+
+    result = logic.admin_get_campus_places_logic()
+    return render_template('admin/campus_places.html', places=result.get('data', []))
+
+@app.route('/admin/campus-places/<int:place_id>/delete', methods=['POST'])
+@admin_required
+def admin_delete_campus_place(place_id):
+    result = logic.admin_delete_campus_place_logic(place_id)
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_campus_places'))
+
+@app.route('/admin/moderation/reload', methods=['POST'])
+@admin_required
+def admin_reload_moderation():
+    result = logic.admin_reload_moderation_logic()
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_moderation'))
+
+@app.route('/admin/map/dedupe', methods=['POST'])
+@admin_required
+def admin_dedupe_map_points():
+    dry_run = request.form.get('apply') != '1'
+    result = logic.dedupe_map_points_logic(request.form.get('radius_m') or None, dry_run=dry_run)
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/heatmap')
+@admin_required
+def admin_heatmap():
+    return render_template('admin/heatmap.html',
+                           windows=list(heatmap.HEATMAP_WINDOWS),
+                           layers=heatmap.HEATMAP_LAYERS,
+                           min_zoom=heatmap.HEATMAP_MIN_ZOOM,
+                           max_zoom=heatmap.HEATMAP_MAX_ZOOM)
+
+@app.route('/admin/api/heatmap/<time_window>/<layer>/<int:zoom>/<int:tile_x>/<int:tile_y>')
+@admin_required
+def admin_heatmap_tile(time_window, layer, zoom, tile_x, tile_y):
+    """One density tile as a small JSON array, only re-sent after a rebuild."""
+    cached = not_modified(heatmap_etag(request.path))
+    if cached:
+        return cached
+    result = logic.get_heatmap_tile_logic(time_window, layer, zoom, tile_x, tile_y)
+    if result['status'] == 'info':
+        # Not built yet, the job is queued: no ETag so the tile is fetched again
+        return jsonify(result), 202
+    if result['status'] != 'success':
+        return jsonify(result), 400
+    return with_etag(jsonify(result), heatmap_etag(request.path))
+
+@app.route('/admin/heatmap/rebuild', methods=['POST'])
+@admin_required
+def admin_rebuild_heatmap():
+    # Binning every window and zoom is slow, the scheduler runs it in the background
+    result = logic.run_job_logic('heatmap')
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_jobs'))
+
+@app.route('/admin/api/password-pool')
+@admin_required
+def admin_password_pool_stats():
+    """Queue wait and run time of the password hashing pool of this worker (see passwords.py)."""
+    return jsonify(logic.get_password_pool_stats_logic())
+
+@app.route('/admin/messages/archive', methods=['POST'])
+@admin_required
+def admin_archive_messages():
+    result = logic.archive_messages_logic(request.form.get('max_age_days') or None)
+    flash(result['message'], result['status'])
+    return redirect(url_for('admin_dashboard'))
+
 @app.route('/index_prueba_messages')
 def chat_test():
     session.clear()
     session['entity_id'] = 1
     session['entity_type'] = 'user'
-    session['name'] = f'Usuario Temporal {1}'
-    session.modified = True
     print(f"[Workaround] Sesión establecida manualmente para user_id: {1}")
     current_user_id = session.get('entity_id')
     return render_template('index_prueba_messages.html', current_user_id=current_user_id)
@@ -1311,14 +1663,58 @@ def view_user_profile(user_id):
                            user_orgs=user_orgs,
                            points=points)
 
+# --- Notification Routes ---
+
+@app.route('/notifications')
+@user_login_required
+def view_notifications():
+    before_id = request.args.get('before_id', type=int)
+    result = logic.get_notifications_logic(session['entity_id'], before_id=before_id)
+    if request.args.get('format') == 'json':
+        return jsonify(result)
+    return render_template('notifications.html',
+                           notifications=result['data'],
+                           next_before_id=result['next_before_id'])
+
+@app.route('/notifications/read', methods=['POST'])
+@user_login_required
+def mark_notifications_read():
+    if request.is_json:
+        ids = (request.get_json(silent=True) or {}).get('notification_ids')
+        return jsonify(logic.mark_notifications_read_logic(session['entity_id'], ids))
+    result = logic.mark_notifications_read_logic(session['entity_id'])
+    flash(result['message'], result['status'])
+    return redirect(url_for('view_notifications'))
+
+@app.route('/chat/search')
+@login_required
+def search_messages():
+    if 'entity_id' not in session:
+        # Admin sessions have no chats to search
+        flash("Los administradores no tienen chats para buscar.", "info")
+        return redirect(url_for('admin_dashboard'))
+    q = request.args.get('q', '')
+    before_id = request.args.get('before_id', type=int)
+    result = logic.search_messages_logic(session['entity_id'], session['entity_type'], q, before_id=before_id)
+    if q and result['status'] != 'success':
+        flash(result['message'], result['status'])
+    return render_template(
+        'search_messages.html',
+        results=result.get('data', []),
+        next_before_id=result.get('next_before_id'),
+        query=q
+    )
+
 @app.route('/chat/<int:user_id>')
 @login_required
 def private_chat(user_id):
     my_id = session['entity_id']
+    # before_id lets a search result open the chat right at that message
     msgs = logic.get_conversation_logic(
         my_id, session['entity_type'],
         user_id, 'user',
-        limit=50
+        limit=50,
+        before_id=request.args.get('before_id', type=int)
     ).get('data', [])
 
     recipient = logic.get_entity_by_id(user_id, 'user').get('data', {})
@@ -1331,6 +1727,19 @@ def private_chat(user_id):
         messages=msgs
     )
 
+@app.route('/chat/<int:user_id>/messages')
+@login_required
+def private_chat_history(user_id):
+    """Older messages for the "load older" button (keyset pagination on message_id)."""
+    before_id = request.args.get('before_id', type=int)
+    result = logic.get_conversation_logic(
+        session['entity_id'], session['entity_type'],
+        user_id, 'user',
+        limit=50,
+        before_id=before_id
+    )
+    return jsonify(result)
+
 if __name__ == '__main__':
     import db_conn
     print("Setting up database...")
@@ -0,0 +1,57 @@
+'''Background flushing of queued Socket.IO events, shared by notifications.py and map_live.py'''
+'''
+A module that batches events keeps its own queue and flush() function, and
+hands both timing and the background task to one BatchingEmitter:
+
+    _emitter = batching.BatchingEmitter("Map live", FLUSH_INTERVAL)
+
+    def init(socketio):
+        _emitter.init(socketio, flush)
+
+    def point_added(point):
+        with _lock:
+            _added[point['id']] = point
+        _emitter.queued()
+
+The first queued() call starts a Socket.IO background task that calls flush()
+every `interval` seconds, so everything queued in between reaches the browsers
+as one event. An exception in flush() is printed and the task keeps running.
+'''
+
+import threading
+
+
+class BatchingEmitter:
+    """Runs a module's flush() every `interval` seconds once something was queued."""
+
+    def __init__(self, label, interval):
+        self.label = label          # prefix of the log lines
+        self.interval = interval
+        self.socketio = None
+        self._flush = None
+        self._lock = threading.Lock()
+        self._worker_started = False
+
+    def init(self, socketio, flush):
+        """Wires the emitter to the app's SocketIO instance and the module's flush function."""
+        self.socketio = socketio
+        self._flush = flush
+
+    def queued(self):
+        """Call after queueing something, starts the flush task the first time."""
+        if self.socketio is None:
+            return
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+        self.socketio.start_background_task(self._flush_loop)
+
+    def _flush_loop(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self._flush()
+            except Exception as e:
+                # Keep the worker alive, the next flush or a reconnect catches up
+                print(f"{self.label}: error flushing queue: {e}")
@@ -0,0 +1,79 @@
+'''Snapshot of the achievement and challenge catalogs (db_operator.search_achievements / search_challenges)'''
+'''
+The four catalog tables (achievements_for_users / _orgs, challenges_for_users /
+_orgs) only change when an admin edits them, but they are read on every
+/achievements and /challenges view and on every points award.
+
+Each process keeps one snapshot of the catalogs, stamped with the 'catalog'
+row of change_counters. Triggers on the four tables bump that row on every
+write (see db_conn.py), whoever the writer is, so a worker notices an edit
+made by another one on its next check. The check is a single-row read, done
+at most once per Flask request (flask.g) or once per call outside of Flask.
+
+The snapshot holds tuples of rows and is never modified: a new version
+replaces it. Callers get copies, so they can modify them freely.
+'''
+
+import threading
+from flask import g, has_app_context
+
+_snapshot = {'version': None, 'catalogs': {}}  # catalogs: (kind, user_type) -> tuple of rows
+_lock = threading.Lock()
+
+
+def _current_version(version_loader):
+    """The catalog version, read once per request."""
+    if has_app_context():
+        if 'catalog_version' not in g:
+            g.catalog_version = version_loader()
+        return g.catalog_version
+    return version_loader()
+
+
+def get(kind, user_type, loader, version_loader):
+    """
+    Returns a catalog, loading it with loader(user_type) when the snapshot is missing or outdated.
+
+    Args:
+        kind (str): 'achievements' or 'challenges'.
+        user_type (str): 'user' or 'org'.
+        loader (callable): Reads the catalog from the database, returns a list of dicts or None on error.
+        version_loader (callable): Returns the current catalog version, None on error.
+
+    Returns:
+        list: Copies of the catalog rows.
+    """
+    version = _current_version(version_loader)
+    if version is None:
+        # Can't tell if the snapshot is current, read the table directly
+        return loader(user_type) or []
+
+    key = (kind, user_type)
+    with _lock:
+        if _snapshot['version'] == version and key in _snapshot['catalogs']:
+            rows = _snapshot['catalogs'][key]
+        else:
+            rows = None
+
+    if rows is None:
+        # The version was read before the rows, so a concurrent edit only causes one extra reload
+        rows = loader(user_type)
+        if rows is None:
+            return []
+        rows = tuple(rows)
+        with _lock:
+            if _snapshot['version'] != version:
+                _snapshot['version'] = version
+                _snapshot['catalogs'] = {}
+            _snapshot['catalogs'][key] = rows
+
+    return [dict(row) for row in rows]
+
+
+def invalidate():
+    """Drops the snapshot after a catalog write of this process, the triggers tell the other ones."""
+    with _lock:
+        _snapshot['version'] = None
+        _snapshot['catalogs'] = {}
+    if has_app_context():
+        g.pop('catalog_version', None)
@@ -8,24 +8,83 @@ exchange_status: pending, accepted, rejected
 item_type: --ropa, libros, hogar, otros
 item_terms: --regalo, intercambio
 item_status: --available, borrowed, unavailable
-challenge_status: active, completed
+challenge_status: active, completed, expired
+moderation action: mask, reject
+notification_type: exchange_request, exchange_accepted, exchange_rejected, event_registration, achievement_unlocked
 datetime format ISO 8601 YYYY-MM-DD HH:MM:SS
 '''
 
 import sqlite3
 import os
+#CUSTOM MODULES
+import profiling
+
+# Banned terms the moderation_terms table starts with (see moderation.py)
+DEFAULT_MODERATION_TERMS = [
+    ('bit.ly', 'reject'),
+    ('tinyurl.com', 'reject'),
+    ('goo.gl', 'reject'),
+    ('t.ly', 'reject'),
+    ('idiota', 'mask'),
+    ('estupido', 'mask'),
+    ('imbecil', 'mask'),
+]
+
+# Absolute path of the database file, COMUNIDAD_VERDE_DB points elsewhere (e.g. a test database)
+DB_PATH = os.environ.get(
+    'COMUNIDAD_VERDE_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comunidad_verde.db')
+)
 
 def create_connection():
     conn = None
     try:
-        # Use absolute path for the database file
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comunidad_verde.db')
-        conn = sqlite3.connect(db_path)
+        db_path = DB_PATH
+        # profiling.Connection counts connections, statements and DB time per request
+        conn = sqlite3.connect(db_path, factory=profiling.Connection)
         print(f"Database created/connected at: {db_path}")
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
     return conn
 
+ARCHIVE_DB_PATH = os.environ.get(
+    'MESSAGE_ARCHIVE_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'comunidad_verde_archive.db')
+)
+
+def attach_archive(conn):
+    """
+    Attaches the cold message archive as schema 'archive' on an open connection
+    and creates its table if needed. Returns True on success.
+    """
+    try:
+        cursor = conn.cursor()
+        databases = [row[1] for row in cursor.execute("PRAGMA database_list").fetchall()]
+        if 'archive' not in databases:
+            cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+        # Each row is a zlib-compressed JSON list of messages from one conversation
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.message_archive_chunks (
+            chunk_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_key TEXT NOT NULL, -- 'user:1|user:2' (sorted pair) or 'org:5'
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            first_timestamp TEXT,
+            last_timestamp TEXT,
+            message_count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_date TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_chunks_conversation
+        ON message_archive_chunks (conversation_key, last_message_id)
+        ''')
+        return True
+    except sqlite3.Error as e:
+        print(f"Error attaching message archive: {e}")
+        return False
+
 def setup_database():
     """
     Creates all necessary tables in the database if they don't exist.
@@ -67,7 +126,8 @@ def setup_database():
                 email TEXT UNIQUE NOT NULL,
                 description TEXT,
                 interests TEXT, --siembra, reciclaje, caridad, enseñanza, software
-                points INTEGER DEFAULT 0,
+                points INTEGER DEFAULT 0, --own_points + members' points (see reconcile_org_points)
+                own_points INTEGER DEFAULT 0, --earned by the org itself: events, challenges
                 photo TEXT, --photo-org
                 creation_date TEXT DEFAULT CURRENT_TIMESTAMP
             )
@@ -87,6 +147,18 @@ def setup_database():
             )
             ''')
 
+            # Databases created before organizations kept their own points apart: whatever
+            # the org has above its members' sum was earned by the org itself
+            cursor.execute("PRAGMA table_info(organizations)")
+            if 'own_points' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE organizations ADD COLUMN own_points INTEGER DEFAULT 0")
+                cursor.execute('''
+                UPDATE organizations SET own_points = MAX(COALESCE(points, 0) - COALESCE((
+                    SELECT SUM(u.points) FROM organization_members m JOIN users u ON u.user_id = m.user_id
+                    WHERE m.org_id = organizations.org_id
+                ), 0), 0)
+                ''')
+
             # Events table
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS events (
@@ -100,10 +172,67 @@ def setup_database():
                 event_datetime TEXT NOT NULL,
                 event_status TEXT DEFAULT 'active', --active, completed
                 points_value INTEGER DEFAULT 0, --poits it gives to creators and participants
-                creation_date TEXT DEFAULT CURRENT_TIMESTAMP
+                creation_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                latitude REAL, -- NULL when the location could not be geocoded
+                longitude REAL
             )
             ''')
-            
+            # Databases created before events had coordinates
+            cursor.execute("PRAGMA table_info(events)")
+            event_columns = [column[1] for column in cursor.fetchall()]
+            for column in ('latitude', 'longitude'):
+                if column not in event_columns:
+                    cursor.execute(f"ALTER TABLE events ADD COLUMN {column} REAL")
+
+            # R*Tree over geocoded events, same layout as map_points_rtree (see search_events)
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(
+                id, -- same as events.event_id
+                min_lat, max_lat,
+                min_lng, max_lng
+            )
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS events_rtree_insert AFTER INSERT ON events
+            WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL
+            BEGIN
+                INSERT INTO events_rtree (id, min_lat, max_lat, min_lng, max_lng)
+                VALUES (new.event_id, new.latitude, new.latitude, new.longitude, new.longitude);
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS events_rtree_update AFTER UPDATE OF latitude, longitude ON events
+            BEGIN
+                DELETE FROM events_rtree WHERE id = old.event_id;
+                INSERT INTO events_rtree (id, min_lat, max_lat, min_lng, max_lng)
+                SELECT new.event_id, new.latitude, new.latitude, new.longitude, new.longitude
+                WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS events_rtree_delete AFTER DELETE ON events
+            BEGIN
+                DELETE FROM events_rtree WHERE id = old.event_id;
+            END
+            ''')
+            cursor.execute('''
+            INSERT INTO events_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT event_id, latitude, latitude, longitude, longitude FROM events
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            AND event_id NOT IN (SELECT id FROM events_rtree)
+            ''')
+
+            # Offline gazetteer: campus place names used to geocode free-text event locations
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campus_places (
+                place_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                normalized_name TEXT NOT NULL UNIQUE, -- see logic._normalize_point_name
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL
+            )
+            ''')
+
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_event_participants (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -245,7 +374,7 @@ def setup_database():
                 user_id INTEGER NOT NULL,           
                 challenge_id INTEGER NOT NULL,     
                 goal_progress INTEGER DEFAULT 0, 
-                challenge_status TEXT NOT NULL DEFAULT 'active', --active, completed
+                challenge_status TEXT NOT NULL DEFAULT 'active', --active, completed, expired
                 start_time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 deadline TEXT DEFAULT NULL,
                 date_completed TEXT DEFAULT NULL,
@@ -263,7 +392,7 @@ def setup_database():
                 org_id INTEGER NOT NULL,  
                 challenge_id INTEGER NOT NULL,    
                 goal_progress INTEGER DEFAULT 0,
-                challenge_status TEXT NOT NULL DEFAULT 'active', --active, completed
+                challenge_status TEXT NOT NULL DEFAULT 'active', --active, completed, expired
                 start_time TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
                 deadline TEXT DEFAULT NULL,
                 date_completed TEXT DEFAULT NULL,
@@ -287,10 +416,151 @@ def setup_database():
                 longitude REAL NOT NULL,
                 added_by TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                creator_id INTEGER DEFAULT 1
+                creator_id INTEGER DEFAULT 1,
+                geohash TEXT -- precision 9, duplicate detection buckets (see geo.py)
+            )
+            ''')
+            # Databases created before the geohash column existed
+            cursor.execute("PRAGMA table_info(map_points)")
+            if 'geohash' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE map_points ADD COLUMN geohash TEXT")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_map_points_geohash ON map_points (geohash)")
+
+
+            # R*Tree over map point coordinates, kept in sync by triggers (see get_map_points_in_bbox)
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS map_points_rtree USING rtree(
+                id, -- same as map_points.id
+                min_lat, max_lat,
+                min_lng, max_lng
+            )
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS map_points_rtree_insert AFTER INSERT ON map_points
+            BEGIN
+                INSERT INTO map_points_rtree (id, min_lat, max_lat, min_lng, max_lng)
+                VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS map_points_rtree_update AFTER UPDATE OF latitude, longitude ON map_points
+            BEGIN
+                UPDATE map_points_rtree
+                SET min_lat = new.latitude, max_lat = new.latitude, min_lng = new.longitude, max_lng = new.longitude
+                WHERE id = new.id;
+            END
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS map_points_rtree_delete AFTER DELETE ON map_points
+            BEGIN
+                DELETE FROM map_points_rtree WHERE id = old.id;
+            END
+            ''')
+            # Backfill points created before the index existed
+            cursor.execute('''
+            INSERT INTO map_points_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT id, latitude, latitude, longitude, longitude FROM map_points
+            WHERE id NOT IN (SELECT id FROM map_points_rtree)
+            ''')
+
+            # Change counters: bumped by triggers on every write, used as cache versions / ETags
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_counters (
+                name TEXT PRIMARY KEY, -- table name, e.g. 'map_points'
+                version INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            cursor.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('map_points', 0)")
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS map_points_version_{event.lower()} AFTER {event} ON map_points
+                BEGIN
+                    UPDATE change_counters SET version = version + 1 WHERE name = 'map_points';
+                END
+                ''')
+
+            # Achievement and challenge catalogs: a single version for the four tables (catalog_cache.py)
+            cursor.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('catalog', 0)")
+            for table in ('achievements_for_users', 'achievements_for_orgs', 'challenges_for_users', 'challenges_for_orgs'):
+                for event in ('INSERT', 'UPDATE', 'DELETE'):
+                    cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS catalog_version_{table}_{event.lower()} AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE change_counters SET version = version + 1 WHERE name = 'catalog';
+                    END
+                    ''')
+
+            # Admin dashboard snapshot (stats_snapshot.py): row counts kept by triggers,
+            # top-N lists rewritten by the periodic refresh
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT PRIMARY KEY, -- users, orgs, events, items
+                value INTEGER NOT NULL DEFAULT 0
             )
             ''')
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_snapshot (
+                name TEXT PRIMARY KEY, -- top_orgs, top_users
+                data TEXT NOT NULL, -- JSON list of rows
+                refreshed_at TEXT NOT NULL
+            )
+            ''')
+            stats_tables = {
+                'users': ('users', "WHEN new.user_type != 'admin'", "WHEN old.user_type != 'admin'", "WHERE user_type != 'admin'"),
+                'orgs': ('organizations', '', '', ''),
+                'events': ('events', '', '', ''),
+                'items': ('items', '', '', ''),
+            }
+            for metric, (table, insert_when, delete_when, where) in stats_tables.items():
+                # Seeded once from the table, the triggers keep it exact from then on
+                cursor.execute(f"INSERT OR IGNORE INTO stats_counters (name, value) SELECT '{metric}', COUNT(*) FROM {table} {where}")
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS stats_{metric}_insert AFTER INSERT ON {table} {insert_when}
+                BEGIN
+                    UPDATE stats_counters SET value = value + 1 WHERE name = '{metric}';
+                END
+                ''')
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS stats_{metric}_delete AFTER DELETE ON {table} {delete_when}
+                BEGIN
+                    UPDATE stats_counters SET value = value - 1 WHERE name = '{metric}';
+                END
+                ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_points ON users (points)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_organizations_points ON organizations (points)")
+
+            # Cluster pyramid: per zoom level and grid cell, how many points and their
+            # coordinate sums (centroid = sum / count). Written by db_operator in the same
+            # transaction as every map_points insert and delete
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS map_point_clusters (
+                zoom INTEGER NOT NULL,
+                cell_x INTEGER NOT NULL,
+                cell_y INTEGER NOT NULL,
+                point_type TEXT NOT NULL,
+                point_count INTEGER NOT NULL DEFAULT 0,
+                sum_lat REAL NOT NULL DEFAULT 0,
+                sum_lng REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (zoom, cell_x, cell_y, point_type)
+            ) WITHOUT ROWID
+            ''')
 
+            # Admin heatmap rasters precomputed by heatmap.py: one row per non-empty tile,
+            # data is the zlib-compressed uint8 HEATMAP_TILE_SIZE x HEATMAP_TILE_SIZE grid
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS heatmap_tiles (
+                time_window TEXT NOT NULL, -- 7d, 30d, 365d, all
+                layer TEXT NOT NULL, -- points, events, activity
+                zoom INTEGER NOT NULL,
+                tile_x INTEGER NOT NULL,
+                tile_y INTEGER NOT NULL,
+                zoom_max REAL NOT NULL, -- raw density of a 255 cell at this zoom, for the legend
+                data BLOB NOT NULL,
+                PRIMARY KEY (time_window, layer, zoom, tile_x, tile_y)
+            ) WITHOUT ROWID
+            ''')
+            # Bumped on every rebuild, heatmap tile ETags
+            cursor.execute("INSERT OR IGNORE INTO change_counters (name, version) VALUES ('heatmap', 0)")
 
             # Messages table
             cursor.execute('''
@@ -305,7 +575,246 @@ def setup_database():
                 is_read BOOLEAN DEFAULT 0
             )
             ''')
-        
+
+            # Keep the hot messages table cheap to page through (see archive_old_messages)
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_private
+            ON messages (sender_id, sender_type, recipient_id, recipient_type, message_id)
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_group
+            ON messages (recipient_type, recipient_id, message_id)
+            ''')
+
+            # Full-text index over chat content (see search_messages in db_operator).
+            # participants holds the tokens allowed to see the message:
+            # 'user1 user2' for a private chat, 'grp5' for the org 5 group room.
+            # There is no delete trigger on purpose: archived messages stay searchable.
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                participants,
+                sender_id UNINDEXED,
+                sender_type UNINDEXED,
+                recipient_id UNINDEXED,
+                recipient_type UNINDEXED,
+                timestamp UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            ''')
+            cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO messages_fts (rowid, content, participants, sender_id, sender_type, recipient_id, recipient_type, timestamp)
+                VALUES (
+                    new.message_id, new.content,
+                    CASE WHEN new.recipient_type = 'org' THEN 'grp' || new.recipient_id
+                         ELSE new.sender_type || new.sender_id || ' ' || new.recipient_type || new.recipient_id END,
+                    new.sender_id, new.sender_type, new.recipient_id, new.recipient_type, new.timestamp
+                );
+            END
+            ''')
+            # Backfill once for messages written before the index existed
+            cursor.execute("SELECT 1 FROM messages_fts LIMIT 1")
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                INSERT INTO messages_fts (rowid, content, participants, sender_id, sender_type, recipient_id, recipient_type, timestamp)
+                SELECT message_id, content,
+                       CASE WHEN recipient_type = 'org' THEN 'grp' || recipient_id
+                            ELSE sender_type || sender_id || ' ' || recipient_type || recipient_id END,
+                       sender_id, sender_type, recipient_id, recipient_type, timestamp
+                FROM messages
+                ''')
+
+            # Notifications table (written by notifications.py)
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notifications (
+                notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                notification_type TEXT NOT NULL, --exchange_request, exchange_accepted, exchange_rejected, event_registration, achievement_unlocked
+                message TEXT NOT NULL,
+                link TEXT,
+                is_read BOOLEAN DEFAULT 0,
+                is_delivered BOOLEAN DEFAULT 0, --pushed over Socket.IO
+                creation_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+            )
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notifications_user
+            ON notifications (user_id, notification_id)
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_notifications_undelivered
+            ON notifications (user_id) WHERE is_delivered = 0
+            ''')
+
+            # Unread notifications per user, kept in step with notifications.is_read
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_counters (
+                user_id INTEGER PRIMARY KEY,
+                unread_count INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+
+            # Moderation terms table (compiled by moderation.py)
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'moderation_terms'")
+            seed_moderation_terms = cursor.fetchone() is None
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS moderation_terms (
+                term_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                term TEXT UNIQUE NOT NULL,
+                action TEXT NOT NULL DEFAULT 'mask', --mask, reject
+                creation_date TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            # Starting list, only when the table is created: afterwards the admins own it,
+            # and deleting every term leaves the filter empty
+            if seed_moderation_terms:
+                cursor.executemany("INSERT INTO moderation_terms (term, action) VALUES (?, ?)", DEFAULT_MODERATION_TERMS)
+
+            # Outgoing mail queue (sent in batches by outbox.py, the request path only inserts)
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                email_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                html TEXT,
+                status TEXT NOT NULL DEFAULT 'pending', --pending, sending, sent, failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                claim_token TEXT, --sender that is sending it
+                claimed_at TEXT,
+                last_error TEXT,
+                creation_date TEXT DEFAULT CURRENT_TIMESTAMP,
+                sent_at TEXT
+            )
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+            ON email_outbox (next_attempt_at) WHERE status IN ('pending', 'sending')
+            ''')
+
+            # Activity rollups (analytics.py): how many times something happened per hour and per
+            # day, written by triggers in the same transaction as the write itself.
+            # bucket: 'YYYY-MM-DD HH' (hourly) or 'YYYY-MM-DD' (daily); weeks are summed from days
+            for rollup in ('activity_rollup_hourly', 'activity_rollup_daily'):
+                cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {rollup} (
+                    metric TEXT NOT NULL, -- signups, events, items_listed, items_exchanged, messages
+                    bucket TEXT NOT NULL,
+                    dimension TEXT NOT NULL, -- user/org, event_type, item_type, org_id
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, bucket, dimension)
+                ) WITHOUT ROWID
+                ''')
+            # name: (table, trigger event and condition, metric, dimension, timestamp, backfill filter)
+            # {row} is 'new.' inside the trigger and '' in the backfill. timestamp can be a pair
+            # (trigger, backfill) when the row has no UTC time of the event
+            rollup_sources = {
+                'users': ('users', "INSERT ON users WHEN new.user_type != 'admin'",
+                          'signups', "'user'", "{row}creation_date", "user_type != 'admin'"),
+                'orgs': ('organizations', "INSERT ON organizations",
+                         'signups', "'org'", "{row}creation_date", "1"),
+                'events': ('events', "INSERT ON events",
+                           'events', "{row}event_type", "{row}creation_date", "1"),
+                'items': ('items', "INSERT ON items",
+                          'items_listed', "{row}item_type", "{row}creation_date", "1"),
+                'exchanges': ('exchange_requests',
+                              "UPDATE OF exchange_status ON exchange_requests "
+                              "WHEN new.exchange_status = 'accepted' AND old.exchange_status != 'accepted'",
+                              'items_exchanged',
+                              "COALESCE((SELECT item_type FROM items WHERE items.item_id = {row}item_id), 'otros')",
+                              # decision_date is local time (db_operator writes datetime.now()), the
+                              # accept itself is bucketed by the UTC clock like every other source
+                              ("'now'", "decision_date"), "exchange_status = 'accepted'"),
+                # Group rooms are recipient_type 'org', but senders are typed from the session: 'organization'
+                'messages': ('messages',
+                             "INSERT ON messages WHEN new.recipient_type = 'org' OR new.sender_type IN ('org', 'organization')",
+                             'messages',
+                             "CAST(CASE WHEN {row}recipient_type = 'org' THEN {row}recipient_id ELSE {row}sender_id END AS TEXT)",
+                             "{row}timestamp", "recipient_type = 'org' OR sender_type IN ('org', 'organization')"),
+            }
+            rollup_formats = {'activity_rollup_hourly': '%Y-%m-%d %H', 'activity_rollup_daily': '%Y-%m-%d'}
+            cursor.execute("SELECT 1 FROM activity_rollup_daily LIMIT 1")
+            backfill_rollups = cursor.fetchone() is None
+            # Triggers of older versions, kept by CREATE TRIGGER IF NOT EXISTS unless dropped:
+            # rollup_exchanges bucketed by the local decision_date, rollup_messages only
+            # matched sender_type 'org' and so missed every private message sent by an organization
+            stale_rollup_triggers = {'exchanges': 'decision_date', 'messages': "new.sender_type = 'org'"}
+            replaced_rollups = set()
+            for name, marker in stale_rollup_triggers.items():
+                cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"rollup_{name}",))
+                row = cursor.fetchone()
+                if row and marker in row[0]:
+                    cursor.execute(f"DROP TRIGGER rollup_{name}")
+                    replaced_rollups.add(name)
+            if 'messages' in replaced_rollups and not backfill_rollups:
+                # Count the organization messages the old trigger skipped
+                for rollup, fmt in rollup_formats.items():
+                    cursor.execute(f'''
+                    INSERT INTO {rollup} (metric, bucket, dimension, value)
+                    SELECT 'messages', COALESCE(strftime('{fmt}', timestamp), strftime('{fmt}', 'now')),
+                           CAST(sender_id AS TEXT), COUNT(*)
+                    FROM messages WHERE sender_type = 'organization' AND recipient_type != 'org' GROUP BY 2, 3
+                    ON CONFLICT (metric, bucket, dimension) DO UPDATE SET value = value + excluded.value
+                    ''')
+            for name, (table, trigger_on, metric, dimension, timestamp, backfill_where) in rollup_sources.items():
+                trigger_timestamp, backfill_timestamp = timestamp if isinstance(timestamp, tuple) else (timestamp, timestamp)
+                upserts = []
+                for rollup, fmt in rollup_formats.items():
+                    # An unreadable timestamp counts as now rather than failing the write
+                    bucket = "COALESCE(strftime('{fmt}', {timestamp}), strftime('{fmt}', 'now'))"
+                    trigger_bucket = bucket.format(fmt=fmt, timestamp=trigger_timestamp.format(row='new.'))
+                    backfill_bucket = bucket.format(fmt=fmt, timestamp=backfill_timestamp.format(row=''))
+                    upserts.append(f'''
+                    INSERT INTO {rollup} (metric, bucket, dimension, value)
+                    VALUES ('{metric}', {trigger_bucket}, {dimension.format(row='new.')}, 1)
+                    ON CONFLICT (metric, bucket, dimension) DO UPDATE SET value = value + 1;''')
+                    if backfill_rollups:
+                        cursor.execute(f'''
+                        INSERT INTO {rollup} (metric, bucket, dimension, value)
+                        SELECT '{metric}', {backfill_bucket}, {dimension.format(row='')}, COUNT(*)
+                        FROM {table} WHERE {backfill_where} GROUP BY 2, 3
+                        ON CONFLICT (metric, bucket, dimension) DO UPDATE SET value = value + excluded.value
+                        ''')
+                cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS rollup_{name} AFTER {trigger_on}
+                BEGIN{''.join(upserts)}
+                END
+                ''')
+
+            # Background jobs (scheduler.py): one row per job, shared by every worker.
+            # lock_owner / lock_expires_at is a lease: only the worker holding it runs the job
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                job_name TEXT PRIMARY KEY,
+                interval_seconds INTEGER, --NULL = one-off, runs only when requested
+                next_run_at TEXT, --UTC, NULL = not scheduled
+                status TEXT NOT NULL DEFAULT 'idle', --idle, queued, running
+                lock_owner TEXT,
+                lock_expires_at TEXT,
+                progress_done INTEGER NOT NULL DEFAULT 0,
+                progress_total INTEGER,
+                progress_message TEXT,
+                last_started_at TEXT,
+                last_finished_at TEXT,
+                last_status TEXT, --success, error
+                last_message TEXT,
+                run_count INTEGER NOT NULL DEFAULT 0
+            )
+            ''')
+            # Challenge expiry only looks at active challenges with a deadline
+            for progress_table in ('user_challenges', 'org_challenges'):
+                cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS idx_{progress_table}_deadline
+                ON {progress_table} (deadline) WHERE challenge_status = 'active' AND deadline IS NOT NULL
+                ''')
+
+            # The FTS backfill above opens a transaction, close it so nothing is rolled back
+            conn.commit()
+
         except sqlite3.Error as e:
             print(f"Error setting up database: {e}")
         finally:
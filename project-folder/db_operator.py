@@ -1,8 +1,15 @@
 '''Data base modifications'''
 import sqlite3
 import datetime
+import html
+import json
+import math
+import zlib
 #CUSTOM MODULES
 import db_conn
+import geo
+import entity_cache
+import catalog_cache
 
 
 
@@ -34,7 +41,159 @@ def register_user(user_type, student_code, password, name, nickname, email, care
         print(f"Error registering user: {e}")
     finally:
         conn.close() 
-    return user_id is not None
+    return user_id # None on error
+
+def set_verification_token(user_id, token_hash, expires):
+    """
+    Stores the (hashed) email verification token of a user and its expiry ('YYYY-MM-DD HH:MM:SS' UTC).
+    Returns True on success.
+    """
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE users SET verification_token = ?, verification_token_expires = ?
+            WHERE user_id = ?
+            ''', (token_hash, expires, user_id))
+            conn.commit()
+            success = cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error storing verification token: {e}")
+        finally:
+            conn.close()
+    return success
+
+def verify_user_by_token(token_hash):
+    """
+    Marks as verified the user holding this unexpired token and clears the token.
+    Returns the user_id, or None if no user matches (wrong or expired token) or on error.
+    """
+    user_id = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT user_id FROM users
+            WHERE verification_token = ? AND verification_token_expires > datetime('now')
+            ''', (token_hash,))
+            row = cursor.fetchone()
+            if row:
+                user_id = row[0]
+                cursor.execute('''
+                UPDATE users SET is_verified = 1, verification_token = NULL, verification_token_expires = NULL
+                WHERE user_id = ?
+                ''', (user_id,))
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error verifying user: {e}")
+            user_id = None
+        finally:
+            conn.close()
+    return user_id
+
+def get_user_verification(email):
+    """
+    Verification state of a user found by email:
+    {'user_id', 'name', 'email', 'is_verified', 'has_token'}, None if not found or on error.
+    """
+    data = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT user_id, name, email, is_verified, verification_token IS NOT NULL
+            FROM users WHERE email = ?
+            ''', (email,))
+            row = cursor.fetchone()
+            if row:
+                data = {'user_id': row[0], 'name': row[1], 'email': row[2], 'is_verified': bool(row[3]), 'has_token': bool(row[4])}
+        except sqlite3.Error as e:
+            print(f"Error retrieving user verification: {e}")
+        finally:
+            conn.close()
+    return data
+
+def get_existing_user_keys(emails, student_codes):
+    """
+    Finds which of these emails and student codes are already registered, with one query.
+
+    Returns:
+        tuple: (set of taken emails, set of taken student codes), None on error.
+    """
+    emails, student_codes = list(emails), list(student_codes)
+    taken_emails, taken_codes = set(), set()
+    if not emails and not student_codes:
+        return taken_emails, taken_codes
+    conn = db_conn.create_connection()
+    if conn is None:
+        return None
+    try:
+        cursor = conn.cursor()
+        email_marks = ', '.join('?' * len(emails)) or 'NULL'
+        code_marks = ', '.join('?' * len(student_codes)) or 'NULL'
+        cursor.execute(f'''
+        SELECT email, student_code FROM users
+        WHERE email IN ({email_marks}) OR student_code IN ({code_marks})
+        ''', emails + student_codes)
+        for email, student_code in cursor.fetchall():
+            taken_emails.add(email)
+            taken_codes.add(student_code)
+        return taken_emails, taken_codes
+    except sqlite3.Error as e:
+        print(f"Error checking existing users: {e}")
+        return None
+    finally:
+        conn.close()
+
+def register_users_bulk(users):
+    """
+    Inserts many users in one transaction with executemany (bulk import).
+    If a row breaks a UNIQUE constraint (registered meanwhile), the chunk is
+    retried row by row so only that row fails.
+
+    Args:
+        users (list): Tuples (user_type, student_code, password, name, nickname, email, career, interests, photo).
+
+    Returns:
+        list: One bool per user, True if it was inserted.
+    """
+    results = [False] * len(users)
+    if not users:
+        return results
+    conn = db_conn.create_connection()
+    if conn is None:
+        return results
+    insert = '''
+        INSERT INTO users (user_type, student_code, password, name, nickname, email, career, interests, photo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(insert, users)
+            conn.commit()
+            results = [True] * len(users)
+        except sqlite3.IntegrityError as e:
+            conn.rollback()
+            print(f"Bulk user insert conflict, inserting one by one: {e}")
+            for index, user in enumerate(users):
+                try:
+                    cursor.execute(insert, user)
+                    results[index] = True
+                except sqlite3.IntegrityError:
+                    pass
+            conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error in bulk user insert: {e}")
+        results = [False] * len(users)
+    finally:
+        conn.close()
+    return results
 
 def update_user_profile(user_id, student_code=None, password=None, name=None, nickname=None, email=None, career=None, interests=None):
     success = False
@@ -78,6 +237,7 @@ def update_user_profile(user_id, student_code=None, password=None, name=None, ni
             cursor.execute(query, params) #both tuples and list work in sql queries.
             conn.commit()
             success = cursor.rowcount > 0 # rowcount returns how many rows were affected by the most recent SQL operation.
+            entity_cache.invalidate('user', user_id)
         except sqlite3.Error as e:
             print(f"Error updating user profile: {e}")
         finally:
@@ -92,6 +252,7 @@ def delete_my_user(student_code):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM users WHERE student_code = ?", (student_code,))
             conn.commit()
+            entity_cache.invalidate('user')  # only the student code is known here
             if cursor.rowcount > 0:
                 print(f"User successfully deleted.")
                 success = True
@@ -164,6 +325,7 @@ def update_org_profile(org_id, creator_student_code=None, password=None, name=No
             conn.commit()
             
             success = cursor.rowcount > 0
+            entity_cache.invalidate('org', org_id)
         except sqlite3.Error as e:
             print(f"Error updating organization profile: {e}")
         finally:
@@ -178,6 +340,7 @@ def delete_my_org(creator_student_code):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM organizations WHERE creator_student_code = ?", (creator_student_code,))
             conn.commit()
+            entity_cache.invalidate('org')  # only the creator code is known here
             if cursor.rowcount > 0:
                 print(f"Organization successfully deleted.")
                 success = True
@@ -226,6 +389,7 @@ def create_achievement(name, description, points_required, badge_icon, user_type
             
             conn.commit()
             achievement_id = cursor.lastrowid
+            catalog_cache.invalidate()
             
         except sqlite3.Error as e:
             print(f"Error creating achievement: {e}")
@@ -267,6 +431,7 @@ def delete_achievement(achievement_id, user_type):
             
             conn.commit()
             success = cursor.rowcount > 0
+            catalog_cache.invalidate()
             
         except sqlite3.Error as e:
             print(f"Error deleting achievement: {e}")
@@ -313,6 +478,7 @@ def create_challenge(name, description, goal_type, goal_target, points_reward, t
             
             conn.commit()
             challenge_id = cursor.lastrowid
+            catalog_cache.invalidate()
             
         except sqlite3.Error as e:
             print(f"Error creating challenge: {e}")
@@ -354,6 +520,7 @@ def delete_challenge(challenge_id, user_type):
             
             conn.commit()
             success = cursor.rowcount > 0
+            catalog_cache.invalidate()
             
         except sqlite3.Error as e:
             print(f"Error deleting challenge: {e}")
@@ -366,9 +533,12 @@ def delete_challenge(challenge_id, user_type):
 #HELPER FUNCTIONS
 def get_user_by_id(user_id):
     """
-    Retrieves user information by user ID.
+    Retrieves user information by user ID, through entity_cache.
     Returns dict with user data if found, None otherwise.
     """
+    return entity_cache.get('user', user_id, _select_user_by_id)
+
+def _select_user_by_id(user_id):
     user_data = None
     conn = db_conn.create_connection()
     if conn is not None:
@@ -412,6 +582,7 @@ def delete_user_by_id(user_id):
             WHERE user_id = ?
             ''', (user_id,))
             conn.commit()
+            entity_cache.invalidate('user', user_id)
             if cursor.rowcount > 0:
                 success = True
 
@@ -422,6 +593,13 @@ def delete_user_by_id(user_id):
     return success
 
 def get_org_by_id(org_id):
+    """
+    Retrieves organization information by org ID, through entity_cache.
+    Returns dict with org data if found, None otherwise.
+    """
+    return entity_cache.get('org', org_id, _select_org_by_id)
+
+def _select_org_by_id(org_id):
     org_data = None
     conn = db_conn.create_connection()
     if conn is not None:
@@ -466,6 +644,7 @@ def delete_org_by_id(org_id):
             ''', (org_id,))
             
             conn.commit()
+            entity_cache.invalidate('org', org_id)
             if cursor.rowcount > 0:
                 success = True
         except sqlite3.Error as e:
@@ -485,7 +664,8 @@ def get_user_by_student_code(student_code):
         try:
             cursor = conn.cursor()
             cursor.execute('''
-            SELECT user_id, user_type, student_code, name, nickname, email, password, career, interests, photo, points, creation_date, is_verified
+            SELECT user_id, user_type, student_code, name, nickname, email, password, career, interests, photo, points, creation_date, is_verified,
+                   verification_token IS NOT NULL, verification_token_expires
             FROM users
             WHERE student_code = ?
             ''', (student_code,))
@@ -504,7 +684,9 @@ def get_user_by_student_code(student_code):
                     'photo': user[9],
                     'points': user[10],
                     'creation_date': user[11],
-                    'is_verified': user[12]
+                    'is_verified': user[12],
+                    'verification_pending': bool(user[13]),
+                    'verification_token_expires': user[14]
                 }
         except sqlite3.Error as e:
             print(f"Error retrieving user by student code: {e}")
@@ -781,7 +963,7 @@ def leave_org(org_id, user_id):
     return success
 
 #EVENTS
-def search_events(event_id=None, query=None, location=None, event_type=None, event_status=None, organizer_type=None, organizer_id=None, start_date=None, end_date=None):
+def search_events(event_id=None, query=None, location=None, event_type=None, event_status=None, organizer_type=None, organizer_id=None, start_date=None, end_date=None, bbox=None):
     """
     Searches for events based on various criteria.
     
@@ -795,6 +977,8 @@ def search_events(event_id=None, query=None, location=None, event_type=None, eve
         start_date (str, optional): Filter events on or after this date (ISO format)
         end_date (str, optional): Filter events on or before this date (ISO format)
         location (str, optional): Filter by event location
+        bbox (tuple, optional): (min_lat, min_lng, max_lat, max_lng), only geocoded events
+            inside the box, through the events_rtree index. min_lng > max_lng crosses the antimeridian.
 
     Returns:
         list: List of dictionaries containing event data
@@ -808,12 +992,29 @@ def search_events(event_id=None, query=None, location=None, event_type=None, eve
             
             sql_query = '''
             SELECT event_id, organizer_id, organizer_type, name, description, 
-                   event_type, location, event_datetime, event_status, points_value, creation_date
+                   event_type, location, event_datetime, event_status, points_value, creation_date,
+                   latitude, longitude
             FROM events
             WHERE 1=1
             '''
             
             params = []
+
+            if bbox:
+                min_lat, min_lng, max_lat, max_lng = bbox
+                if min_lng <= max_lng:
+                    lng_ranges = [(min_lng, max_lng)]
+                else:
+                    lng_ranges = [(min_lng, 180.0), (-180.0, max_lng)]
+                lng_filter = ' OR '.join(['(max_lng >= ? AND min_lng <= ?)'] * len(lng_ranges))
+                sql_query += f'''
+                AND event_id IN (
+                    SELECT id FROM events_rtree
+                    WHERE max_lat >= ? AND min_lat <= ? AND ({lng_filter})
+                )'''
+                params.extend([min_lat, max_lat])
+                for range_min, range_max in lng_ranges:
+                    params.extend([range_min, range_max])
             
             if query:
                 sql_query += " AND (name LIKE ? OR description LIKE ?)"
@@ -864,7 +1065,9 @@ def search_events(event_id=None, query=None, location=None, event_type=None, eve
                     'event_datetime': row[7],
                     'event_status': row[8],
                     'points_value': row[9],
-                    'creation_date': row[10]
+                    'creation_date': row[10],
+                    'latitude': row[11],
+                    'longitude': row[12]
                 }
                 events.append(event)
                 
@@ -935,9 +1138,10 @@ def get_event_participants(event_id):
             
     return participants
 
-def create_event(organizer_id, organizer_type, name, description, event_type, location, event_datetime):
+def create_event(organizer_id, organizer_type, name, description, event_type, location, event_datetime, latitude=None, longitude=None):
     """
     Creates a new event in the system.
+    latitude/longitude are optional, geocoded events are indexed in events_rtree by a trigger.
     Returns the event_id if successful, None otherwise.
     """
     event_id = None
@@ -945,9 +1149,9 @@ def create_event(organizer_id, organizer_type, name, description, event_type, lo
     try:
         cursor = conn.cursor()
         cursor.execute('''
-        INSERT INTO events (organizer_id, organizer_type, name, description, event_type, location, event_datetime)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (organizer_id, organizer_type, name, description, event_type, location, event_datetime))
+        INSERT INTO events (organizer_id, organizer_type, name, description, event_type, location, event_datetime, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (organizer_id, organizer_type, name, description, event_type, location, event_datetime, latitude, longitude))
         conn.commit()
         event_id = cursor.lastrowid
 
@@ -1611,6 +1815,7 @@ def accept_exchange_request(exchange_id):
 def search_challenges(user_type):
     """
     Retrieves all challenges for "user" or "org" entities, depending on the user_type.
+    Served from the process snapshot of catalog_cache, refreshed when the catalog version changes.
 
     Args:
         user_type (str): Either 'user' or 'org' to specify which challenges to retrieve.
@@ -1619,6 +1824,19 @@ def search_challenges(user_type):
         list: A list of dictionaries, each containing challenge data (id, name, description, goal, reward, time).
               Returns an empty list if the user_type is invalid or an error occurs.
     """
+    return catalog_cache.get('challenges', user_type, _select_challenges, get_catalog_version)
+
+def _select_challenges(user_type):
+    """
+    Reads the challenges of "user" or "org" entities from the database.
+
+    Args:
+        user_type (str): Either 'user' or 'org' to specify which challenges to retrieve.
+
+    Returns:
+        list: A list of dictionaries, each containing challenge data (id, name, description, goal, reward, time).
+              An empty list if the user_type is invalid, None on database error.
+    """
     challenges = []
     conn = db_conn.create_connection()
 
@@ -1659,6 +1877,7 @@ def search_challenges(user_type):
 
     except sqlite3.Error as e:
         print(f"Error retrieving challenges for {user_type}: {e}")
+        challenges = None  # not cached, unlike an empty catalog
     finally:
         if conn: # Ensure conn exists before closing
             conn.close()
@@ -1880,6 +2099,7 @@ def update_challenges_progress(entity_id, user_type, challenge_id, new_progress,
 def search_achievements(user_type):
     """
     Retrieves all achievements for "user" or "org" entities, depending on the user_type.
+    Served from the process snapshot of catalog_cache, refreshed when the catalog version changes.
 
     Args:
         user_type (str)
@@ -1888,6 +2108,19 @@ def search_achievements(user_type):
         list: A list of dictionaries, each containing achievement data (id, name, description, points, icon).
               Returns an empty list if the user_type is invalid or an error occurs.
     """
+    return catalog_cache.get('achievements', user_type, _select_achievements, get_catalog_version)
+
+def _select_achievements(user_type):
+    """
+    Reads the achievements of "user" or "org" entities from the database.
+
+    Args:
+        user_type (str)
+
+    Returns:
+        list: A list of dictionaries, each containing achievement data (id, name, description, points, icon).
+              An empty list if the user_type is invalid, None on database error.
+    """
     achievements = []
     conn = db_conn.create_connection()
 
@@ -1923,6 +2156,7 @@ def search_achievements(user_type):
 
         except sqlite3.Error as e:
             print(f"Error retrieving achievements for {user_type}: {e}")
+            achievements = None  # not cached, unlike an empty catalog
         finally:
             conn.close()
 
@@ -2006,6 +2240,7 @@ def update_entity_points(entity_id, user_type, new_points):
             WHERE {id_col} = ?
         ''', (new_points, entity_id))
         conn.commit()
+        entity_cache.invalidate(user_type, entity_id)
 
     except sqlite3.Error as e:
         print(f"Database error in update_entity_points: {e}")
@@ -2017,6 +2252,33 @@ def update_entity_points(entity_id, user_type, new_points):
     
     return success
 
+def add_org_own_points(org_id, points):
+    """
+    Adds points earned by an organization itself (not through its members) to
+    both own_points and points, in one statement so concurrent awards add up.
+
+    Returns:
+        bool: True if the organization was updated.
+    """
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE organizations
+                SET own_points = COALESCE(own_points, 0) + ?, points = COALESCE(points, 0) + ?
+                WHERE org_id = ?
+            ''', (points, points, org_id))
+            conn.commit()
+            success = cursor.rowcount > 0
+            entity_cache.invalidate('org', org_id)
+        except sqlite3.Error as e:
+            print(f"Error adding organization points: {e}")
+        finally:
+            conn.close()
+    return success
+
 def update_entity_achievements(entity_id, user_type, achievement_id):
     success = None
     try:
@@ -2165,19 +2427,25 @@ def get_top_users_by_points(limit=10):
     return users
 
 #MAP FUNCTIONS
-def add_map_point(user_id, name, description, point_type, latitude, longitude, address=None):
-    success = None
+def add_map_point(user_id, name, description, point_type, latitude, longitude, address=None, geohash=None, added_by=None):
+    """
+    Adds a map point and counts it in the cluster pyramid in the same transaction.
+    Returns the id of the new point, None on error.
+    """
+    point_id = None
     conn = db_conn.create_connection()
 
     if conn is not None:
         try:
             cursor = conn.cursor()
+            # map_points has no address column; kept in the signature for existing callers
             cursor.execute('''
-                INSERT INTO map_points (creator_id, name, description, point_type, latitude, longitude, address)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, name, description, point_type, latitude, longitude, address))
+                INSERT INTO map_points (creator_id, added_by, name, description, point_type, latitude, longitude, geohash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, added_by, name, description, point_type, latitude, longitude, geohash))
+            point_id = cursor.lastrowid
+            _apply_map_point_clusters(cursor, [(latitude, longitude, point_type)], 1)
             conn.commit()
-            success = cursor.rowcount > 0
 
         except sqlite3.Error as e:
             print(f"Error adding map point: {e}")
@@ -2187,7 +2455,7 @@ def add_map_point(user_id, name, description, point_type, latitude, longitude, a
             if conn:
                 conn.close()
 
-    return success is not None
+    return point_id
 
 def delete_map_point(user_id, user_type, point_id):
     """
@@ -2212,17 +2480,20 @@ def delete_map_point(user_id, user_type, point_id):
 
     try:
         cursor = conn.cursor()
+        cursor.execute("SELECT latitude, longitude, point_type FROM map_points WHERE id = ?", (point_id,))
+        point = cursor.fetchone()
         if user_type == "admin":
             # Admin can delete any point by its ID
-            cursor.execute("DELETE FROM map_points WHERE point_id = ?", (point_id,))
+            cursor.execute("DELETE FROM map_points WHERE id = ?", (point_id,))
         else:
             # Non-admin users can only delete points they created
-            cursor.execute("DELETE FROM map_points WHERE point_id = ? AND creator_id = ?", (point_id, user_id))
-        conn.commit()
+            cursor.execute("DELETE FROM map_points WHERE id = ? AND creator_id = ?", (point_id, user_id))
         if cursor.rowcount > 0:
+            _apply_map_point_clusters(cursor, [point], -1)
             deleted = True
         else:
             print("You don't own that point.")
+        conn.commit()
     except sqlite3.Error as e:
         print(f"Error deleting map point: {e}")
         if conn:
@@ -2304,380 +2575,2438 @@ def get_map_points(point_type=None):
 
     return map_points_list
 
-def update_exchange_requests_schema():
+def get_map_point(point_id):
     """
-    Updates the exchange_requests table schema.
-    Warning: This function requires careful invocation.
+    Retrieves one map point, same fields as get_map_points_in_bbox.
+
+    Returns:
+        dict: The point, or None if it does not exist or on error.
     """
+    point = None
     conn = db_conn.create_connection()
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
-            
-            # Check if the column exists already
-            cursor.execute("PRAGMA table_info(exchange_requests)")
-            columns = cursor.fetchall()
-            column_names = [column[1] for column in columns]
-            
-            if 'requested_term' not in column_names:
-                cursor.execute("ALTER TABLE exchange_requests ADD COLUMN requested_term TEXT")
-                conn.commit()
-                print("Added 'requested_term' column to exchange_requests table.")
-            else:
-                print("Column 'requested_term' already exists in exchange_requests table.")
-        
+            cursor.execute('''
+                SELECT id, name, description, point_type, latitude, longitude, added_by, created_at
+                FROM map_points
+                WHERE id = ?
+            ''', (point_id,))
+            row = cursor.fetchone()
+            if row:
+                point = {
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'point_type': row[3],
+                    'latitude': row[4],
+                    'longitude': row[5],
+                    'added_by': row[6],
+                    'created_at': row[7]
+                }
         except sqlite3.Error as e:
-            print(f"Error updating schema: {e}")
+            print(f"Error getting map point: {e}")
         finally:
             conn.close()
+    return point
+
+def get_map_points_in_bbox(min_lat, min_lng, max_lat, max_lng, point_type=None, limit=500):
+    """
+    Retrieves the map points inside a bounding box through the map_points_rtree index,
+    so the cost depends on the visible points and not on the size of the table.
+    A box with min_lng > max_lng crosses the antimeridian and is split in two.
 
+    Returns:
+        list: Point dictionaries (at most limit), or None on error.
+    """
+    points = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            if min_lng <= max_lng:
+                lng_ranges = [(min_lng, max_lng)]
+            else:
+                lng_ranges = [(min_lng, 180.0), (-180.0, max_lng)]
+
+            lng_filter = ' OR '.join(['(r.max_lng >= ? AND r.min_lng <= ?)'] * len(lng_ranges))
+            params = [min_lat, max_lat]
+            for range_min, range_max in lng_ranges:
+                params += [range_min, range_max]
+            type_filter = ''
+            if point_type:
+                type_filter = 'AND p.point_type = ?'
+                params.append(point_type)
+            params.append(limit)
+
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.id, p.name, p.description, p.point_type, p.latitude, p.longitude, p.added_by, p.created_at
+                FROM map_points_rtree r
+                JOIN map_points p ON p.id = r.id
+                WHERE r.max_lat >= ? AND r.min_lat <= ?
+                  AND ({lng_filter})
+                  {type_filter}
+                ORDER BY p.id DESC
+                LIMIT ?
+            ''', params)
+            points = []
+            for row in cursor.fetchall():
+                points.append({
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'point_type': row[3],
+                    'latitude': row[4],
+                    'longitude': row[5],
+                    'added_by': row[6],
+                    'created_at': row[7]
+                })
+        except sqlite3.Error as e:
+            print(f"Error retrieving map points in bbox: {e}")
+        finally:
+            conn.close()
+    return points
 
+def get_nearest_map_points(latitude, longitude, k, point_type=None, start_radius_km=0.5, max_radius_km=20000.0):
+    """
+    The map points nearest to a coordinate, all on one connection.
 
-# --- Statistics Functions ---
+    Searches the R*Tree with a box around the coordinate that doubles in size until
+    k points fall inside the search circle. Inside each box SQLite ranks the points
+    by squared degree distance (longitude scaled by cos(latitude), wrapping at the
+    antimeridian) and returns only the closest few, which are then ranked by
+    haversine distance. Nothing is capped by id, so a dense box never hides the
+    nearest point.
 
-def get_users_count():
-    """Returns the total number of registered users."""
+    Returns:
+        list: Up to k point dictionaries with 'distance_km', nearest first, or None on error.
+    """
+    points = None
+    # A few more than k, the squared degree distance is only an approximation of haversine
+    candidates_limit = max(4 * k, k + 10)
+    cos_lat = math.cos(math.radians(latitude))
     conn = db_conn.create_connection()
-    count = 0
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM users WHERE user_type != 'admin'")
-            count = cursor.fetchone()[0]
+            radius_km = start_radius_km
+            while True:
+                min_lat, min_lng, max_lat, max_lng = geo.bbox_around(latitude, longitude, radius_km)
+                if min_lng <= max_lng:
+                    lng_ranges = [(min_lng, max_lng)]
+                else:
+                    lng_ranges = [(min_lng, 180.0), (-180.0, max_lng)]
+                params = {'lat': latitude, 'lng': longitude, 'cos_lat': cos_lat,
+                          'min_lat': min_lat, 'max_lat': max_lat, 'limit': candidates_limit}
+                lng_filters = []
+                for index, (range_min, range_max) in enumerate(lng_ranges):
+                    lng_filters.append(f'(r.max_lng >= :min_lng{index} AND r.min_lng <= :max_lng{index})')
+                    params[f'min_lng{index}'] = range_min
+                    params[f'max_lng{index}'] = range_max
+                type_filter = ''
+                if point_type:
+                    type_filter = 'AND p.point_type = :point_type'
+                    params['point_type'] = point_type
+
+                cursor.execute(f'''
+                    SELECT id, name, description, point_type, latitude, longitude, added_by, created_at
+                    FROM (
+                        SELECT p.*, min(abs(p.longitude - :lng), 360 - abs(p.longitude - :lng)) * :cos_lat AS dx
+                        FROM map_points_rtree r
+                        JOIN map_points p ON p.id = r.id
+                        WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat
+                          AND ({' OR '.join(lng_filters)})
+                          {type_filter}
+                    )
+                    ORDER BY (latitude - :lat) * (latitude - :lat) + dx * dx
+                    LIMIT :limit
+                ''', params)
+                found = []
+                for row in cursor.fetchall():
+                    found.append({
+                        'id': row[0],
+                        'name': row[1],
+                        'description': row[2],
+                        'point_type': row[3],
+                        'latitude': row[4],
+                        'longitude': row[5],
+                        'added_by': row[6],
+                        'created_at': row[7],
+                        'distance_km': round(geo.haversine_km(latitude, longitude, row[4], row[5]), 3)
+                    })
+                found.sort(key=lambda point: point['distance_km'])
+                # A point in the box corners may be farther than an unseen point just outside the circle,
+                # so only points inside the circle are certain to be among the nearest
+                inside = [point for point in found if point['distance_km'] <= radius_km]
+                if len(inside) >= k or radius_km >= max_radius_km:
+                    points = (inside if len(inside) >= k else found)[:k]
+                    break
+                radius_km *= 2
         except sqlite3.Error as e:
-            print(f"Error getting users count: {e}")
+            print(f"Error retrieving nearest map points: {e}")
         finally:
             conn.close()
-    
-    return count
+    return points
 
-def get_orgs_count():
-    """Returns the total number of registered organizations."""
+def get_map_points_in_geohash_cells(cells, point_type=None):
+    """
+    Retrieves the points whose geohash starts with any of the given cells
+    (prefix ranges on idx_map_points_geohash, no table scan).
+    """
+    points = []
+    if not cells:
+        return points
     conn = db_conn.create_connection()
-    count = 0
-    
     if conn is not None:
         try:
+            prefix_filter = ' OR '.join(['(geohash >= ? AND geohash < ?)'] * len(cells))
+            params = []
+            for cell in cells:
+                params += [cell, cell + '~']  # '~' sorts after every base32 char
+            type_filter = ''
+            if point_type:
+                type_filter = 'AND point_type = ?'
+                params.append(point_type)
+
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM organizations")
-            count = cursor.fetchone()[0]
+            cursor.execute(f'''
+                SELECT id, name, description, point_type, latitude, longitude, added_by, created_at
+                FROM map_points
+                WHERE ({prefix_filter}) {type_filter}
+            ''', params)
+            for row in cursor.fetchall():
+                points.append({
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'point_type': row[3],
+                    'latitude': row[4],
+                    'longitude': row[5],
+                    'added_by': row[6],
+                    'created_at': row[7]
+                })
         except sqlite3.Error as e:
-            print(f"Error getting organizations count: {e}")
+            print(f"Error retrieving map points by geohash: {e}")
         finally:
             conn.close()
-    
-    return count
+    return points
 
-def get_events_count():
-    """Returns the total number of events."""
+def fill_missing_map_point_geohashes():
+    """
+    Computes the geohash of points saved before the column existed.
+
+    Returns:
+        int: Number of points updated.
+    """
+    updated = 0
     conn = db_conn.create_connection()
-    count = 0
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM events")
-            count = cursor.fetchone()[0]
+            cursor.execute("SELECT id, latitude, longitude FROM map_points WHERE geohash IS NULL")
+            rows = [(geo.geohash_encode(lat, lng), point_id) for point_id, lat, lng in cursor.fetchall()]
+            cursor.executemany("UPDATE map_points SET geohash = ? WHERE id = ?", rows)
+            conn.commit()
+            updated = len(rows)
         except sqlite3.Error as e:
-            print(f"Error getting events count: {e}")
+            print(f"Error filling map point geohashes: {e}")
+            conn.rollback()
         finally:
             conn.close()
-    
-    return count
+    return updated
 
-def get_items_count():
-    """Returns the total number of exchange items."""
+def get_all_map_points_for_dedupe():
+    """Retrieves (id, name, point_type, latitude, longitude, geohash) of every point, oldest first."""
+    rows = []
     conn = db_conn.create_connection()
-    count = 0
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM exchange_items")
-            count = cursor.fetchone()[0]
+            cursor.execute("SELECT id, name, point_type, latitude, longitude, geohash FROM map_points ORDER BY id")
+            rows = cursor.fetchall()
         except sqlite3.Error as e:
-            print(f"Error getting items count: {e}")
+            print(f"Error retrieving map points: {e}")
         finally:
             conn.close()
-    
-    return count
+    return rows
 
-def users_view():
+def delete_map_points(point_ids):
     """
-    Retrieves all users from the database for admin viewing.
-    Returns all user information except passwords.
-    
+    Deletes several points at once (R*Tree rows go with them through the triggers)
+    and takes them out of the cluster pyramid in the same transaction.
+
     Returns:
-        list: A list of dictionaries containing user data without passwords.
+        int: Number of points deleted, or None on error.
     """
-    users_list = []
+    deleted = None
     conn = db_conn.create_connection()
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT user_id, student_code, name, email, career, 
-                       interests, points, creation_date, user_type
-                FROM users
-                ORDER BY creation_date DESC
-            ''')
-            
-            for row in cursor.fetchall():
-                user_data = {
-                    'user_id': row[0],
-                    'student_code': row[1],
-                    'name': row[2],
-                    'email': row[3],
-                    'career': row[4],
-                    'interests': row[5],
-                    'points': row[6],
-                    'creation_date': row[7],
-                    'user_type': row[8]
+            points = []
+            for start in range(0, len(point_ids), 500):
+                chunk = point_ids[start:start + 500]
+                cursor.execute(f'''
+                    SELECT latitude, longitude, point_type FROM map_points WHERE id IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                points += cursor.fetchall()
+            cursor.executemany("DELETE FROM map_points WHERE id = ?", [(point_id,) for point_id in point_ids])
+            _apply_map_point_clusters(cursor, points, -1)
+            conn.commit()
+            deleted = len(points)
+        except sqlite3.Error as e:
+            print(f"Error deleting map points: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+    return deleted
+
+def get_change_counter(name):
+    """
+    Returns the current version of a table from change_counters (bumped by triggers
+    on every write), or None on error.
+    """
+    version = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM change_counters WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            version = row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Error retrieving change counter '{name}': {e}")
+        finally:
+            conn.close()
+    return version
+
+def get_catalog_version():
+    """Version of the achievement and challenge catalogs, see catalog_cache. None on error."""
+    return get_change_counter('catalog')
+
+def iter_map_points(point_type=None, batch_size=500):
+    """
+    Generator over every map point (optionally of one type), read in batches so
+    large layers are never held in memory at once. Every batch is its own short
+    statement resuming after the last id (like iter_export_rows), so a slow client
+    never holds the read lock that would block writers. The connection is closed
+    when the generator is exhausted or closed.
+    """
+    conn = db_conn.create_connection()
+    if conn is None:
+        return
+    try:
+        cursor = conn.cursor()
+        last_id = 0
+        while True:
+            cursor.execute('''
+                SELECT id, name, description, point_type, latitude, longitude, added_by, created_at
+                FROM map_points
+                WHERE id > ? AND (? IS NULL OR point_type = ?)
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, point_type, point_type, batch_size))
+            rows = cursor.fetchall()
+            for row in rows:
+                yield {
+                    'id': row[0],
+                    'name': row[1],
+                    'description': row[2],
+                    'point_type': row[3],
+                    'latitude': row[4],
+                    'longitude': row[5],
+                    'added_by': row[6],
+                    'created_at': row[7]
                 }
-                users_list.append(user_data)
-                
-            print(f"Retrieved {len(users_list)} users for admin view.")
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1][0]
+    except sqlite3.Error as e:
+        print(f"Error streaming map points: {e}")
+    finally:
+        conn.close()
+
+def _map_point_cells(points):
+    """Sums points [(latitude, longitude, point_type), ...] per pyramid cell: {(zoom, x, y, type): (count, sum_lat, sum_lng)}."""
+    cells = {}
+    for latitude, longitude, point_type in points:
+        for zoom in range(geo.CLUSTER_MAX_ZOOM + 1):
+            key = (zoom,) + geo.cell_for(latitude, longitude, zoom) + (point_type,)
+            point_count, sum_lat, sum_lng = cells.get(key, (0, 0.0, 0.0))
+            cells[key] = (point_count + 1, sum_lat + latitude, sum_lng + longitude)
+    return cells
+
+def _apply_map_point_clusters(cursor, points, delta):
+    """
+    Adds (delta=1) or removes (delta=-1) points from every level of the cluster pyramid,
+    inside the caller's transaction so the clusters change together with map_points
+    (and its version counter). One upsert per zoom level and cell.
+    """
+    cells = _map_point_cells(points)
+    cursor.executemany('''
+        INSERT INTO map_point_clusters (zoom, cell_x, cell_y, point_type, point_count, sum_lat, sum_lng)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(zoom, cell_x, cell_y, point_type) DO UPDATE SET
+            point_count = point_count + excluded.point_count,
+            sum_lat = sum_lat + excluded.sum_lat,
+            sum_lng = sum_lng + excluded.sum_lng
+    ''', [key + (delta * count, delta * sum_lat, delta * sum_lng)
+          for key, (count, sum_lat, sum_lng) in cells.items()])
+    if delta < 0:
+        # Only the cells just touched can have emptied, each one a primary key lookup
+        cursor.executemany('''
+            DELETE FROM map_point_clusters
+            WHERE zoom = ? AND cell_x = ? AND cell_y = ? AND point_type = ? AND point_count <= 0
+        ''', list(cells))
+
+def rebuild_map_point_clusters():
+    """
+    Recomputes the whole cluster pyramid from map_points (backfill or repair).
+
+    Returns:
+        int: Number of points clustered, or None on error.
+    """
+    count = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT latitude, longitude, point_type FROM map_points")
+            points = cursor.fetchall()
+            count = len(points)
+            cells = _map_point_cells(points)
+
+            cursor.execute("DELETE FROM map_point_clusters")
+            cursor.executemany('''
+                INSERT INTO map_point_clusters (zoom, cell_x, cell_y, point_type, point_count, sum_lat, sum_lng)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [key + value for key, value in cells.items()])
+            # New clusters under a new version, so cached cluster responses (ETag) are not reused
+            cursor.execute("UPDATE change_counters SET version = version + 1 WHERE name = 'map_points'")
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error rebuilding map point clusters: {e}")
+            conn.rollback()
+            count = None
+        finally:
+            conn.close()
+    return count
+
+def map_point_clusters_in_sync():
+    """
+    True if every map point is counted in the cluster pyramid: each point is in
+    exactly one zoom 0 cell, so the zoom 0 counts must add up to the number of points.
+    """
+    conn = db_conn.create_connection()
+    if conn is None:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT (SELECT COALESCE(SUM(point_count), 0) FROM map_point_clusters WHERE zoom = 0)
+                 = (SELECT COUNT(*) FROM map_points)
+        ''')
+        return bool(cursor.fetchone()[0])
+    except sqlite3.Error as e:
+        print(f"Error checking map point clusters: {e}")
+        return True
+    finally:
+        conn.close()
+
+def get_map_point_clusters(zoom, cell_ranges, point_type=None, limit=2000):
+    """
+    Retrieves the clusters of one zoom level inside the given cell ranges.
+    Types are merged unless point_type is given.
+
+    Args:
+        zoom (int): Zoom level of the pyramid.
+        cell_ranges (list): [(min_x, max_x, min_y, max_y), ...] from geo.cell_ranges.
+
+    Returns:
+        list: {'latitude', 'longitude', 'count'} dictionaries, or None on error.
+    """
+    clusters = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            range_filter = ' OR '.join(['(cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?)'] * len(cell_ranges))
+            params = [zoom]
+            for cell_range in cell_ranges:
+                params += list(cell_range)
+            type_filter = ''
+            if point_type:
+                type_filter = 'AND point_type = ?'
+                params.append(point_type)
+            params.append(limit)
+
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT SUM(sum_lat) / SUM(point_count), SUM(sum_lng) / SUM(point_count), SUM(point_count)
+                FROM map_point_clusters
+                WHERE zoom = ? AND ({range_filter}) {type_filter}
+                GROUP BY cell_x, cell_y
+                LIMIT ?
+            ''', params)
+            clusters = [{'latitude': row[0], 'longitude': row[1], 'count': row[2]} for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving map point clusters: {e}")
+        finally:
+            conn.close()
+    return clusters
+
+# --- Heatmap Functions (see heatmap.py) ---
+
+def get_map_point_coordinates(since=None):
+    """
+    Retrieves the coordinates of the map points created on or after since (YYYY-MM-DD).
+
+    Returns:
+        list: [(latitude, longitude), ...], or None on error.
+    """
+    rows = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            if since:
+                cursor.execute("SELECT latitude, longitude FROM map_points WHERE created_at >= ?", (since,))
+            else:
+                cursor.execute("SELECT latitude, longitude FROM map_points")
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error getting map point coordinates: {e}")
+        finally:
+            conn.close()
+    return rows
+
+def get_event_activity_coordinates(since=None):
+    """
+    Retrieves the geocoded events taking place on or after since (YYYY-MM-DD)
+    with their number of registered participants.
+
+    Returns:
+        list: [(latitude, longitude, participants), ...], or None on error.
+    """
+    rows = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            sql_query = '''
+                SELECT e.latitude, e.longitude, COUNT(p.id)
+                FROM events e
+                LEFT JOIN user_event_participants p ON p.event_id = e.event_id
+                WHERE e.latitude IS NOT NULL AND e.longitude IS NOT NULL
+            '''
+            params = []
+            if since:
+                sql_query += " AND e.event_datetime >= ?"
+                params.append(since)
+            sql_query += " GROUP BY e.event_id"
+            cursor.execute(sql_query, params)
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error getting event activity coordinates: {e}")
+        finally:
+            conn.close()
+    return rows
+
+def replace_heatmap_tiles(rows):
+    """
+    Replaces every precomputed heatmap tile in one transaction, so admins never
+    see half a rebuild, and bumps the 'heatmap' change counter.
+
+    Args:
+        rows (list): [(time_window, layer, zoom, tile_x, tile_y, zoom_max, data), ...]
+
+    Returns:
+        int: Number of tiles stored, or None on error.
+    """
+    stored = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM heatmap_tiles")
+            cursor.executemany('''
+                INSERT INTO heatmap_tiles (time_window, layer, zoom, tile_x, tile_y, zoom_max, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            cursor.execute("UPDATE change_counters SET version = version + 1 WHERE name = 'heatmap'")
+            conn.commit()
+            stored = len(rows)
+        except sqlite3.Error as e:
+            print(f"Error replacing heatmap tiles: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+    return stored
+
+def get_heatmap_tile(time_window, layer, zoom, tile_x, tile_y):
+    """
+    Retrieves one precomputed heatmap tile.
+
+    Returns:
+        dict: {'zoom_max', 'data'} with data still compressed, {} if the tile is empty, None on error.
+    """
+    tile = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT zoom_max, data FROM heatmap_tiles
+                WHERE time_window = ? AND layer = ? AND zoom = ? AND tile_x = ? AND tile_y = ?
+            ''', (time_window, layer, zoom, tile_x, tile_y))
+            row = cursor.fetchone()
+            tile = {'zoom_max': row[0], 'data': row[1]} if row else {}
+        except sqlite3.Error as e:
+            print(f"Error getting heatmap tile: {e}")
+        finally:
+            conn.close()
+    return tile
+
+def update_exchange_requests_schema():
+    """
+    Updates the exchange_requests table schema.
+    Warning: This function requires careful invocation.
+    """
+    conn = db_conn.create_connection()
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            
+            # Check if the column exists already
+            cursor.execute("PRAGMA table_info(exchange_requests)")
+            columns = cursor.fetchall()
+            column_names = [column[1] for column in columns]
             
+            if 'requested_term' not in column_names:
+                cursor.execute("ALTER TABLE exchange_requests ADD COLUMN requested_term TEXT")
+                conn.commit()
+                print("Added 'requested_term' column to exchange_requests table.")
+            else:
+                print("Column 'requested_term' already exists in exchange_requests table.")
+        
+        except sqlite3.Error as e:
+            print(f"Error updating schema: {e}")
+        finally:
+            conn.close()
+
+
+
+# --- Campus Places Functions (event geocoding gazetteer) ---
+
+def get_campus_places():
+    """
+    Retrieves every place of the campus gazetteer.
+
+    Returns:
+        list: Place dictionaries ordered by name.
+    """
+    places = []
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT place_id, name, normalized_name, latitude, longitude
+                FROM campus_places
+                ORDER BY name
+            ''')
+            for row in cursor.fetchall():
+                places.append({
+                    'place_id': row[0],
+                    'name': row[1],
+                    'normalized_name': row[2],
+                    'latitude': row[3],
+                    'longitude': row[4]
+                })
+        except sqlite3.Error as e:
+            print(f"Error getting campus places: {e}")
+        finally:
+            conn.close()
+
+    return places
+
+def add_campus_place(name, normalized_name, latitude, longitude):
+    """
+    Adds a place to the campus gazetteer.
+
+    Returns:
+        int: ID of the created place if successful, None otherwise (e.g. duplicated name).
+    """
+    place_id = None
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO campus_places (name, normalized_name, latitude, longitude)
+                VALUES (?, ?, ?, ?)
+            ''', (name, normalized_name, latitude, longitude))
+            conn.commit()
+            place_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error adding campus place: {e}")
+        finally:
+            conn.close()
+
+    return place_id
+
+def delete_campus_place(place_id):
+    """
+    Deletes a place from the campus gazetteer.
+
+    Returns:
+        bool: True if a place was deleted, False otherwise.
+    """
+    success = False
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM campus_places WHERE place_id = ?", (place_id,))
+            conn.commit()
+            success = cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error deleting campus place: {e}")
+        finally:
+            conn.close()
+
+    return success
+
+def get_events_without_coordinates():
+    """
+    Retrieves the events that were not geocoded yet.
+
+    Returns:
+        list: Dictionaries with event_id and location.
+    """
+    events = []
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT event_id, location FROM events WHERE latitude IS NULL OR longitude IS NULL")
+            events = [{'event_id': row[0], 'location': row[1]} for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error getting events without coordinates: {e}")
+        finally:
+            conn.close()
+
+    return events
+
+def set_event_coordinates(coordinates):
+    """
+    Stores the coordinates of several events in one transaction (events_rtree follows by trigger).
+
+    Args:
+        coordinates (list): [(event_id, latitude, longitude), ...]
+
+    Returns:
+        int: Number of events updated.
+    """
+    updated = 0
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "UPDATE events SET latitude = ?, longitude = ? WHERE event_id = ?",
+                [(latitude, longitude, event_id) for event_id, latitude, longitude in coordinates]
+            )
+            conn.commit()
+            updated = cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error setting event coordinates: {e}")
+        finally:
+            conn.close()
+
+    return updated
+
+def find_map_points_by_name(text, limit=20):
+    """
+    Retrieves map points whose name contains the text or is contained in it,
+    e.g. 'Huerta ML' for the location 'Huerta ML, terraza piso 8'.
+    Names shorter than 3 characters are ignored to avoid matching everything.
+
+    Returns:
+        list: Point dictionaries (id, name, latitude, longitude).
+    """
+    points = []
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, name, latitude, longitude
+                FROM map_points
+                WHERE length(name) >= 3
+                  AND (name LIKE ? OR ? LIKE '%' || name || '%')
+                ORDER BY length(name) DESC
+                LIMIT ?
+            ''', (f"%{text}%", text, limit))
+            for row in cursor.fetchall():
+                points.append({
+                    'id': row[0],
+                    'name': row[1],
+                    'latitude': row[2],
+                    'longitude': row[3]
+                })
+        except sqlite3.Error as e:
+            print(f"Error finding map points by name: {e}")
+        finally:
+            conn.close()
+
+    return points
+
+def get_named_map_points():
+    """
+    Retrieves every map point with a name of 3 characters or more, for matching
+    many locations in one pass (see find_map_points_by_name).
+
+    Returns:
+        list: Point dictionaries (id, name, latitude, longitude).
+    """
+    points = []
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, latitude, longitude FROM map_points WHERE length(name) >= 3")
+            points = [
+                {'id': row[0], 'name': row[1], 'latitude': row[2], 'longitude': row[3]}
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"Error getting named map points: {e}")
+        finally:
+            conn.close()
+
+    return points
+
+
+# --- Statistics Functions ---
+
+def get_users_count():
+    """Returns the total number of registered users."""
+    conn = db_conn.create_connection()
+    count = 0
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM users WHERE user_type != 'admin'")
+            count = cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error getting users count: {e}")
+        finally:
+            conn.close()
+    
+    return count
+
+def get_orgs_count():
+    """Returns the total number of registered organizations."""
+    conn = db_conn.create_connection()
+    count = 0
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM organizations")
+            count = cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error getting organizations count: {e}")
+        finally:
+            conn.close()
+    
+    return count
+
+def get_events_count():
+    """Returns the total number of events."""
+    conn = db_conn.create_connection()
+    count = 0
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM events")
+            count = cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error getting events count: {e}")
+        finally:
+            conn.close()
+    
+    return count
+
+def get_items_count():
+    """Returns the total number of exchange items."""
+    conn = db_conn.create_connection()
+    count = 0
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM exchange_items")
+            count = cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error getting items count: {e}")
+        finally:
+            conn.close()
+    
+    return count
+
+def users_view():
+    """
+    Retrieves all users from the database for admin viewing.
+    Returns all user information except passwords.
+    
+    Returns:
+        list: A list of dictionaries containing user data without passwords.
+    """
+    users_list = []
+    conn = db_conn.create_connection()
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, student_code, name, email, career, 
+                       interests, points, creation_date, user_type
+                FROM users
+                ORDER BY creation_date DESC
+            ''')
+            
+            for row in cursor.fetchall():
+                user_data = {
+                    'user_id': row[0],
+                    'student_code': row[1],
+                    'name': row[2],
+                    'email': row[3],
+                    'career': row[4],
+                    'interests': row[5],
+                    'points': row[6],
+                    'creation_date': row[7],
+                    'user_type': row[8]
+                }
+                users_list.append(user_data)
+                
+            print(f"Retrieved {len(users_list)} users for admin view.")
+            
+        except sqlite3.Error as e:
+            print(f"Error retrieving users for admin view: {e}")
+        finally:
+            conn.close()
+    
+    return users_list
+
+def orgs_view():
+    """
+    Retrieves all organizations from the database for admin viewing.
+    Returns all organization information except passwords.
+    
+    Returns:
+        list: A list of dictionaries containing organization data without passwords.
+    """
+    orgs_list = []
+    conn = db_conn.create_connection()
+    
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT org_id, name, email, description, 
+                       interests, points, creation_date, creator_student_code
+                FROM organizations
+                ORDER BY creation_date DESC
+            ''')
+            
+            for row in cursor.fetchall():
+                org_data = {
+                    'org_id': row[0],
+                    'name': row[1],
+                    'email': row[2],
+                    'description': row[3],
+                    'interests': row[4],
+                    'points': row[5],
+                    'creation_date': row[6],
+                    'creator_student_code': row[7]
+                }
+                orgs_list.append(org_data)
+                
+            print(f"Retrieved {len(orgs_list)} organizations for admin view.")
+            
+        except sqlite3.Error as e:
+            print(f"Error retrieving organizations for admin view: {e}")
+        finally:
+            conn.close()
+
+    return orgs_list
+
+def get_stats_counters():
+    """
+    Row counts kept by the stats_counters triggers (see db_conn.setup_database).
+
+    Returns:
+        dict: {'users', 'orgs', 'events', 'items'} counts, or None on error.
+    """
+    counters = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, value FROM stats_counters")
+            counters = dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error retrieving stats counters: {e}")
+        finally:
+            conn.close()
+    return counters
+
+def get_stats_snapshot():
+    """
+    Top-N lists stored by refresh_stats_snapshot.
+
+    Returns:
+        dict: {name: {'data': list of rows, 'refreshed_at': str}}, or None on error.
+    """
+    snapshot = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, data, refreshed_at FROM stats_snapshot")
+            snapshot = {name: {'data': json.loads(data), 'refreshed_at': refreshed_at}
+                        for name, data, refreshed_at in cursor.fetchall()}
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error retrieving stats snapshot: {e}")
+        finally:
+            conn.close()
+    return snapshot
+
+def refresh_stats_snapshot(top_n):
+    """
+    Rewrites the top-N lists of stats_snapshot and realigns stats_counters with the tables,
+    in case they were written while the triggers did not exist yet.
+
+    Args:
+        top_n (int): Length of the top lists.
+
+    Returns:
+        bool: True on success, False on error.
+    """
+    conn = db_conn.create_connection()
+    if conn is None:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT org_id, name, email, points, creation_date FROM organizations
+            ORDER BY points DESC, org_id LIMIT ?
+        ''', (top_n,))
+        top_orgs = [
+            {'org_id': row[0], 'name': row[1], 'email': row[2], 'points': row[3], 'creation_date': row[4]}
+            for row in cursor.fetchall()
+        ]
+        cursor.execute('''
+            SELECT user_id, name, student_code, points, creation_date FROM users
+            WHERE user_type != 'admin'
+            ORDER BY points DESC, user_id LIMIT ?
+        ''', (top_n,))
+        top_users = [
+            {'user_id': row[0], 'name': row[1], 'student_code': row[2], 'points': row[3], 'creation_date': row[4]}
+            for row in cursor.fetchall()
+        ]
+
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany('''
+            INSERT INTO stats_snapshot (name, data, refreshed_at) VALUES (?, ?, datetime('now', 'localtime'))
+            ON CONFLICT(name) DO UPDATE SET data = excluded.data, refreshed_at = excluded.refreshed_at
+        ''', [('top_orgs', json.dumps(top_orgs)), ('top_users', json.dumps(top_users))])
+        cursor.execute('''
+            UPDATE stats_counters SET value = CASE name
+                WHEN 'users' THEN (SELECT COUNT(*) FROM users WHERE user_type != 'admin')
+                WHEN 'orgs' THEN (SELECT COUNT(*) FROM organizations)
+                WHEN 'events' THEN (SELECT COUNT(*) FROM events)
+                WHEN 'items' THEN (SELECT COUNT(*) FROM items)
+                ELSE value END
+        ''')
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error refreshing stats snapshot: {e}")
+        return False
+    finally:
+        conn.close()
+
+MAX_ROWID = 2 ** 63 - 1  # upper bound of an unbounded keyset page
+
+def users_page(limit, before_id=None, after_id=None):
+    """
+    One page of the admin users list, newest first. Same fields as users_view.
+
+    Args:
+        limit (int): Rows to return.
+        before_id (int, optional): Only users older than this user_id (next page).
+        after_id (int, optional): Only users newer than this user_id (previous page),
+            the ones right after it.
+
+    Returns:
+        list: User dictionaries without passwords, newest first, or None on error.
+    """
+    users_list = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            # user_id follows the registration order and is the rowid: the cursor is a
+            # rowid range (plain bounds, an "? IS NULL OR" would turn it into a scan),
+            # no sort and no scan past the page however deep it is
+            order = 'ASC' if after_id is not None else 'DESC'
+            cursor.execute(f'''
+                SELECT user_id, student_code, name, email, career,
+                       interests, points, creation_date, user_type
+                FROM users
+                WHERE user_type != 'admin'
+                  AND user_id < ? AND user_id > ?
+                ORDER BY user_id {order}
+                LIMIT ?
+            ''', (before_id if before_id is not None else MAX_ROWID, after_id or 0, limit))
+            rows = cursor.fetchall()
+            if after_id is not None:
+                rows.reverse()
+            users_list = [
+                {
+                    'user_id': row[0],
+                    'student_code': row[1],
+                    'name': row[2],
+                    'email': row[3],
+                    'career': row[4],
+                    'interests': row[5],
+                    'points': row[6],
+                    'creation_date': row[7],
+                    'user_type': row[8]
+                }
+                for row in rows
+            ]
+        except sqlite3.Error as e:
+            print(f"Error retrieving users page: {e}")
+        finally:
+            conn.close()
+    return users_list
+
+def orgs_page(limit, before_id=None, after_id=None):
+    """
+    One page of the admin organizations list, newest first. Same fields as orgs_view.
+    Keyset pagination on org_id, see users_page.
+
+    Returns:
+        list: Organization dictionaries without passwords, newest first, or None on error.
+    """
+    orgs_list = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            order = 'ASC' if after_id is not None else 'DESC'
+            cursor.execute(f'''
+                SELECT org_id, name, email, description,
+                       interests, points, creation_date, creator_student_code
+                FROM organizations
+                WHERE org_id < ? AND org_id > ?
+                ORDER BY org_id {order}
+                LIMIT ?
+            ''', (before_id if before_id is not None else MAX_ROWID, after_id or 0, limit))
+            rows = cursor.fetchall()
+            if after_id is not None:
+                rows.reverse()
+            orgs_list = [
+                {
+                    'org_id': row[0],
+                    'name': row[1],
+                    'email': row[2],
+                    'description': row[3],
+                    'interests': row[4],
+                    'points': row[5],
+                    'creation_date': row[6],
+                    'creator_student_code': row[7]
+                }
+                for row in rows
+            ]
+        except sqlite3.Error as e:
+            print(f"Error retrieving organizations page: {e}")
+        finally:
+            conn.close()
+    return orgs_list
+
+# Admin exports (exports.py). Each dataset lists its columns with their type and one or more
+# parts (the participation of users and of organizations live in two tables). A part is read
+# in batches ordered by its key, `select` maps every column to its SQL expression.
+EXPORT_DATASETS = {
+    'users': {
+        'columns': {
+            'user_id': 'int', 'student_code': 'str', 'name': 'str', 'nickname': 'str', 'email': 'str',
+            'career': 'str', 'interests': 'str', 'points': 'int', 'is_verified': 'bool', 'creation_date': 'str',
+        },
+        'parts': [{
+            'from': "users",
+            'where': "user_type != 'admin'",
+            'key': "user_id",
+            'date': "creation_date",
+            'select': {},  # same names as the columns
+        }],
+    },
+    'events': {
+        'columns': {
+            'event_id': 'int', 'organizer_id': 'int', 'organizer_type': 'str', 'name': 'str', 'event_type': 'str',
+            'location': 'str', 'event_datetime': 'str', 'event_status': 'str', 'points_value': 'int',
+            'latitude': 'float', 'longitude': 'float', 'creation_date': 'str',
+        },
+        'parts': [{
+            'from': "events",
+            'where': "1",
+            'key': "event_id",
+            'date': "creation_date",
+            'select': {},
+        }],
+    },
+    'participation': {
+        'columns': {
+            'participant_type': 'str', 'participant_id': 'int', 'event_id': 'int', 'event_name': 'str',
+            'event_type': 'str', 'registered_date': 'str', 'attended': 'bool',
+        },
+        'parts': [
+            {
+                'from': "user_event_participants p LEFT JOIN events e ON e.event_id = p.event_id",
+                'where': "1",
+                'key': "p.id",
+                'date': "p.registered_date",
+                'select': {'participant_type': "'user'", 'participant_id': "p.user_id", 'event_id': "p.event_id",
+                           'event_name': "e.name", 'event_type': "e.event_type",
+                           'registered_date': "p.registered_date", 'attended': "p.attended"},
+            },
+            {
+                'from': "org_event_participants p LEFT JOIN events e ON e.event_id = p.event_id",
+                'where': "1",
+                'key': "p.id",
+                'date': "p.registered_date",
+                'select': {'participant_type': "'org'", 'participant_id': "p.org_id", 'event_id': "p.event_id",
+                           'event_name': "e.name", 'event_type': "e.event_type",
+                           'registered_date': "p.registered_date", 'attended': "p.attended"},
+            },
+        ],
+    },
+    'exchanges': {
+        'columns': {
+            'exchange_id': 'int', 'item_id': 'int', 'item_name': 'str', 'item_type': 'str', 'requester_id': 'int',
+            'owner_id': 'int', 'exchange_status': 'str', 'request_date': 'str', 'decision_date': 'str',
+        },
+        'parts': [{
+            'from': "exchange_requests x LEFT JOIN items i ON i.item_id = x.item_id",
+            'where': "1",
+            'key': "x.exchange_id",
+            'date': "x.request_date",
+            'select': {'exchange_id': "x.exchange_id", 'item_id': "x.item_id", 'item_name': "i.name",
+                       'item_type': "i.item_type", 'requester_id': "x.requester_id", 'owner_id': "x.owner_id",
+                       'exchange_status': "x.exchange_status", 'request_date': "x.request_date",
+                       'decision_date': "x.decision_date"},
+        }],
+    },
+}
+
+def iter_export_rows(dataset, columns, since=None, until=None, batch_size=1000):
+    """
+    Generator over the rows of an export dataset, read in batches of batch_size.
+
+    Every batch is its own short statement resuming after the last key (keyset
+    pagination), so a slow download never holds a read lock that would block the
+    writers, and at most one batch is in memory. The connection is closed when the
+    generator is exhausted or closed.
+
+    Args:
+        dataset (str): A key of EXPORT_DATASETS.
+        columns (list): Column names of the dataset, in output order (already validated).
+        since (str): Only rows dated on or after this 'YYYY-MM-DD HH:MM:SS' value, None for no limit.
+        until (str): Only rows dated before this value, None for no limit.
+        batch_size (int): Rows per statement.
+
+    Yields:
+        tuple: One row with the values of `columns`.
+    """
+    conn = db_conn.create_connection()
+    if conn is None:
+        return
+    try:
+        cursor = conn.cursor()
+        for part in EXPORT_DATASETS[dataset]['parts']:
+            expressions = ', '.join(part['select'].get(column, column) for column in columns)
+            query = f'''
+                SELECT {part['key']}, {expressions}
+                FROM {part['from']}
+                WHERE ({part['where']}) AND {part['key']} > ?
+                  AND (? IS NULL OR {part['date']} >= ?) AND (? IS NULL OR {part['date']} < ?)
+                ORDER BY {part['key']}
+                LIMIT ?
+            '''
+            last_key = -1
+            while True:
+                cursor.execute(query, (last_key, since, since, until, until, batch_size))
+                rows = cursor.fetchall()
+                for row in rows:
+                    yield row[1:]
+                if len(rows) < batch_size:
+                    break
+                last_key = rows[-1][0]
+    except sqlite3.Error as e:
+        print(f"Error streaming export '{dataset}': {e}")
+        raise  # abort the download: a truncated file must not look complete
+    finally:
+        conn.close()
+
+def get_activity_rollup(metric, granularity, since_bucket, until_bucket):
+    """
+    Reads one metric of the activity rollups (see db_conn.setup_database) over a bucket range.
+    Only the primary key range of the metric is visited, whatever the size of the source tables.
+
+    Args:
+        metric (str): signups, events, items_listed, items_exchanged or messages.
+        granularity (str): 'hour', 'day' or 'week' (summed from the daily rows, bucket = the Monday).
+        since_bucket (str): First bucket included ('YYYY-MM-DD HH' for hours, 'YYYY-MM-DD' otherwise).
+        until_bucket (str): Last bucket included, same format.
+
+    Returns:
+        list: (bucket, dimension, value) tuples, or None on error.
+    """
+    if granularity == 'hour':
+        query = '''
+            SELECT bucket, dimension, value FROM activity_rollup_hourly
+            WHERE metric = ? AND bucket BETWEEN ? AND ?
+        '''
+    elif granularity == 'week':
+        query = '''
+            SELECT date(bucket, 'weekday 0', '-6 days') AS week, dimension, SUM(value) FROM activity_rollup_daily
+            WHERE metric = ? AND bucket BETWEEN ? AND date(?, '+6 days')
+            GROUP BY week, dimension
+        '''
+    else:
+        query = '''
+            SELECT bucket, dimension, value FROM activity_rollup_daily
+            WHERE metric = ? AND bucket BETWEEN ? AND ?
+        '''
+    rows = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, (metric, since_bucket, until_bucket))
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"Error retrieving activity rollup '{metric}': {e}")
+        finally:
+            conn.close()
+    return rows
+
+def prune_hourly_rollups(before_bucket):
+    """
+    Deletes the hourly rollups older than a bucket, the daily ones are kept.
+
+    Returns:
+        int: Number of rows deleted, or None on error.
+    """
+    deleted = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM activity_rollup_hourly WHERE bucket < ?", (before_bucket,))
+            deleted = cursor.rowcount
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error pruning hourly rollups: {e}")
+        finally:
+            conn.close()
+    return deleted
+
+# --- Messaging Functions ---
+
+def save_message(sender_id: int, sender_type: str, recipient_id: int, recipient_type: str, content: str) -> dict:
+    
+    '''
+    Saves a message in the database.
+    saves sender_id, recipient_id and content in the messages table.
+    Validates if content is a non-empty string.
+    
+    Returns a dict with the status and message ID.
+    '''
+    
+    result = None
+    
+    # Validate if content isn't empty and is a string
+    if not isinstance(content, str) or len(content.strip()) == 0:
+        result = {"status": "error", "message": "Content must be a non-empty string"}
+
+    else:
+        conn = db_conn.create_connection()
+        if conn is None:
+            result = {"status": "error", "message": "Database connection failed"}
+
+        else:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO messages (sender_id, sender_type, recipient_id, recipient_type, content)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (sender_id, sender_type, recipient_id, recipient_type, content))
+                conn.commit()
+                result = {"status": "success", "message_id": cursor.lastrowid}
+
+            except sqlite3.Error as e:
+                result = {"status": "error", "message": str(e)}
+
+            finally:
+                conn.close()
+
+    return result
+
+def get_conversation (user1_id: int, user1_type: str, user2_id: int, user2_type: str, limit: int = 10, before_id: int = None) -> dict:
+
+    '''
+    Retrieves messages exchanged between two users.
+    Optional: limit to last 10 messages
+    Optional: before_id, keyset cursor to load the messages older than that message_id
+    Returns a dict with the status and the messages data.
+    Only reads the archive db when the hot messages table runs out of rows.
+    
+    
+    Returns:
+        dict: A dictionary containing the status and messages data.
+        data: dict with message details.
+    '''
+    response = None
+    messages = []
+    conn = db_conn.create_connection()
+
+    #validate if conn is successfully created
+    if conn is None:
+        response = {"status": "error", "message": "Database connection failed"}
+
+    else:
+        try:
+            cursor = conn.cursor()
+            params = [user1_id, user1_type, user2_id, user2_type,
+                      user2_id, user2_type, user1_id, user1_type]
+            # Only a plain bound lets idx_messages_private seek to the page, "? IS NULL OR" would not
+            before_clause = ''
+            if before_id is not None:
+                before_clause = 'AND message_id < ?'
+                params.append(before_id)
+            cursor.execute(f'''
+                SELECT message_id, sender_id, sender_type, recipient_id, recipient_type, content, timestamp, is_read
+                FROM messages
+                WHERE ((sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ?)
+                   OR (sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ?))
+                  {before_clause}
+                ORDER BY message_id DESC -- Obtener los más recientes primero
+                LIMIT ?
+            ''', params + [limit])
+
+            rows = cursor.fetchall()
+            if len(rows) < limit:
+                # The cursor went past the hot window, continue in the archive
+                cursor_id = rows[-1][0] if rows else before_id
+                key = _conversation_key(user1_id, user1_type, user2_id, user2_type)
+                rows += _get_archived_messages(conn, key, cursor_id, limit - len(rows))
+
+            for row in reversed(rows): #get revert messages to show in UI
+                messages.append({
+                    'message_id': row[0],
+                    'sender_id': row[1],
+                    'sender_type': row[2],
+                    'recipient_id': row[3],
+                    'recipient_type': row[4],
+                    'content': row[5],
+                    'timestamp': row[6],
+                    'is_read': bool(row[7])
+                })
+
+            response = {
+                "status": "success",
+                "data": messages
+            }
+
+        except sqlite3.Error as e:
+            response = {"status": "error", "message": str(e)}
+
+        finally:
+            conn.close()
+    return response
+
+def mark_message_as_read(recipient_id: int, recipient_type: str, sender_id: int, sender_type: str) -> dict:
+    """
+    Marks messages as read for a specific recipient and sender.
+    
+    Args:
+        recipient_id (int): The ID of the recipient.
+        recipient_type (str): The type of the recipient ('user' or 'org').
+        sender_id (int): The ID of the sender.
+        sender_type (str): The type of the sender ('user' or 'org').
+
+    Returns:
+        dict: A dictionary containing the status and message ID.
+    """
+    result = None
+    conn = db_conn.create_connection()
+
+    if conn is None:
+        result = {"status": "error", "message": "Database connection failed"}
+    else:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE messages
+                SET is_read = 1
+                WHERE sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ? AND is_read = ?
+            ''', (sender_id, sender_type, recipient_id, recipient_type, 0))
+
+            conn.commit()
+            result = {"status": "success", "message": f"Marked {cursor.rowcount} messages as read."}
+
+        except sqlite3.Error as e:
+            result = {"status": "error", "message": str(e)}
+
+        finally:
+            conn.close()
+
+    return result
+
+def get_group_conversation (org_id: int, limit: int = 50, before_id: int = None) -> dict:
+    """
+    Retrieves messages exchanged in a group conversation for a specific organization.
+    Falls through to the archive db only when the hot messages table runs out of rows.
+    
+    Args:
+        org_id (int): The ID of the organization.
+        limit (int): The maximum number of messages to retrieve.
+        before_id (int, optional): Keyset cursor, only messages older than this message_id.
+
+    Returns:
+        dict: A dictionary containing the status and messages data.
+    """
+    response = None
+    messages = []
+    conn = db_conn.create_connection()
+
+    if conn is None:
+        response = {"status": "error", "message": "Database connection failed"}
+    else:
+        try:
+            cursor = conn.cursor()
+            params = [org_id]
+            before_clause = ''
+            if before_id is not None:
+                # Plain bound so idx_messages_group seeks to the page (see get_conversation)
+                before_clause = 'AND message_id < ?'
+                params.append(before_id)
+            cursor.execute(f'''
+                SELECT message_id, sender_id, sender_type, recipient_id, recipient_type, content, timestamp, is_read
+                FROM messages
+                WHERE recipient_type = 'org' AND recipient_id = ?
+                  {before_clause}
+                ORDER BY message_id DESC -- Get newest first
+                LIMIT ?
+            ''', params + [limit])
+
+            rows = cursor.fetchall()
+            if len(rows) < limit:
+                cursor_id = rows[-1][0] if rows else before_id
+                rows += _get_archived_messages(conn, f"org:{org_id}", cursor_id, limit - len(rows))
+
+            for row in reversed(rows): #get revert messages to show in UI
+                messages.append({
+                    'message_id': row[0],
+                    'sender_id': row[1],
+                    'sender_type': row[2],
+                    'recipient_id': row[3],
+                    'recipient_type': row[4],
+                    'content': row[5],
+                    'timestamp': row[6],
+                    'is_read': bool(row[7])
+                })
+
+            response = {
+                "status": "success",
+                "data": messages
+            }
+
+        except sqlite3.Error as e:
+            response = {"status": "error", "message": str(e)}
+
+        finally:
+            conn.close()
+    return response
+
+SNIPPET_START = '\x02'  # placeholders swapped for <mark> after escaping the message
+SNIPPET_END = '\x03'
+
+def _fts_phrase_query(text):
+    """Turns free user text into an FTS5 query: every word is a quoted phrase, all required."""
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"' for word in words if word.strip('"'))
+
+def search_messages(entity_id: int, entity_type: str, query: str, limit: int = 20, before_id: int = None) -> dict:
+    """
+    Full-text search over the chats the entity takes part in: its private
+    conversations and the group rooms of its orgs. Membership is filtered in
+    the FTS index itself (participants column), never with a LIKE scan.
+    Results are newest first, with keyset pagination on message_id.
+
+    Args:
+        entity_id (int): ID of the user or org searching.
+        entity_type (str): 'user' or 'organization' (session entity_type; 'org' accepted too).
+        query (str): Free text typed by the user.
+        limit (int): Page size.
+        before_id (int, optional): Cursor, message_id of the last result of the previous page.
+
+    Returns:
+        dict: {"status": "success", "data": [...], "next_before_id": int or None}
+              Each result has an HTML-safe 'snippet' with <mark> around matches.
+    """
+    match_text = _fts_phrase_query(query or '')
+    if not match_text:
+        return {"status": "success", "data": [], "next_before_id": None}
+
+    conn = db_conn.create_connection()
+    if conn is None:
+        return {"status": "error", "message": "Database connection failed"}
+
+    try:
+        cursor = conn.cursor()
+        tokens = [f"{entity_type}{entity_id}"]
+        if entity_type in ('org', 'organization'):
+            # An org only sees its own group room, never the rooms of the user with the same id
+            tokens.append(f"grp{entity_id}")
+        else:
+            cursor.execute("SELECT org_id FROM organization_members WHERE user_id = ?", (entity_id,))
+            tokens += [f"grp{row[0]}" for row in cursor.fetchall()]
+
+        match = f"participants : ({' OR '.join(tokens)}) AND content : ({match_text})"
+        cursor.execute('''
+            SELECT rowid, sender_id, sender_type, recipient_id, recipient_type, timestamp,
+                   snippet(messages_fts, 0, ?, ?, '…', 12)
+            FROM messages_fts
+            WHERE messages_fts MATCH ? AND (? IS NULL OR rowid < ?)
+            ORDER BY rowid DESC
+            LIMIT ?
+        ''', (SNIPPET_START, SNIPPET_END, match, before_id, before_id, limit))
+
+        results = []
+        for row in cursor.fetchall():
+            snippet = html.escape(row[6]).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+            results.append({
+                'message_id': row[0],
+                'sender_id': row[1],
+                'sender_type': row[2],
+                'recipient_id': row[3],
+                'recipient_type': row[4],
+                'timestamp': row[5],
+                'snippet': snippet
+            })
+
+        next_before_id = results[-1]['message_id'] if len(results) == limit else None
+        return {"status": "success", "data": results, "next_before_id": next_before_id}
+
+    except sqlite3.Error as e:
+        print(f"Error searching messages: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        conn.close()
+
+# --- Message Archive Functions ---
+
+ARCHIVE_CHUNK_SIZE = 200  # messages per compressed chunk
+
+def _conversation_key(entity1_id, entity1_type, entity2_id, entity2_type):
+    """Same key for both directions of a private chat: 'org:3|user:7'."""
+    return '|'.join(sorted([f"{entity1_type}:{entity1_id}", f"{entity2_type}:{entity2_id}"]))
+
+def _message_conversation_key(row):
+    # row: message_id, sender_id, sender_type, recipient_id, recipient_type, ...
+    if row[4] == 'org':
+        return f"org:{row[3]}"
+    return _conversation_key(row[1], row[2], row[3], row[4])
+
+def _get_archived_messages(conn, conversation_key, before_id, limit):
+    """
+    Reads up to limit archived messages of a conversation, newest first,
+    with message_id < before_id (all of them if before_id is None).
+    Returns rows in the same column order as the messages table.
+    """
+    if limit <= 0 or not db_conn.attach_archive(conn):
+        return []
+
+    rows = []
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT payload FROM archive.message_archive_chunks
+        WHERE conversation_key = ? AND (? IS NULL OR first_message_id < ?)
+        ORDER BY last_message_id DESC
+    ''', (conversation_key, before_id, before_id))
+
+    # Chunks are read lazily, newest first, so only the ones needed are decompressed
+    for (payload,) in cursor:
+        chunk = json.loads(zlib.decompress(payload).decode('utf-8'))
+        for row in reversed(chunk):
+            if before_id is None or row[0] < before_id:
+                rows.append(tuple(row))
+                if len(rows) >= limit:
+                    return rows
+    return rows
+
+def archive_old_messages(max_age_days):
+    """
+    Moves messages older than max_age_days from the hot messages table into
+    zlib-compressed per-conversation chunks in the archive db.
+    Insert and delete run in one transaction, so a message is never lost or duplicated.
+
+    Returns:
+        dict: {"status": "success", "archived": int, "chunks": int} or an error dict.
+    """
+    conn = db_conn.create_connection()
+    if conn is None:
+        return {"status": "error", "message": "Database connection failed"}
+
+    try:
+        if not db_conn.attach_archive(conn):
+            return {"status": "error", "message": "Archive database unavailable"}
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT message_id, sender_id, sender_type, recipient_id, recipient_type, content, timestamp, is_read
+            FROM messages
+            WHERE timestamp < datetime('now', ?)
+            ORDER BY message_id
+        ''', (f"-{int(max_age_days)} days",))
+
+        conversations = {}
+        for row in cursor.fetchall():
+            conversations.setdefault(_message_conversation_key(row), []).append(list(row))
+
+        archived = 0
+        chunks = 0
+        for key, rows in conversations.items():
+            for i in range(0, len(rows), ARCHIVE_CHUNK_SIZE):
+                chunk = rows[i:i + ARCHIVE_CHUNK_SIZE]
+                payload = zlib.compress(json.dumps(chunk, ensure_ascii=False).encode('utf-8'), 9)
+                cursor.execute('''
+                    INSERT INTO archive.message_archive_chunks
+                    (conversation_key, first_message_id, last_message_id, first_timestamp, last_timestamp, message_count, payload)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (key, chunk[0][0], chunk[-1][0], chunk[0][6], chunk[-1][6], len(chunk), payload))
+                cursor.executemany("DELETE FROM messages WHERE message_id = ?", [(row[0],) for row in chunk])
+                archived += len(chunk)
+                chunks += 1
+
+        conn.commit()
+        return {"status": "success", "archived": archived, "chunks": chunks}
+
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        conn.rollback()
+        print(f"Error archiving messages: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        conn.close()
+
+# --- Notification Functions ---
+
+def create_notification(user_id, notification_type, message, link=None):
+    """
+    Stores a notification and increments the user's unread counter in one transaction.
+
+    Returns:
+        dict: The stored notification, or None on error.
+    """
+    notification = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO notifications (user_id, notification_type, message, link)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, notification_type, message, link))
+            notification_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO notification_counters (user_id, unread_count) VALUES (?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET unread_count = unread_count + 1
+            ''', (user_id,))
+            cursor.execute("SELECT creation_date FROM notifications WHERE notification_id = ?", (notification_id,))
+            creation_date = cursor.fetchone()[0]
+            conn.commit()
+            notification = {
+                'notification_id': notification_id,
+                'user_id': user_id,
+                'notification_type': notification_type,
+                'message': message,
+                'link': link,
+                'is_read': False,
+                'creation_date': creation_date
+            }
+        except sqlite3.Error as e:
+            print(f"Error creating notification: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+    return notification
+
+def _notification_from_row(row):
+    return {
+        'notification_id': row[0],
+        'user_id': row[1],
+        'notification_type': row[2],
+        'message': row[3],
+        'link': row[4],
+        'is_read': bool(row[5]),
+        'creation_date': row[6]
+    }
+
+def get_notifications(user_id, limit=20, before_id=None):
+    """
+    Retrieves a user's notifications, newest first (keyset pagination on notification_id).
+    """
+    notifications = []
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT notification_id, user_id, notification_type, message, link, is_read, creation_date
+                FROM notifications
+                WHERE user_id = ? AND (? IS NULL OR notification_id < ?)
+                ORDER BY notification_id DESC
+                LIMIT ?
+            ''', (user_id, before_id, before_id, limit))
+            notifications = [_notification_from_row(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving notifications: {e}")
+        finally:
+            conn.close()
+    return notifications
+
+def get_undelivered_notifications(user_id):
+    """Retrieves the notifications not yet pushed to the user, oldest first."""
+    notifications = []
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT notification_id, user_id, notification_type, message, link, is_read, creation_date
+                FROM notifications
+                WHERE user_id = ? AND is_delivered = 0
+                ORDER BY notification_id
+            ''', (user_id,))
+            notifications = [_notification_from_row(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving undelivered notifications: {e}")
+        finally:
+            conn.close()
+    return notifications
+
+def mark_notifications_delivered(notification_ids):
+    success = False
+    if not notification_ids:
+        return True
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE notifications SET is_delivered = 1 WHERE notification_id = ?",
+                               [(notification_id,) for notification_id in notification_ids])
+            conn.commit()
+            success = True
+        except sqlite3.Error as e:
+            print(f"Error marking notifications as delivered: {e}")
+        finally:
+            conn.close()
+    return success
+
+def mark_notifications_read(user_id, notification_ids=None):
+    """
+    Marks the given notifications (or all of them if None) as read and
+    lowers the unread counter by the number of rows that actually changed.
+
+    Returns:
+        int: New unread count, or None on error.
+    """
+    unread_count = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            if notification_ids is None:
+                cursor.execute("UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0", (user_id,))
+                changed = cursor.rowcount
+            else:
+                changed = 0
+                for notification_id in notification_ids:
+                    cursor.execute('''
+                        UPDATE notifications SET is_read = 1
+                        WHERE notification_id = ? AND user_id = ? AND is_read = 0
+                    ''', (notification_id, user_id))
+                    changed += cursor.rowcount
+            cursor.execute('''
+                UPDATE notification_counters SET unread_count = MAX(unread_count - ?, 0)
+                WHERE user_id = ?
+            ''', (changed, user_id))
+            cursor.execute("SELECT unread_count FROM notification_counters WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            conn.commit()
+            unread_count = row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Error marking notifications as read: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+    return unread_count
+
+def get_unread_notifications_count(user_id):
+    """Reads the counter row instead of counting notifications."""
+    unread_count = 0
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT unread_count FROM notification_counters WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            unread_count = row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Error retrieving unread notifications count: {e}")
+        finally:
+            conn.close()
+    return unread_count
+
+# --- Email Outbox Functions (see outbox.py) ---
+def enqueue_email(recipient, subject, body, html=None):
+    """
+    Queues an email, outbox.py sends it in the background.
+    Returns the email_id, or None on error.
+    """
+    email_id = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            INSERT INTO email_outbox (recipient, subject, body, html, next_attempt_at)
+            VALUES (?, ?, ?, ?, datetime('now'))
+            ''', (recipient, subject, body, html))
+            conn.commit()
+            email_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error queuing email: {e}")
+        finally:
+            conn.close()
+    return email_id
+
+def claim_outbox_batch(claim_token, limit, stale_after_seconds):
+    """
+    Claims up to limit due emails for one sender in a single UPDATE, so two workers
+    never send the same message. Emails left in 'sending' for longer than
+    stale_after_seconds (sender died mid-batch) are claimed again.
+
+    Returns:
+        list: Dicts with email_id, recipient, subject, body, html, attempts. None on error.
+    """
+    emails = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE email_outbox SET status = 'sending', claim_token = ?, claimed_at = datetime('now')
+            WHERE email_id IN (
+                SELECT email_id FROM email_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= datetime('now'))
+                   OR (status = 'sending' AND claimed_at <= datetime('now', ?))
+                ORDER BY email_id
+                LIMIT ?
+            )
+            ''', (claim_token, f"-{int(stale_after_seconds)} seconds", limit))
+            conn.commit()
+            cursor.execute('''
+            SELECT email_id, recipient, subject, body, html, attempts
+            FROM email_outbox WHERE claim_token = ? AND status = 'sending'
+            ORDER BY email_id
+            ''', (claim_token,))
+            emails = [
+                {'email_id': row[0], 'recipient': row[1], 'subject': row[2], 'body': row[3], 'html': row[4], 'attempts': row[5]}
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            print(f"Error claiming outbox batch: {e}")
+        finally:
+            conn.close()
+    return emails
+
+def mark_emails_sent(email_ids):
+    """Marks a batch of claimed emails as sent. Returns True on success."""
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.executemany('''
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = datetime('now'), attempts = attempts + 1, claim_token = NULL, last_error = NULL
+            WHERE email_id = ?
+            ''', [(email_id,) for email_id in email_ids])
+            conn.commit()
+            success = True
+        except sqlite3.Error as e:
+            print(f"Error marking emails as sent: {e}")
+        finally:
+            conn.close()
+    return success
+
+def reschedule_email(email_id, error, delay_seconds, give_up=False):
+    """
+    Records a failed attempt: the email goes back to 'pending' and is retried after
+    delay_seconds, or is left as 'failed' when give_up is True. Returns True on success.
+    """
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE email_outbox
+            SET status = ?, attempts = attempts + 1, last_error = ?, claim_token = NULL,
+                next_attempt_at = datetime('now', ?)
+            WHERE email_id = ?
+            ''', ('failed' if give_up else 'pending', str(error)[:500], f"+{int(delay_seconds)} seconds", email_id))
+            conn.commit()
+            success = cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error rescheduling email: {e}")
+        finally:
+            conn.close()
+    return success
+
+def get_outbox_counts():
+    """Number of emails per status, e.g. {'pending': 3, 'sent': 120}. None on error."""
+    counts = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status")
+            counts = dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error counting outbox emails: {e}")
+        finally:
+            conn.close()
+    return counts
+
+
+# --- Moderation Functions ---
+
+def get_moderation_terms():
+    """
+    Retrieves all banned terms used by the moderation filter.
+
+    Returns:
+        list: List of dictionaries with term_id, term, action and creation_date.
+              Empty list if there are no terms or an error occurs.
+    """
+    terms = []
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT term_id, term, action, creation_date
+                FROM moderation_terms
+                ORDER BY term
+            ''')
+
+            for row in cursor.fetchall():
+                terms.append({
+                    'term_id': row[0],
+                    'term': row[1],
+                    'action': row[2],
+                    'creation_date': row[3]
+                })
+
+        except sqlite3.Error as e:
+            print(f"Error retrieving moderation terms: {e}")
+        finally:
+            conn.close()
+
+    return terms
+
+def get_moderation_signature():
+    """
+    Returns a cheap fingerprint (row count, highest term_id) of the moderation_terms table.
+    Used by moderation.py to detect changes made from another worker. None on error.
+    """
+    signature = None
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*), COALESCE(MAX(term_id), 0) FROM moderation_terms")
+            signature = cursor.fetchone()
+        except sqlite3.Error as e:
+            print(f"Error reading moderation signature: {e}")
+        finally:
+            conn.close()
+
+    return signature
+
+def add_moderation_term(term, action):
+    """
+    Adds a banned term.
+
+    Args:
+        term (str): Word or link fragment to filter.
+        action (str): 'mask' or 'reject'.
+
+    Returns:
+        int: ID of the created term if successful, None otherwise.
+    """
+    term_id = None
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO moderation_terms (term, action)
+                VALUES (?, ?)
+            ''', (term, action))
+            conn.commit()
+            term_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error adding moderation term: {e}")
+        finally:
+            conn.close()
+
+    return term_id
+
+def delete_moderation_term(term_id):
+    """
+    Deletes a banned term.
+
+    Returns:
+        bool: True if successful, False otherwise.
+    """
+    success = False
+    conn = db_conn.create_connection()
+
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM moderation_terms WHERE term_id = ?", (term_id,))
+            conn.commit()
+            success = cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error retrieving users for admin view: {e}")
+            print(f"Error deleting moderation term: {e}")
         finally:
             conn.close()
-    
-    return users_list
 
-def orgs_view():
+    return success
+
+# --- Scheduled Job Functions (see scheduler.py) ---
+_JOB_COLUMNS = ('job_name', 'interval_seconds', 'next_run_at', 'status', 'lock_owner', 'lock_expires_at',
+                'progress_done', 'progress_total', 'progress_message', 'last_started_at', 'last_finished_at',
+                'last_status', 'last_message', 'run_count')
+
+def register_scheduled_job(job_name, interval_seconds):
     """
-    Retrieves all organizations from the database for admin viewing.
-    Returns all organization information except passwords.
-    
+    Creates the row of a job if it doesn't exist yet and keeps its interval up to date.
+    A new periodic job is due right away, a one-off job (interval None) only when requested.
+
     Returns:
-        list: A list of dictionaries containing organization data without passwords.
+        bool: True on success, False on error.
     """
-    orgs_list = []
+    success = False
     conn = db_conn.create_connection()
-    
     if conn is not None:
         try:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT org_id, name, email, description, 
-                       interests, points, creation_date, creator_student_code
-                FROM organizations
-                ORDER BY creation_date DESC
-            ''')
-            
-            for row in cursor.fetchall():
-                org_data = {
-                    'org_id': row[0],
-                    'name': row[1],
-                    'email': row[2],
-                    'description': row[3],
-                    'interests': row[4],
-                    'points': row[5],
-                    'creation_date': row[6],
-                    'creator_student_code': row[7]
-                }
-                orgs_list.append(org_data)
-                
-            print(f"Retrieved {len(orgs_list)} organizations for admin view.")
-            
+            INSERT INTO scheduled_jobs (job_name, interval_seconds, next_run_at)
+            VALUES (?, ?, CASE WHEN ? IS NULL THEN NULL ELSE datetime('now') END)
+            ON CONFLICT(job_name) DO UPDATE SET
+                interval_seconds = excluded.interval_seconds,
+                next_run_at = CASE
+                    WHEN excluded.interval_seconds IS NOT NULL AND next_run_at IS NULL THEN datetime('now')
+                    ELSE next_run_at END
+            ''', (job_name, interval_seconds, interval_seconds))
+            conn.commit()
+            success = True
         except sqlite3.Error as e:
-            print(f"Error retrieving organizations for admin view: {e}")
+            print(f"Error registering scheduled job {job_name}: {e}")
         finally:
             conn.close()
-    
-    return orgs_list
+    return success
 
-# --- Messaging Functions ---
+def get_due_jobs(job_names):
+    """
+    Names among job_names that should run now: due and not running, or still
+    'running' under a lease that expired (the worker running it died).
 
-def save_message(sender_id: int, sender_type: str, recipient_id: int, recipient_type: str, content: str) -> dict:
-    
-    '''
-    Saves a message in the database.
-    saves sender_id, recipient_id and content in the messages table.
-    Validates if content is a non-empty string.
-    
-    Returns a dict with the status and message ID.
-    '''
-    
-    result = None
-    
-    # Validate if content isn't empty and is a string
-    if not isinstance(content, str) or len(content.strip()) == 0:
-        result = {"status": "error", "message": "Content must be a non-empty string"}
+    Returns:
+        list: Job names, most overdue first. None on error.
+    """
+    if not job_names:
+        return []
+    due = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            placeholders = ', '.join('?' * len(job_names))
+            cursor.execute(f'''
+            SELECT job_name FROM scheduled_jobs
+            WHERE job_name IN ({placeholders})
+              AND ((status != 'running' AND next_run_at <= datetime('now'))
+                   OR (status = 'running' AND lock_expires_at <= datetime('now')))
+            ORDER BY next_run_at
+            ''', list(job_names))
+            due = [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error reading due jobs: {e}")
+        finally:
+            conn.close()
+    return due
 
-    else:
-        conn = db_conn.create_connection()
-        if conn is None:
-            result = {"status": "error", "message": "Database connection failed"}
+def claim_scheduled_job(job_name, owner, lease_seconds):
+    """
+    Takes the lease of a due job with a single conditional UPDATE, so only one
+    worker (of however many run the scheduler) runs it.
 
-        else:
-            try:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO messages (sender_id, sender_type, recipient_id, recipient_type, content)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (sender_id, sender_type, recipient_id, recipient_type, content))
-                conn.commit()
-                result = {"status": "success", "message_id": cursor.lastrowid}
+    Returns:
+        bool: True if this owner got the job, False otherwise.
+    """
+    claimed = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE scheduled_jobs
+            SET status = 'running', lock_owner = ?, lock_expires_at = datetime('now', ?),
+                last_started_at = datetime('now'), progress_done = 0, progress_total = NULL, progress_message = NULL
+            WHERE job_name = ?
+              AND ((status != 'running' AND next_run_at <= datetime('now'))
+                   OR (status = 'running' AND lock_expires_at <= datetime('now')))
+            ''', (owner, f"+{int(lease_seconds)} seconds", job_name))
+            conn.commit()
+            claimed = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"Error claiming scheduled job {job_name}: {e}")
+        finally:
+            conn.close()
+    return claimed
 
-            except sqlite3.Error as e:
-                result = {"status": "error", "message": str(e)}
+def update_scheduled_job_progress(job_name, owner, done, total, message, lease_seconds):
+    """
+    Records the progress of a running job and extends its lease.
 
-            finally:
-                conn.close()
+    Returns:
+        bool: False if the owner lost the lease (or on error), the job should stop then.
+    """
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE scheduled_jobs
+            SET progress_done = ?, progress_total = ?, progress_message = ?, lock_expires_at = datetime('now', ?)
+            WHERE job_name = ? AND lock_owner = ?
+            ''', (done, total, message, f"+{int(lease_seconds)} seconds", job_name, owner))
+            conn.commit()
+            success = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"Error updating progress of job {job_name}: {e}")
+        finally:
+            conn.close()
+    return success
 
-    return result
+def finish_scheduled_job(job_name, owner, last_status, message):
+    """
+    Releases the lease of a job and schedules its next run: interval_seconds from
+    now for periodic jobs, none for one-off jobs. Returns True on success.
+    """
+    success = False
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+            UPDATE scheduled_jobs
+            SET status = 'idle', lock_owner = NULL, lock_expires_at = NULL,
+                last_finished_at = datetime('now'), last_status = ?, last_message = ?, run_count = run_count + 1,
+                next_run_at = CASE WHEN interval_seconds IS NULL THEN NULL
+                                   ELSE datetime('now', '+' || interval_seconds || ' seconds') END
+            WHERE job_name = ? AND lock_owner = ?
+            ''', (last_status, str(message)[:500] if message is not None else None, job_name, owner))
+            conn.commit()
+            success = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"Error finishing job {job_name}: {e}")
+        finally:
+            conn.close()
+    return success
 
-def get_conversation (user1_id: int, user1_type: str, user2_id: int, user2_type: str, limit: int = 10) -> dict:
+def request_scheduled_job_run(job_name):
+    """
+    Makes a job due now. A job that is already queued or running is left as it is.
 
-    '''
-    Retrieves messages exchanged between two users.
-    Optional: limit to last 10 messages
-    Returns a dict with the status and the messages data.
-    
-    
     Returns:
-        dict: A dictionary containing the status and messages data.
-        data: dict with message details.
-    '''
-    response = None
-    messages = []
+        bool: True if queued, False if it was already queued or running. None on error.
+    """
+    queued = None
     conn = db_conn.create_connection()
-
-    #validate if conn is successfully created
-    if conn is None:
-        response = {"status": "error", "message": "Database connection failed"}
-
-    else:
+    if conn is not None:
         try:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT message_id, sender_id, sender_type, recipient_id, recipient_type, content, timestamp, is_read
-                FROM messages
-                WHERE (sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ?)
-                   OR (sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ?)
-                ORDER BY timestamp DESC -- Obtener los más recientes primero
-                LIMIT ?
-            ''', (user1_id, user1_type, user2_id, user2_type,
-                  user2_id, user2_type, user1_id, user1_type,
-                  limit))
-
-            rows = reversed(cursor.fetchall()) #get revert messages to show in UI
-            for row in rows:
-                messages.append({
-                    'message_id': row[0],
-                    'sender_id': row[1],
-                    'sender_type': row[2],
-                    'recipient_id': row[3],
-                    'recipient_type': row[4],
-                    'content': row[5],
-                    'timestamp': row[6],
-                    'is_read': bool(row[7])
-                })
+            UPDATE scheduled_jobs SET status = 'queued', next_run_at = datetime('now')
+            WHERE job_name = ? AND status = 'idle'
+            ''', (job_name,))
+            conn.commit()
+            queued = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            print(f"Error queuing job {job_name}: {e}")
+        finally:
+            conn.close()
+    return queued
 
-            response = {
-                "status": "success",
-                "data": messages
-            }
+def get_scheduled_jobs():
+    """
+    State of every job, for the admin jobs page. Times are UTC.
 
+    Returns:
+        list: Dicts with the scheduled_jobs columns, by name. None on error.
+    """
+    jobs = None
+    conn = db_conn.create_connection()
+    if conn is not None:
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM scheduled_jobs ORDER BY job_name")
+            jobs = [dict(zip(_JOB_COLUMNS, row)) for row in cursor.fetchall()]
         except sqlite3.Error as e:
-            response = {"status": "error", "message": str(e)}
-
+            print(f"Error reading scheduled jobs: {e}")
         finally:
             conn.close()
-    return response
+    return jobs
 
-def mark_message_as_read(recipient_id: int, recipient_type: str, sender_id: int, sender_type: str) -> dict:
+def reconcile_org_points(after_org_id=0, limit=500, org_ids=None):
     """
-    Marks messages as read for a specific recipient and sender.
-    
+    Sets the points of organizations to their own points (own_points, see
+    add_org_own_points) plus the sum of their members' points, one keyset batch
+    at a time (org_id > after_org_id). Organizations without members are left as they are. A row whose points changed since it was read is not
+    overwritten, the next run picks it up.
+
     Args:
-        recipient_id (int): The ID of the recipient.
-        recipient_type (str): The type of the recipient ('user' or 'org').
-        sender_id (int): The ID of the sender.
-        sender_type (str): The type of the sender ('user' or 'org').
+        after_org_id (int): Last org_id of the previous batch.
+        limit (int): Batch size.
+        org_ids (list): Only these organizations (ignores the keyset), or None for all.
 
     Returns:
-        dict: A dictionary containing the status and message ID.
+        dict: {'last_org_id': int or None when there are no more, 'scanned': int,
+               'updated': [(org_id, old_points, new_points), ...]}, or None on error.
     """
     result = None
     conn = db_conn.create_connection()
-
-    if conn is None:
-        result = {"status": "error", "message": "Database connection failed"}
-    else:
+    if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE messages
-                SET is_read = 1
-                WHERE sender_id = ? AND sender_type = ? AND recipient_id = ? AND recipient_type = ? AND is_read = ?
-            ''', (sender_id, sender_type, recipient_id, recipient_type, 0))
-
-            conn.commit()
-            result = {"status": "success", "message": f"Marked {cursor.rowcount} messages as read."}
-
+            if org_ids is not None:
+                placeholders = ', '.join('?' * len(org_ids)) or 'NULL'
+                where, params = f"o.org_id IN ({placeholders})", list(org_ids)
+            else:
+                where, params = "o.org_id > ?", [after_org_id]
+            cursor.execute(f'''
+            SELECT o.org_id, o.points, COALESCE(o.own_points, 0) + SUM(COALESCE(u.points, 0))
+            FROM organizations o
+            JOIN organization_members m ON m.org_id = o.org_id
+            LEFT JOIN users u ON u.user_id = m.user_id
+            WHERE {where}
+            GROUP BY o.org_id
+            ORDER BY o.org_id
+            LIMIT ?
+            ''', params + [limit])
+            rows = cursor.fetchall()
+            updated = [(org_id, old, new) for org_id, old, new in rows if (old or 0) != new]
+            if updated:
+                cursor.executemany('''
+                UPDATE organizations SET points = ? WHERE org_id = ? AND points IS ?
+                ''', [(new, org_id, old) for org_id, old, new in updated])
+                conn.commit()
+                for org_id, _, _ in updated:
+                    entity_cache.invalidate('org', org_id)
+            result = {
+                'last_org_id': rows[-1][0] if len(rows) == limit and org_ids is None else None,
+                'scanned': len(rows),
+                'updated': updated,
+            }
         except sqlite3.Error as e:
-            result = {"status": "error", "message": str(e)}
-
+            conn.rollback()
+            print(f"Error reconciling organization points: {e}")
         finally:
             conn.close()
-
     return result
 
-def get_group_conversation (org_id: int, limit: int = 50) -> dict:
+def expire_challenges_batch(user_type, limit=500):
     """
-    Retrieves messages exchanged in a group conversation for a specific organization.
-    
-    Args:
-        org_id (int): The ID of the organization.
-        limit (int): The maximum number of messages to retrieve.
+    Marks up to limit active challenges of users or organizations whose deadline
+    passed as 'expired'. Deadlines are local time, as join_challenge writes them.
 
     Returns:
-        dict: A dictionary containing the status and messages data.
+        int: Number of challenges expired, None on error.
     """
-    response = None
-    messages = []
-    conn = db_conn.create_connection()
-
-    if conn is None:
-        response = {"status": "error", "message": "Database connection failed"}
+    if user_type == "user":
+        progress_table = "user_challenges"
+    elif user_type == "org":
+        progress_table = "org_challenges"
     else:
+        print(f"Error: Invalid user_type: {user_type}")
+        return None
+    expired = None
+    conn = db_conn.create_connection()
+    if conn is not None:
         try:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT message_id, sender_id, sender_type, recipient_id, recipient_type, content, timestamp, is_read
-                FROM messages
-                WHERE recipient_id = ? AND recipient_type = 'org'
-                ORDER BY timestamp DESC -- Get newest first
+            cursor.execute(f'''
+            UPDATE {progress_table} SET challenge_status = 'expired'
+            WHERE id IN (
+                SELECT id FROM {progress_table}
+                WHERE challenge_status = 'active' AND deadline IS NOT NULL
+                  AND deadline <= datetime('now', 'localtime')
                 LIMIT ?
-            ''', (org_id, limit))
-
-            rows = reversed(cursor.fetchall()) #get revert messages to show in UI
-            for row in rows:
-                messages.append({
-                    'message_id': row[0],
-                    'sender_id': row[1],
-                    'sender_type': row[2],
-                    'recipient_id': row[3],
-                    'recipient_type': row[4],
-                    'content': row[5],
-                    'timestamp': row[6],
-                    'is_read': bool(row[7])
-                })
-
-            response = {
-                "status": "success",
-                "data": messages
-            }
-
+            )
+            ''', (limit,))
+            conn.commit()
+            expired = cursor.rowcount
         except sqlite3.Error as e:
-            response = {"status": "error", "message": str(e)}
-
+            print(f"Error expiring {user_type} challenges: {e}")
         finally:
             conn.close()
-    return response
\ No newline at end of file
+    return expired
@@ -0,0 +1,110 @@
+'''Cache of user and organization rows (db_operator.get_user_by_id / get_org_by_id)'''
+'''
+Two layers:
+- request memo: inside a Flask request (flask.g) the same id is read at most
+  once, however many times the profile, the chat or award_points ask for it.
+- process LRU: rows kept for ENTITY_CACHE_TTL seconds (env, default 30) and at
+  most ENTITY_CACHE_MAX_ENTRIES rows.
+
+db_operator invalidates an entry right after every write to users or
+organizations (write-through), so this process never serves a stale row after
+its own writes. Other workers may serve a row up to the TTL old.
+
+Callers get a copy of the row, so they can modify it (e.g. drop the password)
+without touching the cache.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_app_context
+
+ENTITY_CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 30))
+ENTITY_CACHE_MAX_ENTRIES = int(os.environ.get('ENTITY_CACHE_MAX_ENTRIES', 1024))
+
+_entries = OrderedDict()  # (entity_type, entity_id) -> (expires, row)
+_lock = threading.Lock()
+
+
+def _request_memo():
+    """The memo dict of the current request, None outside of Flask."""
+    if not has_app_context():
+        return None
+    if 'entity_memo' not in g:
+        g.entity_memo = {}
+    return g.entity_memo
+
+
+def get(entity_type, entity_id, loader):
+    """
+    Returns the row of an entity, loading it with loader(entity_id) on a miss.
+
+    Args:
+        entity_type (str): 'user' or 'org'.
+        entity_id (int): The id.
+        loader (callable): Reads the row from the database, returns a dict or None.
+
+    Returns:
+        dict: A copy of the row, or None if it does not exist.
+    """
+    try:
+        key = (entity_type, int(entity_id))
+    except (TypeError, ValueError):
+        return loader(entity_id)
+
+    memo = _request_memo()
+    if memo is not None and key in memo:
+        row = memo[key]
+        return dict(row) if row is not None else None
+
+    now = time.time()
+    with _lock:
+        cached = _entries.get(key)
+        if cached and cached[0] > now:
+            _entries.move_to_end(key)
+            row = cached[1]
+        else:
+            row = None
+            cached = None
+
+    if cached is None:
+        row = loader(entity_id)
+        # Missing rows are only memoized for the request, a new account may take the id
+        if row is not None:
+            with _lock:
+                _entries[key] = (now + ENTITY_CACHE_TTL, row)
+                _entries.move_to_end(key)
+                while len(_entries) > ENTITY_CACHE_MAX_ENTRIES:
+                    _entries.popitem(last=False)
+
+    if memo is not None:
+        memo[key] = row
+    return dict(row) if row is not None else None
+
+
+def invalidate(entity_type, entity_id=None):
+    """
+    Drops an entity from both layers, or every entity of the type when entity_id
+    is None (deletes by student code, where the id is not known).
+    """
+    with _lock:
+        if entity_id is None:
+            for key in [key for key in _entries if key[0] == entity_type]:
+                del _entries[key]
+        else:
+            _entries.pop((entity_type, int(entity_id)), None)
+
+    memo = _request_memo()
+    if memo is not None:
+        if entity_id is None:
+            for key in [key for key in memo if key[0] == entity_type]:
+                del memo[key]
+        else:
+            memo.pop((entity_type, int(entity_id)), None)
+
+
+def clear():
+    """Drops every cached row."""
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,222 @@
+'''Streaming exports of users, events, participation and exchanges (CSV or Parquet)'''
+'''
+University reporting asks for full dumps. users_view / orgs_view build a list of
+every row, so an export here never does: db_operator.iter_export_rows reads the
+dataset in keyset batches and the writers below turn each batch into output
+right away. Memory stays at one batch (CSV) or one row group (Parquet) however
+large the tables are.
+
+- CSV: UTF-8 with a BOM so Excel shows the accents, sent in chunks of CSV_CHUNK_ROWS rows.
+- Parquet: one row group per PARQUET_ROW_GROUP rows, typed columns. Needs pyarrow,
+  which is optional (pip install pyarrow); without it only CSV is offered.
+
+Both support column projection (only the requested columns are selected) and a
+date range on the dataset's date column (creation / registration / request date),
+inclusive on both days.
+
+Served at /admin/export/<dataset> and from the command line:
+
+    python exports.py users --format parquet --columns user_id,career,points --since 2025-01-01 -o users.parquet
+    python exports.py participation --until 2025-06-30 -o participation.csv
+'''
+
+import argparse
+import csv
+import io
+from datetime import datetime, timedelta
+#CUSTOM MODULES
+import db_operator
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CSV_CHUNK_ROWS = 500
+PARQUET_ROW_GROUP = 10000
+BATCH_SIZE = 1000
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+DATASETS = db_operator.EXPORT_DATASETS
+
+
+def available_formats():
+    """Formats this installation can write ('parquet' only with pyarrow)."""
+    return [fmt for fmt in FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def _parse_day(value, label):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"La fecha '{label}' debe tener el formato AAAA-MM-DD.") from None
+
+
+def _validate(dataset, fmt, columns, since, until):
+    """Checks the parameters. Returns (columns, since, until) as iter_export_rows wants them."""
+    if dataset not in DATASETS:
+        raise ValueError(f"Conjunto de datos desconocido. Opciones: {', '.join(DATASETS)}.")
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido. Opciones: {', '.join(FORMATS)}.")
+    if fmt not in available_formats():
+        raise ValueError("La exportación a Parquet requiere pyarrow (pip install pyarrow).")
+
+    known = DATASETS[dataset]['columns']
+    if columns:
+        unknown = [column for column in columns if column not in known]
+        if unknown:
+            raise ValueError(f"Columnas desconocidas: {', '.join(unknown)}. Opciones: {', '.join(known)}.")
+        columns = list(dict.fromkeys(columns))
+    else:
+        columns = list(known)
+
+    since_day = _parse_day(since, 'desde') if since else None
+    until_day = _parse_day(until, 'hasta') if until else None
+    if since_day and until_day and until_day < since_day:
+        raise ValueError("La fecha 'hasta' es anterior a 'desde'.")
+    # Dates are stored as 'YYYY-MM-DD HH:MM:SS' text, the until day is included whole
+    since_value = since_day.strftime('%Y-%m-%d') if since_day else None
+    until_value = (until_day + timedelta(days=1)).strftime('%Y-%m-%d') if until_day else None
+    return columns, since_value, until_value
+
+
+def iter_csv(rows, columns):
+    """Yields the CSV text in chunks of CSV_CHUNK_ROWS rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # BOM
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """Write-only file for ParquetWriter that hands over what was written so far."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Offsets in the Parquet footer are absolute, so this counts everything ever written
+        return self._position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+_ARROW_TYPES = {'int': 'int64', 'float': 'float64', 'bool': 'bool_', 'str': 'string'}  # pyarrow type factories
+
+
+def iter_parquet(rows, columns, types):
+    """Yields a Parquet file in pieces, one row group of PARQUET_ROW_GROUP rows at a time."""
+    schema = pyarrow.schema([(column, getattr(pyarrow, _ARROW_TYPES[types[column]])()) for column in columns])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        group = []
+        for row in rows:
+            group.append(row)
+            if len(group) >= PARQUET_ROW_GROUP:
+                _write_group(writer, schema, group)
+                group = []
+                yield sink.take()
+        if group:
+            _write_group(writer, schema, group)
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def _write_group(writer, schema, group):
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in group]
+        if pyarrow.types.is_boolean(field.type):
+            values = [None if value is None else bool(value) for value in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema), row_group_size=len(group))
+
+
+def open_export(dataset, fmt='csv', columns=None, since=None, until=None):
+    """
+    Validates an export and returns it ready to stream. Nothing is read until the chunks are iterated.
+
+    Args:
+        dataset (str): users, events, participation or exchanges.
+        fmt (str): 'csv' or 'parquet'.
+        columns (list): Column names to include, None or empty for all of them.
+        since (str): First day included, 'YYYY-MM-DD', or None.
+        until (str): Last day included, 'YYYY-MM-DD', or None.
+
+    Returns:
+        tuple: (chunks generator, mimetype, file name).
+
+    Raises:
+        ValueError: With a message for the admin, on invalid parameters.
+    """
+    columns, since_value, until_value = _validate(dataset, fmt, columns, since, until)
+    rows = db_operator.iter_export_rows(dataset, columns, since_value, until_value, BATCH_SIZE)
+    if fmt == 'parquet':
+        chunks = iter_parquet(rows, columns, DATASETS[dataset]['columns'])
+    else:
+        chunks = iter_csv(rows, columns)
+    mimetype, extension = FORMATS[fmt]
+    suffix = ''.join(f"_{day.replace('-', '')}" for day in (since, until) if day)
+    return chunks, mimetype, f"{dataset}{suffix}.{extension}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a dataset as CSV or Parquet.")
+    parser.add_argument('dataset', choices=list(DATASETS))
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--columns', help="comma separated, default all")
+    parser.add_argument('--since', help="first day included, YYYY-MM-DD")
+    parser.add_argument('--until', help="last day included, YYYY-MM-DD")
+    # A file, not stdout: db_conn logs every connection to stdout
+    parser.add_argument('-o', '--output', required=True, help="file to write")
+    args = parser.parse_args(argv)
+
+    columns = [column.strip() for column in args.columns.split(',') if column.strip()] if args.columns else None
+    try:
+        chunks, _, _ = open_export(args.dataset, args.format, columns, args.since, args.until)
+    except ValueError as e:
+        parser.error(str(e))
+
+    mode, encoding = ('wb', None) if args.format == 'parquet' else ('w', 'utf-8')
+    with open(args.output, mode, encoding=encoding, newline='' if encoding else None) as output:
+        for chunk in chunks:
+            output.write(chunk)
+    print(f"Export of {args.dataset} written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+'''Geographic helpers for the community map'''
+'''
+Cluster grid: cells follow the Web Mercator tiles Leaflet draws. At zoom z a
+tile is 256px and is split into 2^CLUSTER_CELL_BITS cells per side, so a cell
+is always ~64px on screen and the number of clusters per viewport depends on
+the screen size, not on the number of points.
+'''
+
+import math
+
+MAX_MERCATOR_LAT = 85.05112878  # Web Mercator is undefined at the poles
+CLUSTER_MAX_ZOOM = 15           # above this (street level) the map shows the individual points
+CLUSTER_CELL_BITS = 2           # 4x4 cells per 256px tile -> 64px cells
+
+
+def clamp_lat(lat):
+    return max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+
+
+def cell_for(lat, lng, zoom):
+    """
+    Returns the (cell_x, cell_y) grid cell containing a coordinate at a zoom level.
+    """
+    cells = 2 ** (zoom + CLUSTER_CELL_BITS)
+    lat_rad = math.radians(clamp_lat(lat))
+    x = (lng + 180.0) / 360.0 * cells
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * cells
+    return (
+        min(cells - 1, max(0, int(math.floor(x)))),
+        min(cells - 1, max(0, int(math.floor(y))))
+    )
+
+
+def cell_ranges(min_lat, min_lng, max_lat, max_lng, zoom):
+    """
+    Returns the cell ranges [(min_x, max_x, min_y, max_y), ...] covering a bounding box.
+    Two ranges when the box crosses the antimeridian (min_lng > max_lng).
+    """
+    # y grows southwards in Mercator tiles
+    _, min_y = cell_for(max_lat, 0, zoom)
+    _, max_y = cell_for(min_lat, 0, zoom)
+    if min_lng <= max_lng:
+        lng_ranges = [(min_lng, max_lng)]
+    else:
+        lng_ranges = [(min_lng, 180.0), (-180.0, max_lng)]
+
+    ranges = []
+    for range_min, range_max in lng_ranges:
+        min_x, _ = cell_for(0, range_min, zoom)
+        max_x, _ = cell_for(0, range_max, zoom)
+        ranges.append((min_x, max_x, min_y, max_y))
+    return ranges
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two coordinates, in kilometres."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_around(lat, lng, radius_km):
+    """
+    Returns (min_lat, min_lng, max_lat, max_lng) of a box containing the circle of
+    radius_km around a coordinate. min_lng > max_lng when it crosses the antimeridian.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE_LAT
+    min_lat = max(-90.0, lat - lat_delta)
+    max_lat = min(90.0, lat + lat_delta)
+
+    # Near the poles (or for huge radii) the circle covers every longitude
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-6 or min_lat == -90.0 or max_lat == 90.0:
+        return (min_lat, -180.0, max_lat, 180.0)
+    lng_delta = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    if lng_delta >= 180:
+        return (min_lat, -180.0, max_lat, 180.0)
+
+    min_lng = ((lng - lng_delta + 180) % 360) - 180
+    max_lng = ((lng + lng_delta + 180) % 360) - 180
+    return (min_lat, min_lng, max_lat, max_lng)
+
+
+# --- Geohash (duplicate detection buckets) ---
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9  # stored precision (~5m cells); shorter prefixes are the parent cells
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        value_range, value = (lng_range, lng) if even else (lat_range, lat)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits = bits << 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Returns (height, width) of a geohash cell in degrees."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def geohash_precision_for(radius_m, lat):
+    """
+    Longest geohash precision whose cells are at least radius_m tall and wide at this
+    latitude, so a cell plus its 8 neighbours always contains the whole search circle.
+    """
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        if height * KM_PER_DEGREE_LAT * 1000 >= radius_m and width * KM_PER_DEGREE_LAT * 1000 * cos_lat >= radius_m:
+            return precision
+    return 1
+
+
+def geohash_neighbourhood(lat, lng, precision):
+    """Returns the geohash cell of a coordinate and its (up to) 8 neighbours."""
+    height, width = geohash_cell_size(precision)
+    cells = set()
+    for d_lat in (-height, 0, height):
+        for d_lng in (-width, 0, width):
+            neighbour_lat = lat + d_lat
+            if -90 <= neighbour_lat <= 90:
+                neighbour_lng = ((lng + d_lng + 180) % 360) - 180
+                cells.add(geohash_encode(neighbour_lat, neighbour_lng, precision))
+    return sorted(cells)
@@ -0,0 +1,129 @@
+'''Density rasters of map points and event activity for the admin heatmap'''
+'''
+The rasters follow the Web Mercator tiles Leaflet draws (like the clusters in
+geo.py): at zoom z each 256px tile is a HEATMAP_TILE_SIZE x HEATMAP_TILE_SIZE
+grid, so a cell is always 8px on screen. rebuild() bins every coordinate of a
+time window into those grids with NumPy, for all zooms at once per layer:
+- points:   one per map point created in the window
+- events:   1 + registered participants per geocoded event in the window
+- activity: points + events
+
+Only non-empty tiles are stored (heatmap_tiles), as uint8 levels scaled with a
+square root against the densest cell of the zoom level, so sparse areas stay
+visible next to the busy buildings. zoom_max keeps the raw value of level 255.
+'''
+
+import zlib
+from datetime import datetime, timedelta
+import numpy as np
+#CUSTOM MODULES
+import db_operator
+import geo
+
+HEATMAP_TILE_BITS = 5
+HEATMAP_TILE_SIZE = 2 ** HEATMAP_TILE_BITS  # 32x32 cells per 256px tile
+HEATMAP_MIN_ZOOM = 10                       # whole city
+HEATMAP_MAX_ZOOM = 17                       # single buildings
+HEATMAP_WINDOWS = {'7d': 7, '30d': 30, '365d': 365, 'all': None}  # days back, None = everything
+HEATMAP_LAYERS = ('points', 'events', 'activity')
+
+
+def _global_cells(latitudes, longitudes, zoom):
+    """Vectorized geo.cell_for: global (x, y) cell indexes of coordinate arrays at a zoom level."""
+    cells = 2 ** (zoom + HEATMAP_TILE_BITS)
+    lat_rad = np.radians(np.clip(latitudes, -geo.MAX_MERCATOR_LAT, geo.MAX_MERCATOR_LAT))
+    x = (longitudes + 180.0) / 360.0 * cells
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0 * cells
+    x = np.clip(np.floor(x), 0, cells - 1).astype(np.int64)
+    y = np.clip(np.floor(y), 0, cells - 1).astype(np.int64)
+    return x, y
+
+
+def build_tiles(latitudes, longitudes, weights, zoom):
+    """
+    Bins weighted coordinates into the tiles of one zoom level.
+
+    Returns:
+        tuple: (zoom_max, {(tile_x, tile_y): uint8 array HEATMAP_TILE_SIZE x HEATMAP_TILE_SIZE})
+    """
+    cells = 2 ** (zoom + HEATMAP_TILE_BITS)
+    x, y = _global_cells(latitudes, longitudes, zoom)
+
+    # Sum the weights per occupied cell, never allocating the (huge) global grid
+    cell_keys, inverse = np.unique(y * cells + x, return_inverse=True)
+    sums = np.bincount(inverse, weights=weights)
+    cell_y, cell_x = np.divmod(cell_keys, cells)
+    zoom_max = float(sums.max())
+    levels = np.ceil(255 * np.sqrt(sums / zoom_max)).astype(np.uint8)
+
+    # Group the cells by tile: sort once, then slice every tile's run
+    tiles_per_side = 2 ** zoom
+    tile_keys = (cell_y >> HEATMAP_TILE_BITS) * tiles_per_side + (cell_x >> HEATMAP_TILE_BITS)
+    order = np.argsort(tile_keys, kind='stable')
+    tile_keys, cell_x, cell_y, levels = tile_keys[order], cell_x[order], cell_y[order], levels[order]
+    unique_tiles, starts = np.unique(tile_keys, return_index=True)
+    ends = np.append(starts[1:], len(tile_keys))
+
+    tiles = {}
+    mask = HEATMAP_TILE_SIZE - 1
+    for tile_key, start, end in zip(unique_tiles, starts, ends):
+        grid = np.zeros((HEATMAP_TILE_SIZE, HEATMAP_TILE_SIZE), dtype=np.uint8)
+        grid[cell_y[start:end] & mask, cell_x[start:end] & mask] = levels[start:end]
+        tile_y, tile_x = divmod(int(tile_key), tiles_per_side)
+        tiles[(tile_x, tile_y)] = grid
+    return zoom_max, tiles
+
+
+def _window_layers(since):
+    """Coordinate and weight arrays of every layer for one time window, None on database error."""
+    points = db_operator.get_map_point_coordinates(since)
+    events = db_operator.get_event_activity_coordinates(since)
+    if points is None or events is None:
+        return None
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    events = np.array(events, dtype=np.float64).reshape(-1, 3)
+
+    layers = {
+        'points': (points[:, 0], points[:, 1], np.ones(len(points))),
+        'events': (events[:, 0], events[:, 1], events[:, 2] + 1),
+    }
+    layers['activity'] = tuple(np.concatenate(parts) for parts in zip(layers['points'], layers['events']))
+    return layers
+
+
+def rebuild():
+    """
+    Recomputes every window, layer and zoom and replaces the stored tiles.
+
+    Returns:
+        int: Number of tiles stored, or None on error.
+    """
+    now = datetime.now()
+    rows = []
+    for time_window, days in HEATMAP_WINDOWS.items():
+        since = (now - timedelta(days=days)).strftime('%Y-%m-%d') if days else None
+        layers = _window_layers(since)
+        if layers is None:
+            return None
+        for layer, (latitudes, longitudes, weights) in layers.items():
+            if not len(latitudes):
+                continue
+            for zoom in range(HEATMAP_MIN_ZOOM, HEATMAP_MAX_ZOOM + 1):
+                zoom_max, tiles = build_tiles(latitudes, longitudes, weights, zoom)
+                for (tile_x, tile_y), grid in tiles.items():
+                    rows.append((time_window, layer, zoom, tile_x, tile_y, zoom_max, zlib.compress(grid.tobytes())))
+    return db_operator.replace_heatmap_tiles(rows)
+
+
+def get_tile(time_window, layer, zoom, tile_x, tile_y):
+    """
+    Returns one tile as {'size', 'zoom_max', 'data': row-major list of levels 0-255},
+    data is None for an empty tile. None on database error.
+    """
+    tile = db_operator.get_heatmap_tile(time_window, layer, zoom, tile_x, tile_y)
+    if tile is None:
+        return None
+    if not tile:
+        return {'size': HEATMAP_TILE_SIZE, 'zoom_max': 0, 'data': None}
+    grid = np.frombuffer(zlib.decompress(tile['data']), dtype=np.uint8)
+    return {'size': HEATMAP_TILE_SIZE, 'zoom_max': tile['zoom_max'], 'data': grid.tolist()}
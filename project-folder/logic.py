@@ -1,13 +1,35 @@
 import db_operator # Database operations
 import db_conn # Used occasionally for direct DB access
+import moderation # Banned words and spam links filter
+import rate_limiter # Token buckets for socket events
+import notifications # Persisted notifications pushed over Socket.IO
+import map_live # Map point deltas pushed over Socket.IO
+import geo # Map grid and distance helpers
+import heatmap # NumPy density rasters for the admin heatmap
+import response_cache # Cached public pages, invalidated on writes
+import passwords # bcrypt hashing in a bounded process pool
+import user_import # Bulk student onboarding from CSV / JSON
+import outbox # Outgoing mail, queued and sent in batches
+import stats_snapshot # Precomputed admin dashboard numbers
+import analytics # Activity trends from the rollup tables
+import exports # Streaming CSV / Parquet dumps for admins
+import scheduler # Periodic and one-off background jobs
+import profiling # Wall / DB time and statement counts per request and event
 import sqlite3 # For error handling
-import bcrypt  # bcrypt is a hashing algorithm
+import os # For env configuration
+import math # Distance search radius
+import json # GeoJSON map layer
+import difflib # Similar map point names
+import hashlib # Email verification tokens are stored hashed
+import secrets # Email verification tokens
 import datetime # For datetime operations
-from flask import Flask, render_template, session, request
+from flask import Flask, render_template, session, request, url_for
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from datetime import datetime
+from datetime import datetime, timedelta
 socketio = SocketIO()
 connected_users = {}
+notifications.init(socketio, lambda user_id: user_id in connected_users.values())
+map_live.init(socketio)
 
 """
 Main business logic module for the Comunidad Verde application.
@@ -41,7 +63,44 @@ Achievements:
 The points system encourages participation and community engagement.
 """
 
+EMAIL_VERIFICATION = os.environ.get('EMAIL_VERIFICATION', 'on') != 'off'
+EMAIL_VERIFICATION_HOURS = 48
+PASSWORD_POOL_BUSY_MESSAGE = "El servidor está procesando muchas solicitudes. Por favor, intenta de nuevo en unos segundos."
+
 # --- Authentication Functions ---
+def _rehash_password_if_needed(entity_type, entity_id, password, stored_password):
+    """
+    Re-hashes a password stored with another bcrypt cost than passwords.BCRYPT_ROUNDS,
+    right after a successful login (the only moment the plain password is known).
+    """
+    if not passwords.needs_rehash(stored_password):
+        return
+    try:
+        new_password = passwords.hash_password(password)
+    except passwords.PasswordPoolBusy:
+        return  # not urgent, the next login will try again
+    if entity_type == 'user':
+        db_operator.update_user_profile(entity_id, password=new_password)
+    else:
+        db_operator.update_org_profile(entity_id, password=new_password)
+    print(f"Logic: Password of {entity_type} {entity_id} rehashed with cost {passwords.BCRYPT_ROUNDS}")
+
+def _send_verification_email(user_id, name, email):
+    """
+    Issues a new email verification token and queues the mail with the link
+    (outbox.py sends it in the background). Only a hash of the token is stored.
+    Needs a request context for the link. Returns True if the mail was queued.
+    """
+    token = secrets.token_urlsafe(32)
+    expires = (datetime.utcnow() + timedelta(hours=EMAIL_VERIFICATION_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    if not db_operator.set_verification_token(user_id, hashlib.sha256(token.encode('utf-8')).hexdigest(), expires):
+        return False
+    link = url_for('verify_email', token=token, _external=True)
+    body = (f"Hola {name},\n\n"
+            f"Gracias por unirte a Parche Verde Uniandes. Confirma tu correo en este enlace:\n\n{link}\n\n"
+            f"El enlace vence en {EMAIL_VERIFICATION_HOURS} horas. Si no creaste esta cuenta, ignora este mensaje.")
+    return outbox.enqueue(email, "Confirma tu correo - Parche Verde Uniandes", body) is not None
+
 def register_user(name, nickname, email, student_code, password, interests=None, career=None, photo=None):
     """
     Registers a new user whether Student, professor or admin in the system.
@@ -72,13 +131,18 @@ def register_user(name, nickname, email, student_code, password, interests=None,
     # Hash password before sending to db_operator
     hashed_password = None
     if password:
-        password_bytes = password.encode('utf-8') #encode the password so that bcrypt module can handle it.
-        salt = bcrypt.gensalt()  # Generates random salt; value that get combined with the password before hashing
-        hashed_password = bcrypt.hashpw(password_bytes, 
-        salt) #hash the password
+        try:
+            hashed_password = passwords.hash_password(password) # salted bcrypt hash, computed in the password pool
+        except passwords.PasswordPoolBusy:
+            return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
 
-    success = db_operator.register_user(user_type, student_code, hashed_password, name, nickname, email, career, interests, photo)
-    if success:
+    user_id = db_operator.register_user(user_type, student_code, hashed_password, name, nickname, email, career, interests, photo)
+    if user_id:
+        if EMAIL_VERIFICATION and user_type != "admin":
+            # Only queued here, the SMTP round trip happens in the outbox sender
+            if _send_verification_email(user_id, name, email):
+                return {"status": "success", "message": f"Usuario '{name}' registrado exitosamente. Revisa tu correo para confirmar la cuenta."}
+            print(f"Logic: Could not queue the verification email of user {user_id}")
         return {"status": "success", "message": f"Usuario '{name}' registrado exitosamente."}
     else:
         return {"status": "error", "message": "Error en la base de datos."}
@@ -105,12 +169,14 @@ def register_organization(creator_email, creator_student_code, name, email, desc
     user_type = "org"
     hashed_password = None
     if password:
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(password_bytes, salt)
+        try:
+            hashed_password = passwords.hash_password(password)
+        except passwords.PasswordPoolBusy:
+            return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
         
     success = db_operator.register_org(user_type, creator_student_code, hashed_password, name, email, description, interests, photo)
     if success:
+        response_cache.invalidate('orgs')
         return {"status": "success", "message": f"Organización '{name}' registrada exitosamente."}
     else:
         return {"status": "error", "message": "Error al registrar la organización. El correo electrónico ya podría existir."}
@@ -127,11 +193,20 @@ def login(code, password):
     # First try to authenticate as a user
     user = db_operator.get_user_by_student_code(code)
     if user:
-        #if not user.get('is_verified'):
-            #return {"status": "error", "message": "User not verified."}
-        password_bytes = password.encode('utf-8')
         stored_password = user['password']
-        if bcrypt.checkpw(password_bytes, stored_password):
+        try:
+            valid_password = passwords.verify_password(password, stored_password)
+        except passwords.PasswordPoolBusy:
+            return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
+        if valid_password:
+            # Accounts created before verification existed (or imported by an admin) have no token
+            if EMAIL_VERIFICATION and not user.get('is_verified') and user.get('verification_pending'):
+                expires = user.get('verification_token_expires')
+                if not expires or expires <= datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'):
+                    _send_verification_email(user.get('user_id'), user.get('name'), user.get('email'))
+                    return {"status": "error", "message": "Tu enlace de verificación venció. Te enviamos uno nuevo a tu correo."}
+                return {"status": "error", "message": "Debes confirmar tu correo antes de iniciar sesión. Revisa tu bandeja de entrada."}
+            _rehash_password_if_needed('user', user.get('user_id'), password, stored_password)
             if user.get('user_type') == 'admin':
                 print(f"Logic: Admin user '{user.get('name')}' authenticated.")
             return {
@@ -161,9 +236,13 @@ def login_orgs(creator_code, password):
     """
     org = db_operator.get_org_by_creator_student_code(creator_code)
     if org:
-        password_bytes = password.encode('utf-8')
         stored_password = org['password']
-        if bcrypt.checkpw(password_bytes, stored_password):
+        try:
+            valid_password = passwords.verify_password(password, stored_password)
+        except passwords.PasswordPoolBusy:
+            return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
+        if valid_password:
+            _rehash_password_if_needed('org', org.get('org_id'), password, stored_password)
             print(f"Logic: Organization '{org.get('name')}' authenticated.")
             return {
                 "status": "success",
@@ -214,17 +293,14 @@ def update_my_profile_logic(entity_id, entity_type, new_data):
             entity_data = db_operator.get_org_by_id(entity_id)
         else:
             return {"status": "error", "message": f"Tipo de entidad inválido: {entity_type}"}
-        # Verify old password
-        old_password_bytes = new_data['old_password'].encode('utf-8')
+        # Verify old password and hash the new one
         stored_password = entity_data['password']
-        
-        if not bcrypt.checkpw(old_password_bytes, stored_password):
-            return {"status": "error", "message": "La contraseña actual es incorrecta"}
-        
-        # Hash the new password
-        password_bytes = new_data['password'].encode('utf-8')
-        salt = bcrypt.gensalt()
-        new_data['password'] = bcrypt.hashpw(password_bytes, salt)
+        try:
+            if not passwords.verify_password(new_data['old_password'], stored_password):
+                return {"status": "error", "message": "La contraseña actual es incorrecta"}
+            new_data['password'] = passwords.hash_password(new_data['password'])
+        except passwords.PasswordPoolBusy:
+            return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
         
         del new_data['old_password']
     
@@ -238,6 +314,7 @@ def update_my_profile_logic(entity_id, entity_type, new_data):
         if update_payload:
             success = db_operator.update_user_profile(entity_id, **update_payload)
             if success:
+                response_cache.invalidate('orgs', 'events', 'items')
                 return {"status": "success", "message": "Perfil actualizado exitosamente."}
     
     elif entity_type == 'organization':
@@ -251,6 +328,7 @@ def update_my_profile_logic(entity_id, entity_type, new_data):
         if update_payload:
             success = db_operator.update_org_profile(entity_id, **update_payload)
             if success:
+                response_cache.invalidate('orgs', 'events', 'items')
                 return {"status": "success", "message": "Perfil de la organización actualizado exitosamente."}
     
     else:
@@ -258,6 +336,39 @@ def update_my_profile_logic(entity_id, entity_type, new_data):
     
     return {"status": "error", "message": "Error al actualizar el perfil. Por favor, revise los datos."}
 
+def verify_email_logic(token):
+    """
+    Confirms the email of the user that received this token.
+    Returns a status message dictionary.
+    """
+    if not token:
+        return {"status": "error", "message": "Enlace de verificación inválido."}
+    user_id = db_operator.verify_user_by_token(hashlib.sha256(token.encode('utf-8')).hexdigest())
+    if user_id is None:
+        return {"status": "error", "message": "El enlace de verificación es inválido o ya venció. Puedes pedir uno nuevo."}
+    return {"status": "success", "message": "¡Correo confirmado! Ya puedes iniciar sesión."}
+
+def resend_verification_logic(email):
+    """
+    Queues a new verification email for an account whose verification is pending.
+    The answer is the same whether the email exists or not, so it can't be used to find accounts.
+    """
+    message = "Si el correo está registrado y sin confirmar, te enviaremos un nuevo enlace de verificación."
+    if not email:
+        return {"status": "error", "message": "Se requiere un correo electrónico."}
+    user = db_operator.get_user_verification(email.strip())
+    # Only accounts that registered with verification already have a token. Minting one for an
+    # older or imported account would make login refuse it, letting anyone lock it out.
+    if user and not user['is_verified'] and user['has_token']:
+        _send_verification_email(user['user_id'], user['name'], user['email'])
+    return {"status": "success", "message": message}
+
+def get_password_pool_stats_logic():
+    """
+    Metrics of the password hashing pool of this worker process (queue wait, run time, rejections).
+    """
+    return {"status": "success", "data": passwords.stats()}
+
 def delete_my_account_logic(entity_id, entity_type, password):
     """
     Allows the specified user, admin or organization to delete their own account after verifying password.
@@ -272,9 +383,11 @@ def delete_my_account_logic(entity_id, entity_type, password):
     if entity_type == 'user' or entity_type == 'admin':
         user_data = db_operator.get_user_by_id(entity_id)
         if user_data:
-             password_bytes = password.encode('utf-8')
-             stored_password = user_data['password']
-             if bcrypt.checkpw(password_bytes, stored_password):
+             try:
+                 valid_password = passwords.verify_password(password, user_data['password'])
+             except passwords.PasswordPoolBusy:
+                 return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
+             if valid_password:
                 student_code = user_data['student_code']
                 success = db_operator.delete_my_user(student_code)
         else:
@@ -284,9 +397,11 @@ def delete_my_account_logic(entity_id, entity_type, password):
     elif entity_type == 'organization':
         org_data = db_operator.get_org_by_id(entity_id)
         if org_data:
-             password_bytes = password.encode('utf-8')
-             stored_password = org_data['password']
-             if bcrypt.checkpw(password_bytes, stored_password):
+             try:
+                 valid_password = passwords.verify_password(password, org_data['password'])
+             except passwords.PasswordPoolBusy:
+                 return {"status": "error", "message": PASSWORD_POOL_BUSY_MESSAGE}
+             if valid_password:
                 creator_code = org_data['creator_student_code']
                 success = db_operator.delete_my_org(creator_code)
         else:
@@ -295,6 +410,7 @@ def delete_my_account_logic(entity_id, entity_type, password):
          return {"status": "error", "message": f"Tipo de entidad desconocido: {entity_type}"}
 
     if success:
+        response_cache.invalidate('orgs', 'events', 'items')
         # Logout should be triggered in app.py after this returns success
         return {"status": "success", "message": "Cuenta eliminada exitosamente."}
     else:
@@ -346,6 +462,23 @@ def get_entity_by_id(entity_id, entity_type):
         "data": entity_data
     }
 
+def get_session_entity_logic(entity_id, entity_type):
+    """
+    Profile of the logged-in user or organization. The session only keeps the ids
+    (see session_store.py), the rest is read through the entity cache on demand.
+    Returns:
+        dict: The entity data without the password, None if it no longer exists.
+    """
+    if entity_type == 'user' or entity_type == 'admin':
+        entity_data = db_operator.get_user_by_id(entity_id)
+    elif entity_type == 'organization':
+        entity_data = db_operator.get_org_by_id(entity_id)
+    else:
+        return None
+    if entity_data is not None:
+        entity_data.pop('password', None)
+    return entity_data
+
 
 # --- Organization Functions ---
 def search_orgs_logic(query=None, interests=None, sort_by=None, user_id=None):
@@ -425,6 +558,7 @@ def join_org_logic(user_id, org_id):
     success = db_operator.join_org(org_id, user_id)
 
     if success:
+        response_cache.invalidate('orgs')
         # Update organization points to include the new member's points
         update_org_points_from_members_logic(org_id=org_id)
         
@@ -452,6 +586,7 @@ def leave_org_logic(user_id, org_id):
     success = db_operator.leave_org(org_id, user_id)
 
     if success:
+        response_cache.invalidate('orgs')
         # Update organization points after member leaves
         update_org_points_from_members_logic(org_id=org_id)
         
@@ -462,7 +597,85 @@ def leave_org_logic(user_id, org_id):
 
 
 # --- Event Functions ---
-def create_event_logic(organizer_id, organizer_type, title, description, event_datetime, location, event_type):
+EVENT_NEAR_DEFAULT_RADIUS_KM = 1.0
+EVENT_NEAR_MAX_RADIUS_KM = 50.0
+
+def _map_points_named_in(text, points):
+    """find_map_points_by_name over points already loaded: names containing the text or contained in it, longest first."""
+    text = text.lower()
+    matches = [point for point in points if text in point['name'].lower() or point['name'].lower() in text]
+    return sorted(matches, key=lambda point: len(point['name']), reverse=True)
+
+def geocode_event_location(location, latitude=None, longitude=None, places=None, named_points=None):
+    """
+    Resolves the coordinates of an event location.
+
+    Order: the point chosen on the map picker (latitude/longitude), then the campus
+    gazetteer (campus_places, e.g. 'ML' inside 'Salón ML-603'), then a map point
+    with the same name.
+
+    places and named_points are the gazetteer and db_operator.get_named_map_points()
+    when the caller resolves many locations; read from the database otherwise.
+
+    Returns:
+        tuple: (latitude, longitude, source) with source 'picker', 'campus' or 'map',
+               or (None, None, None) if the location could not be resolved.
+    """
+    try:
+        if latitude not in (None, '') and longitude not in (None, ''):
+            latitude = float(latitude)
+            longitude = float(longitude)
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                return latitude, longitude, 'picker'
+    except (TypeError, ValueError):
+        pass  # fall back to the location text
+
+    normalized = _normalize_point_name(location)
+    if not normalized:
+        return None, None, None
+
+    # Whole words only, so the place 'w' does not match every location containing a w
+    if places is None:
+        places = db_operator.get_campus_places()
+    best_place = None
+    for place in places:
+        name = place['normalized_name']
+        if f" {name} " in f" {normalized} ":
+            if best_place is None or len(name) > len(best_place['normalized_name']):
+                best_place = place
+    if best_place:
+        return best_place['latitude'], best_place['longitude'], 'campus'
+
+    if named_points is None:
+        candidates = db_operator.find_map_points_by_name(location.strip())
+    else:
+        candidates = _map_points_named_in(location.strip(), named_points)
+    for point in candidates:
+        if _similar_point_names(point['name'], location):
+            return point['latitude'], point['longitude'], 'map'
+
+    return None, None, None
+
+def geocode_pending_events_logic():
+    """
+    Geocodes the events created before their location could be resolved,
+    e.g. after an admin adds the place to the campus gazetteer. The gazetteer
+    and the map point names are read once and matched in memory.
+    """
+    events = db_operator.get_events_without_coordinates()
+    places = db_operator.get_campus_places() if events else []
+    named_points = db_operator.get_named_map_points() if events else []
+    coordinates = []
+    for event in events:
+        latitude, longitude, _ = geocode_event_location(event['location'], places=places, named_points=named_points)
+        if latitude is not None:
+            coordinates.append((event['event_id'], latitude, longitude))
+    updated = db_operator.set_event_coordinates(coordinates) if coordinates else 0
+    if updated:
+        response_cache.invalidate('events')
+    return {"status": "success", "message": f"{updated} eventos ubicados en el mapa.", "updated": updated}
+
+def create_event_logic(organizer_id, organizer_type, title, description, event_datetime, location, event_type, latitude=None, longitude=None):
     """
     Allows a user or organization (specified by ID and type) to create a new event.
     Note: No points are awarded for creating an event. Points are only awarded when:
@@ -477,6 +690,7 @@ def create_event_logic(organizer_id, organizer_type, title, description, event_d
         event_datetime (str): Event date and time.
         location (str): Event location.
         event_type (str): Event type.
+        latitude, longitude (float, optional): Point chosen on the map picker, see geocode_event_location.
         
     Returns:
         dict: Status message and event ID if successful
@@ -491,10 +705,24 @@ def create_event_logic(organizer_id, organizer_type, title, description, event_d
     if db_organizer_type not in ['user', 'org']:
          return {"status": "error", "message": f"Tipo de organizador inválido: {organizer_type}"}
 
+    moderated = moderation.moderate_fields(title=title, description=description)
+    if moderated['status'] != 'success':
+        return moderated
+    title = moderated['fields']['title']
+    description = moderated['fields']['description']
+
+    latitude, longitude, geocoded = geocode_event_location(location, latitude, longitude)
+
     print(f"Logic: {organizer_type.capitalize()} ID {organizer_id} creating event '{title}'")
-    result_id = db_operator.create_event(organizer_id, db_organizer_type, title, description, event_type, location, event_datetime)
+    result_id = db_operator.create_event(organizer_id, db_organizer_type, title, description, event_type, location, event_datetime, latitude, longitude)
     if result_id:
-        return {"status": "success", "message": f"Evento '{title}' creado exitosamente. Ganarás puntos cuando los participantes asistan.", "event_id": result_id}
+        response_cache.invalidate('events')
+        message = f"Evento '{title}' creado exitosamente. Ganarás puntos cuando los participantes asistan."
+        if moderated['masked']:
+            message += " Algunas palabras fueron censuradas."
+        if geocoded is None:
+            message += " No se pudo ubicar el lugar en el mapa, el evento no aparecerá en las búsquedas por cercanía."
+        return {"status": "success", "message": message, "event_id": result_id, "moderated": moderated['masked'], "geocoded": geocoded}
     else:
         # Consider more specific error messages based on db_operator return/exceptions
         return {"status": "error", "message": "Error al crear el evento."}
@@ -522,12 +750,13 @@ def delete_event_logic(entity_id, entity_type, event_id):
     success = db_operator.delete_event(event_id, entity_id, entity_type)
 
     if success:
+        response_cache.invalidate('events')
         return {"status": "success", "message": "Evento eliminado exitosamente."}
     else:
         # db_operator might print specific errors (not found, not authorized)
         return {"status": "error", "message": "Error al eliminar el evento. Puede que no exista o que no seas el organizador."}
 
-def search_events_logic(event_id=None, query=None, location=None, event_type=None, event_status=None, organizer_type=None, organizer_id=None, start_date=None, end_date=None):
+def search_events_logic(event_id=None, query=None, location=None, event_type=None, event_status=None, organizer_type=None, organizer_id=None, start_date=None, end_date=None, near_lat=None, near_lng=None, radius_km=None):
     """
     Searches for events based on various criteria.
     
@@ -541,11 +770,28 @@ def search_events_logic(event_id=None, query=None, location=None, event_type=Non
       organizer_id (int, optional): Filter by organizer ID.
       start_date (str, optional): Filter events on or after this date.
       end_date (str, optional): Filter events on or before this date.
-      
+      near_lat, near_lng (float, optional): Only geocoded events within radius_km of this point,
+        nearest first and with 'distance_km'.
+      radius_km (float, optional): Search radius, EVENT_NEAR_DEFAULT_RADIUS_KM by default.
     
     Returns:
       dict: Status and event data.
     """
+    bbox = None
+    if near_lat not in (None, '') or near_lng not in (None, ''):
+        try:
+            near_lat = float(near_lat)
+            near_lng = float(near_lng)
+            radius_km = float(radius_km) if radius_km not in (None, '') else EVENT_NEAR_DEFAULT_RADIUS_KM
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "La ubicación y el radio deben ser números válidos."}
+        if not (-90 <= near_lat <= 90 and -180 <= near_lng <= 180):
+            return {"status": "error", "message": "Coordenadas fuera de rango."}
+        if radius_km <= 0:
+            return {"status": "error", "message": "El radio debe ser mayor que 0."}
+        radius_km = min(radius_km, EVENT_NEAR_MAX_RADIUS_KM)
+        bbox = geo.bbox_around(near_lat, near_lng, radius_km)
+
     events = db_operator.search_events(
         event_id=event_id,
         query=query,
@@ -555,10 +801,17 @@ def search_events_logic(event_id=None, query=None, location=None, event_type=Non
         organizer_type=organizer_type,
         organizer_id=organizer_id,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        bbox=bbox
     )
     if events is None:
         return {"status": "error", "message": "Error en la base de datos al buscar eventos."}
+    if bbox:
+        # The index returns the box, keep only the circle
+        for event in events:
+            event['distance_km'] = round(geo.haversine_km(near_lat, near_lng, event['latitude'], event['longitude']), 3)
+        events = sorted([event for event in events if event['distance_km'] <= radius_km], key=lambda x: x['distance_km'])
+        return {"status": "success", "data": events}
     events = sorted(events, key=lambda x: x.get('event_datetime', ""), reverse=True)
     return {"status": "success", "data": events}
 
@@ -600,6 +853,11 @@ def register_for_event_logic(user_id, event_id):
     success = db_operator.join_event(event_id, user_id, 'user')
 
     if success:
+        response_cache.invalidate('events')
+        events = db_operator.search_events(event_id=event_id) or []
+        if events and events[0]['organizer_type'] == 'user' and events[0]['organizer_id'] != user_id:
+            user_name = (db_operator.get_user_by_id(user_id) or {}).get('name', 'Un usuario')
+            notifications.notify(events[0]['organizer_id'], 'event_registration', f"{user_name} se registró en tu evento '{events[0]['name']}'.", f"/event/{event_id}")
         return {"status": "success", "message": "Registrado exitosamente en el evento. Recibirás puntos cuando se confirme tu asistencia."}
     else:
         # Consider more specific errors (already registered, event full, event not found)
@@ -629,6 +887,7 @@ def leave_event_logic(entity_id, entity_type, event_id):
     success = db_operator.leave_event(event_id, entity_id, entity_type)
 
     if success:
+        response_cache.invalidate('events')
         return {"status": "success", "message": "Saliste exitosamente del evento."}
     else:
         return {"status": "error", "message": "Error al salir del evento. Puede que no estuvieras registrado o que el evento no exista."}
@@ -708,6 +967,7 @@ def mark_event_attendance_logic(event_id, marker_id, participant_id, participant
                     if award_org['status'] == 'success':
                         messages.append(f"La organización ID {org_id} ganó {org_points} puntos por tener 5 asistentes confirmados.")
     
+    response_cache.invalidate('events', 'orgs')
     # Generate success message
     message = "Asistencia marcada exitosamente."
     if messages:
@@ -816,12 +1076,22 @@ def add_item_logic(owner_id, name, description, photo, item_type, item_terms):
     if item_terms not in valid_terms:
         return {"status": "error", "message": f"Términos del artículo inválidos. Debe ser uno de: {', '.join(valid_terms)}"}
     
+    moderated = moderation.moderate_fields(name=name, description=description)
+    if moderated['status'] != 'success':
+        return moderated
+    name = moderated['fields']['name']
+    description = moderated['fields']['description']
+
     item_id = db_operator.create_item(owner_id, name, description, photo, item_type, item_terms)
 
     if item_id:
+        response_cache.invalidate('items')
         points_to_award = 1  # Just 1 point for listing an item
         award_result = award_points_logic(owner_id, 'user', points_to_award)
-        return {"status": "success", "message": f"Artículo '{name}' agregado exitosamente. {award_result.get('message', '')}"}
+        message = f"Artículo '{name}' agregado exitosamente. {award_result.get('message', '')}"
+        if moderated['masked']:
+            message += " Algunas palabras fueron censuradas."
+        return {"status": "success", "message": message, "moderated": moderated['masked']}
     else:
         return {"status": "error", "message": "Error al agregar el artículo."}
 
@@ -852,6 +1122,7 @@ def delete_my_item_logic(user_id, item_id):
     success = db_operator.update_item_status(item_id, 'removed')
 
     if success:
+        response_cache.invalidate('items')
         return {"status": "success", "message": "Artículo eliminado exitosamente."}
     else:
         return {"status": "error", "message": "Error al eliminar el artículo."}
@@ -926,9 +1197,13 @@ def request_item_logic(requester_id, item_id, message=""):
         return {"status": "error", "message": "Este artículo no está disponible para solicitud."}
     
     # Process the request based on item term
+    requester_name = (db_operator.get_user_by_id(requester_id) or {}).get('name', 'Un usuario')
+
     if item_term == 'gift':
         update_success = db_operator.update_item_status(item_id, 'unavailable')
         if update_success:
+            response_cache.invalidate('items')
+            notifications.notify(owner_id, 'exchange_request', f"{requester_name} solicitó tu artículo de regalo '{item_name}'.", f"/chat/{requester_id}")
             return {"status": "success", "message": f"Artículo de regalo '{item_name}' solicitado. El artículo ahora está no disponible. Inicia chat con el propietario."}
         else:
             return {"status": "error", "message": "Error al actualizar el estado del artículo para solicitud de regalo."}
@@ -936,6 +1211,8 @@ def request_item_logic(requester_id, item_id, message=""):
     elif item_term == 'loan':
         update_success = db_operator.update_item_status(item_id, 'borrowed')
         if update_success:
+            response_cache.invalidate('items')
+            notifications.notify(owner_id, 'exchange_request', f"{requester_name} solicitó en préstamo tu artículo '{item_name}'.", f"/chat/{requester_id}")
             return {"status": "success", "message": f"Artículo de préstamo '{item_name}' solicitado. El artículo ahora está marcado como prestado. Inicia chat con el propietario sobre la entrega y devolución."}
         else:
             return {"status": "error", "message": "Error al actualizar el estado del artículo para solicitud de préstamo."}
@@ -945,6 +1222,7 @@ def request_item_logic(requester_id, item_id, message=""):
             return {"status": "error", "message": "Se requiere un mensaje de propuesta para solicitudes de intercambio."}
         exchange_id = db_operator.create_item_request(requester_id, owner_id, item_id, item_term, message)
         if exchange_id:
+            notifications.notify(owner_id, 'exchange_request', f"{requester_name} propuso un intercambio por tu artículo '{item_name}'.", "/exchange/requests")
             return {"status": "success", "message": f"Propuesta de intercambio para el artículo '{item_name}' enviada exitosamente. Espera la decisión del propietario."}
         else:
             return {"status": "error", "message": "Error al enviar la propuesta de intercambio."}
@@ -952,6 +1230,44 @@ def request_item_logic(requester_id, item_id, message=""):
     else:
         return {"status": "error", "message": "Término del artículo inválido."}
 
+def _decide_exchange(owner_id, exchange_id, accept):
+    """Shared checks for accepting or rejecting an exchange proposal, notifies the requester."""
+    exchange = db_operator.get_exchange_request(exchange_id)
+    if not exchange:
+        return {"status": "error", "message": "Solicitud de intercambio no encontrada."}
+    if exchange['owner_id'] != owner_id:
+        return {"status": "error", "message": "Solo el propietario puede responder esta solicitud."}
+    if exchange['exchange_status'] != 'pending':
+        return {"status": "error", "message": "Esta solicitud ya fue respondida."}
+
+    if accept:
+        success = db_operator.accept_exchange_request(exchange_id)
+    else:
+        success = db_operator.update_exchange_status(exchange_id, 'rejected')
+    if not success:
+        return {"status": "error", "message": "Error al responder la solicitud de intercambio."}
+
+    response_cache.invalidate('items')
+    item_name = (db_operator.get_item_details(exchange['item_id']) or {}).get('name', '')
+    if accept:
+        notifications.notify(exchange['requester_id'], 'exchange_accepted', f"Tu propuesta de intercambio por '{item_name}' fue aceptada.", f"/chat/{owner_id}")
+        return {"status": "success", "message": "Solicitud de intercambio aceptada."}
+    notifications.notify(exchange['requester_id'], 'exchange_rejected', f"Tu propuesta de intercambio por '{item_name}' fue rechazada.", "/exchange/requests")
+    return {"status": "success", "message": "Solicitud de intercambio rechazada."}
+
+def accept_exchange_logic(owner_id, exchange_id):
+    """
+    Allows the owner of an item to accept an exchange proposal.
+    The item becomes unavailable and the other pending proposals are rejected.
+    """
+    return _decide_exchange(owner_id, exchange_id, accept=True)
+
+def reject_exchange_logic(owner_id, exchange_id):
+    """
+    Allows the owner of an item to reject an exchange proposal.
+    """
+    return _decide_exchange(owner_id, exchange_id, accept=False)
+
 # --- Map Functions ---
 def add_map_point_logic(adder_id, adder_type, permission_code, name, latitude, longitude, point_type, description):
     """
@@ -972,10 +1288,19 @@ def add_map_point_logic(adder_id, adder_type, permission_code, name, latitude, l
         if permission_code != "admin2000":
             return {"status": "error", "message": "Código de permiso inválido."}
     
-    success = db_operator.add_map_point(adder_id, name, description, point_type, latitude, longitude)
+    duplicate = find_duplicate_map_point(name, point_type, latitude, longitude)
+    if duplicate and MAP_DUPLICATE_MODE == 'merge':
+        return _duplicate_point_response(name, duplicate)
 
-    if success:
-        return {"status": "success", "message": f"Punto de mapa '{name}' agregado exitosamente."}
+    point_id = db_operator.add_map_point(adder_id, name, description, point_type, latitude, longitude,
+                                         geohash=geo.geohash_encode(latitude, longitude))
+
+    if point_id:
+        map_live.point_added(db_operator.get_map_point(point_id))
+        response = {"status": "success", "message": f"Punto de mapa '{name}' agregado exitosamente."}
+        if duplicate:
+            response['possible_duplicate_of'] = duplicate['id']
+        return response
     else:
         return {"status": "error", "message": "Error al agregar el punto de mapa. El punto ya podría existir."}
 
@@ -996,9 +1321,11 @@ def delete_map_point_logic(deleter_id, deleter_type, point_id):
     # TODO: Clarify and confirm db_operator.delete_map_point signature and permission logic
     # Assumed signature: delete_map_point(user_id, user_type, point_id)
     print(f"Logic: {deleter_type.capitalize()} ID {deleter_id} attempting to delete map point ID {point_id}")
+    point = db_operator.get_map_point(point_id)
     success = db_operator.delete_map_point(deleter_id, deleter_type, point_id)
 
     if success:
+        map_live.point_removed(point)
         return {"status": "success", "message": "Punto de mapa eliminado exitosamente."}
     else:
         return {"status": "error", "message": "Error al eliminar el punto de mapa. Verifica permisos o si el punto existe."}
@@ -1057,48 +1384,345 @@ def get_map_points():
          if conn:
              conn.close()
  
+MAP_DUPLICATE_RADIUS_M = float(os.environ.get('MAP_DUPLICATE_RADIUS_M', 20))
+MAP_DUPLICATE_MODE = os.environ.get('MAP_DUPLICATE_MODE', 'merge')  # merge: keep the existing point, flag: save and report
+MAP_DUPLICATE_NAME_SIMILARITY = 0.8
+_geohashes_checked = False
+
+def _normalize_point_name(name):
+    normalized, _ = moderation.normalize_text(name or '')
+    return ' '.join(''.join(char if char.isalnum() else ' ' for char in normalized).split())
+
+def _similar_point_names(name_a, name_b):
+    """'Caneca Reciclaje ML' and 'caneca de reciclaje ML' are the same place."""
+    name_a = _normalize_point_name(name_a)
+    name_b = _normalize_point_name(name_b)
+    if not name_a or not name_b:
+        return False
+    if name_a in name_b or name_b in name_a:
+        return True
+    return difflib.SequenceMatcher(None, name_a, name_b).ratio() >= MAP_DUPLICATE_NAME_SIMILARITY
+
+def find_duplicate_map_point(name, point_type, latitude, longitude, radius_m=None):
+    """
+    Looks for an existing point of the same type with a similar name within radius_m.
+    Only the geohash cell of the coordinate and its 8 neighbours are read.
+
+    Returns:
+        dict: The closest duplicate (with 'distance_m'), or None.
+    """
+    global _geohashes_checked
+    if radius_m is None:
+        radius_m = MAP_DUPLICATE_RADIUS_M
+    if not _geohashes_checked:
+        db_operator.fill_missing_map_point_geohashes()
+        _geohashes_checked = True
+
+    precision = geo.geohash_precision_for(radius_m, latitude)
+    cells = geo.geohash_neighbourhood(latitude, longitude, precision)
+    closest = None
+    for point in db_operator.get_map_points_in_geohash_cells(cells, point_type):
+        distance_m = geo.haversine_km(latitude, longitude, point['latitude'], point['longitude']) * 1000
+        if distance_m <= radius_m and _similar_point_names(name, point['name']):
+            if closest is None or distance_m < closest['distance_m']:
+                point['distance_m'] = round(distance_m, 1)
+                closest = point
+    return closest
+
+def _duplicate_point_response(name, duplicate):
+    return {
+        "status": "success",
+        "message": f"Ya existe el punto '{duplicate['name']}' a {duplicate['distance_m']} m, no se creó '{name}'.",
+        "duplicate_of": duplicate['id']
+    }
+
+def dedupe_map_points_logic(radius_m=None, dry_run=True):
+    """
+    Batch tool for existing rows: finds points with a similar name and the same type
+    within radius_m of an older point, and deletes them (keeping the oldest) unless dry_run.
+
+    Returns:
+        dict: Status message and data: [{'id', 'name', 'duplicate_of', 'distance_m'}, ...]
+    """
+    try:
+        radius_m = float(radius_m) if radius_m else MAP_DUPLICATE_RADIUS_M
+    except ValueError:
+        return {"status": "error", "message": "El radio debe ser un número de metros."}
+    if not (0 < radius_m <= 1000):
+        return {"status": "error", "message": "El radio debe estar entre 0 y 1000 metros."}
+
+    db_operator.fill_missing_map_point_geohashes()
+    rows = db_operator.get_all_map_points_for_dedupe()
+    if not rows:
+        return {"status": "success", "message": "No hay puntos en el mapa.", "data": []}
+
+    # One precision for the whole pass, valid at the highest latitude in the data
+    precision = min(geo.geohash_precision_for(radius_m, row[3]) for row in rows)
+    kept = {}  # geohash prefix -> [(id, name, point_type, lat, lng), ...]
+    duplicates = []
+    for point_id, name, point_type, latitude, longitude, geohash in rows:
+        match = None
+        for cell in geo.geohash_neighbourhood(latitude, longitude, precision):
+            for other in kept.get(cell, []):
+                if other[2] != point_type or not _similar_point_names(name, other[1]):
+                    continue
+                distance_m = geo.haversine_km(latitude, longitude, other[3], other[4]) * 1000
+                if distance_m <= radius_m and (match is None or distance_m < match[1]):
+                    match = (other[0], distance_m)
+        if match:
+            duplicates.append({'id': point_id, 'name': name, 'duplicate_of': match[0], 'distance_m': round(match[1], 1)})
+        else:
+            kept.setdefault(geohash[:precision], []).append((point_id, name, point_type, latitude, longitude))
+
+    if dry_run or not duplicates:
+        return {"status": "success", "message": f"{len(duplicates)} puntos duplicados encontrados.", "data": duplicates}
+
+    if db_operator.delete_map_points([duplicate['id'] for duplicate in duplicates]) is None:
+        return {"status": "error", "message": "Error al eliminar los puntos duplicados."}
+    map_live.reset()
+    return {"status": "success", "message": f"{len(duplicates)} puntos duplicados eliminados.", "data": duplicates}
+
+def get_heatmap_version():
+    """Version of the stored heatmap tiles (bumped on every rebuild), used as the tile ETag."""
+    return db_operator.get_change_counter('heatmap')
+
+def rebuild_heatmap_logic(progress=None):
+    """
+    Recomputes the admin heatmap rasters of every time window (see heatmap.py).
+    Run by the 'heatmap' background job, it takes seconds on a large map.
+    """
+    stored = heatmap.rebuild()
+    if stored is None:
+        return {"status": "error", "message": "Error al generar el mapa de calor."}
+    return {"status": "success", "message": f"Mapa de calor generado: {stored} teselas."}
+
+def get_heatmap_tile_logic(time_window, layer, zoom, tile_x, tile_y):
+    """
+    Returns one heatmap tile for the admin map. Until the rasters are built the
+    tile is answered with an 'info' status and the 'heatmap' job is queued, so
+    concurrent tile requests never run the rebuild themselves.
+
+    Returns:
+        dict: {"status", "data": {'size', 'zoom_max', 'data'}}, an info or an error dict.
+    """
+    if time_window not in heatmap.HEATMAP_WINDOWS:
+        return {"status": "error", "message": f"Ventana inválida. Debe ser una de: {', '.join(heatmap.HEATMAP_WINDOWS)}"}
+    if layer not in heatmap.HEATMAP_LAYERS:
+        return {"status": "error", "message": f"Capa inválida. Debe ser una de: {', '.join(heatmap.HEATMAP_LAYERS)}"}
+    if not (heatmap.HEATMAP_MIN_ZOOM <= zoom <= heatmap.HEATMAP_MAX_ZOOM):
+        return {"status": "error", "message": f"El zoom debe estar entre {heatmap.HEATMAP_MIN_ZOOM} y {heatmap.HEATMAP_MAX_ZOOM}."}
+    if not (0 <= tile_x < 2 ** zoom and 0 <= tile_y < 2 ** zoom):
+        return {"status": "error", "message": "Tesela fuera de rango."}
+
+    if get_heatmap_version() == 0:
+        run_job_logic('heatmap')  # no-op if already queued or running
+        return {"status": "info", "message": "El mapa de calor se está generando, vuelve a intentarlo en unos segundos.", "data": None}
+    tile = heatmap.get_tile(time_window, layer, zoom, tile_x, tile_y)
+    if tile is None:
+        return {"status": "error", "message": "Error al obtener el mapa de calor."}
+    return {"status": "success", "data": tile}
+
+def get_map_layer_version():
+    """Version of map_points (bumped on every write), used as the map layer ETag."""
+    return db_operator.get_change_counter('map_points')
+
+def iter_map_layer_geojson(point_type=None, features_per_chunk=200):
+    """
+    Yields the map layer as a GeoJSON FeatureCollection in text chunks, so a large
+    layer is streamed without building the whole document in memory.
+    """
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    features = []
+    for point in db_operator.iter_map_points(point_type):
+        features.append(json.dumps({
+            "type": "Feature",
+            "id": point['id'],
+            "geometry": {"type": "Point", "coordinates": [point['longitude'], point['latitude']]},
+            "properties": {
+                "name": point['name'],
+                "description": point['description'],
+                "point_type": point['point_type'],
+                "added_by": point['added_by'],
+                "created_at": point['created_at']
+            }
+        }, ensure_ascii=False, separators=(',', ':')))
+        if len(features) >= features_per_chunk:
+            yield separator + ','.join(features)
+            separator = ','
+            features = []
+    if features:
+        yield separator + ','.join(features)
+    yield ']}'
+
+MAP_POINTS_LIMIT = 500  # max points returned for one viewport
+_clusters_checked = False
+
+def check_map_clusters_logic(progress=None):
+    """Rebuilds the cluster pyramid if it doesn't count every map point. Returns a status message dictionary."""
+    if db_operator.map_point_clusters_in_sync():
+        return {"status": "success", "message": "Los clusters del mapa están al día."}
+    count = db_operator.rebuild_map_point_clusters()
+    if count is None:
+        return {"status": "error", "message": "Error al reconstruir los clusters del mapa."}
+    return {"status": "success", "message": f"Clusters del mapa reconstruidos ({count} puntos)."}
+
+def _parse_bbox(bbox):
+    """
+    Parses "min_lng,min_lat,max_lng,max_lat" (Leaflet's LatLngBounds.toBBoxString()).
+
+    Returns:
+        dict: {"status": "success", "data": (min_lat, min_lng, max_lat, max_lng)} or an error dict.
+              min_lng > max_lng means the box crosses the antimeridian.
+    """
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(value) for value in (bbox or '').split(',')]
+    except ValueError:
+        return {"status": "error", "message": "El parámetro bbox debe ser 'min_lng,min_lat,max_lng,max_lat'."}
+
+    if not (-90 <= min_lat <= max_lat <= 90):
+        return {"status": "error", "message": "Latitudes inválidas en bbox."}
+    # Leaflet can report longitudes beyond +-180 after panning around the world
+    if max_lng - min_lng >= 360:
+        min_lng, max_lng = -180.0, 180.0
+    else:
+        min_lng = ((min_lng + 180) % 360) - 180
+        max_lng = ((max_lng + 180) % 360) - 180
+    return {"status": "success", "data": (min_lat, min_lng, max_lat, max_lng)}
+
+NEAREST_START_RADIUS_KM = 0.5
+MAX_NEAREST_K = 50
+
+def get_nearest_map_points_logic(latitude, longitude, k=5, point_type=None):
+    """
+    Finds the k map points closest to a coordinate ("what's closest to me").
+
+    The search box grows around the coordinate until it holds k points inside the
+    search circle, and each box is ranked by distance in SQL (see
+    db_operator.get_nearest_map_points). Only the points near the user are ever read.
+
+    Returns:
+        dict: {"status", "data": [points with 'distance_km'], nearest first} or an error dict.
+    """
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+        k = int(k)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "lat, lng y k deben ser números válidos."}
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {"status": "error", "message": "Coordenadas fuera de rango."}
+    k = max(1, min(k, MAX_NEAREST_K))
+
+    nearest = db_operator.get_nearest_map_points(
+        latitude, longitude, k, point_type or None,
+        start_radius_km=NEAREST_START_RADIUS_KM,
+        max_radius_km=math.pi * geo.EARTH_RADIUS_KM  # half the circumference covers the whole planet
+    )
+    if nearest is None:
+        return {"status": "error", "message": "Error al buscar los puntos cercanos."}
+    return {"status": "success", "data": nearest}
+
+def get_map_clusters_logic(bbox, zoom, point_type=None):
+    """
+    Returns what the map should draw for a viewport: cluster centroids with counts
+    while zoomed out, or the individual points above geo.CLUSTER_MAX_ZOOM.
+    The number of clusters is bounded by the screen size (one per ~64px cell).
+
+    Returns:
+        dict: {"status", "mode": "clusters" | "points", "data": [...]} or an error dict.
+    """
+    global _clusters_checked
+    try:
+        zoom = int(zoom)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "El parámetro zoom debe ser un número entero."}
+
+    if zoom > geo.CLUSTER_MAX_ZOOM:
+        result = get_map_points_in_bbox_logic(bbox, point_type)
+        result['mode'] = 'points'
+        return result
+
+    box = _parse_bbox(bbox)
+    if box['status'] != 'success':
+        return box
+    min_lat, min_lng, max_lat, max_lng = box['data']
+
+    # Points written before the pyramid existed (or outside db_operator) are clustered on the
+    # first view; the 'map_clusters' job repeats the check in the background
+    if not _clusters_checked:
+        check_map_clusters_logic()
+        _clusters_checked = True
+
+    zoom = max(0, zoom)
+    clusters = db_operator.get_map_point_clusters(
+        zoom, geo.cell_ranges(min_lat, min_lng, max_lat, max_lng, zoom), point_type or None
+    )
+    if clusters is None:
+        return {"status": "error", "message": "Error al recuperar los puntos del mapa."}
+    return {"status": "success", "mode": "clusters", "data": clusters}
+
+def get_map_points_in_bbox_logic(bbox, point_type=None):
+    """
+    Returns the map points visible in a viewport.
+
+    Args:
+        bbox (str): "min_lng,min_lat,max_lng,max_lat" (Leaflet's LatLngBounds.toBBoxString()).
+        point_type (str, optional): Only points of this type.
+
+    Returns:
+        dict: {"status", "data": [points], "truncated": bool} or an error dict.
+    """
+    box = _parse_bbox(bbox)
+    if box['status'] != 'success':
+        return box
+    min_lat, min_lng, max_lat, max_lng = box['data']
+
+    points = db_operator.get_map_points_in_bbox(min_lat, min_lng, max_lat, max_lng, point_type or None, MAP_POINTS_LIMIT + 1)
+    if points is None:
+        return {"status": "error", "message": "Error al recuperar los puntos del mapa."}
+
+    return {
+        "status": "success",
+        "data": points[:MAP_POINTS_LIMIT],
+        "truncated": len(points) > MAP_POINTS_LIMIT
+    }
+
 def save_map_point(point_data):
     """
     Saves a new map point to the database.
     """
     try:
-        conn = db_conn.create_connection()
-        if conn is None:
-            return {'status': 'error', 'message': 'Error de conexión a la base de datos'}
-            
-        cursor = conn.cursor()
-        
         # Obtener creator_id de la sesión o usar valor por defecto
         creator_id = point_data.get('creator_id', 1)
-        
-        cursor.execute("""
-            INSERT INTO map_points (
-                name, 
-                description, 
-                point_type, 
-                latitude, 
-                longitude, 
-                added_by,
-                creator_id
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
+        latitude = float(point_data['latitude'])
+        longitude = float(point_data['longitude'])
+
+        duplicate = find_duplicate_map_point(point_data['name'], point_data['point_type'], latitude, longitude)
+        if duplicate and MAP_DUPLICATE_MODE == 'merge':
+            return _duplicate_point_response(point_data['name'], duplicate)
+
+        # Same path as add_map_point_logic, so the cluster pyramid is updated in the same transaction
+        point_id = db_operator.add_map_point(
+            creator_id,
             point_data['name'],
             point_data['description'],
             point_data['point_type'],
-            point_data['latitude'],
-            point_data['longitude'],
-            point_data['added_by'],
-            creator_id
-        ))
-        
-        conn.commit()
-        return {'status': 'success', 'message': 'Punto guardado exitosamente'}
+            latitude,
+            longitude,
+            geohash=geo.geohash_encode(latitude, longitude),
+            added_by=point_data['added_by']
+        )
+        if point_id is None:
+            return {'status': 'error', 'message': 'Error al guardar el punto de mapa'}
+
+        map_live.point_added(db_operator.get_map_point(point_id))
+        response = {'status': 'success', 'message': 'Punto guardado exitosamente'}
+        if duplicate:
+            response['possible_duplicate_of'] = duplicate['id']
+        return response
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
-    finally:
-        if conn:
-            conn.close()
 
 #-----------------------------
 
@@ -1238,99 +1862,60 @@ def update_challenge_progress_logic(entity_id, entity_type, challenge_id, progre
         return {"status": "error", "message": "Error al actualizar el progreso del desafío."}
 
 # --- Points Functions ---
-def update_org_points_from_members_logic(org_id=None, user_id=None):
+ORG_POINTS_INTERVAL = int(os.environ.get('ORG_POINTS_INTERVAL', 3600))
+ORG_POINTS_BATCH = 500
+
+def update_org_points_from_members_logic(org_id=None, user_id=None, progress=None):
     """
-    Updates organization points based on the sum of its members' points.
+    Updates organization points: the points the organization earned itself plus the sum of its members' points.
     
     If org_id is provided, only that organization's points are updated.
     If user_id is provided, all organizations that the user is a member of will be updated.
-    If neither is provided, all organizations will be updated.
+    If neither is provided, all organizations will be updated, in batches of
+    ORG_POINTS_BATCH (this is the 'org_points' scheduled job, not for request handlers).
     
     Args:
         org_id (int, optional): The ID of a specific organization to update
         user_id (int, optional): The ID of a user whose organizations should be updated
+        progress (callable, optional): progress(done, total, message), see scheduler.py
         
     Returns:
-        dict: Status message and list of updated organizations
+        dict: Status message and number of updated organizations
     """
-    updated_orgs = []
-    
+    org_ids = None
     if user_id:
         # Get all organizations this user is a member of
-        user_orgs = db_operator.search_orgs(user_id)
-        if user_orgs:
-            for org in user_orgs:
-                update_result = update_single_org_points(org['org_id'])
-                if update_result:
-                    updated_orgs.append(update_result)
+        org_ids = [org['org_id'] for org in db_operator.search_orgs(user_id=user_id)]
+        if not org_ids:
+            return {"status": "info", "message": "No se actualizaron organizaciones", "updated": 0}
     elif org_id:
-        # Update a specific organization
-        update_result = update_single_org_points(org_id)
-        if update_result:
-            updated_orgs.append(update_result)
-    else:
-        # Update all organizations
-        all_orgs = db_operator.search_orgs()
-        if all_orgs:
-            for org in all_orgs:
-                update_result = update_single_org_points(org['org_id'])
-                if update_result:
-                    updated_orgs.append(update_result)
-    
-    if updated_orgs:
+        org_ids = [org_id]
+
+    total = db_operator.get_orgs_count() if org_ids is None and progress else None
+    updated = scanned = 0
+    after_org_id = 0
+    while after_org_id is not None:
+        result = db_operator.reconcile_org_points(after_org_id, ORG_POINTS_BATCH, org_ids)
+        if result is None:
+            return {"status": "error", "message": "Error al actualizar los puntos de las organizaciones.", "updated": updated}
+        if org_ids is not None:
+            for changed_id, previous_points, new_points in result['updated']:
+                print(f"Logic: Updated organization ID {changed_id} points from {previous_points} to {new_points}")
+        updated += len(result['updated'])
+        scanned += result['scanned']
+        after_org_id = result['last_org_id']
+        if progress:
+            progress(scanned, total, f"{updated} organizaciones actualizadas")
+
+    if updated:
+        response_cache.invalidate('orgs')
         return {
             "status": "success", 
-            "message": f"Puntos actualizados para {len(updated_orgs)} organizaciones"
+            "message": f"Puntos actualizados para {updated} organizaciones",
+            "updated": updated
         }
     else:
-        return {"status": "info", "message": "No se actualizaron organizaciones"}
-
-def update_single_org_points(org_id):
-    """
-    Helper function to update a single organization's points.
-    
-    Args:
-        org_id (int): The ID of the organization to update
-        
-    Returns:
-        dict or None: Information about the updated organization or None if update failed
-    """
-    members = db_operator.get_org_members(org_id)
-    
-    if not members:
-        return None
-    
-    # Calculate the sum of all members' points
-    total_points = 0
-    
-    for member in members:
-        # Get user details including points
-        user_data = db_operator.get_user_by_id(member['user_id'])
-        total_points += user_data.get('points', 0)
-    
-    # Get current organization points
-    org_data = db_operator.get_org_by_id(org_id)
-    if not org_data:
-        return None
-    
-    current_points = org_data.get('points', 0)
-    
-    if total_points != current_points:
-        points_diff = total_points - current_points
-        
-        db_operator.update_entity_points(org_id, 'org', points_diff)
-        
-        print(f"Logic: Updated organization ID {org_id} points from {current_points} to {total_points}")
-        
-        return {
-            'org_id': org_id,
-            'name': org_data.get('name', 'Unknown'),
-            'previous_points': current_points,
-            'new_points': total_points,
-            'members_count': len(members)
-        }
-    
-    return None
+        return {"status": "info", "message": "No se actualizaron organizaciones", "updated": 0}
 
 def award_points_logic(entity_id, entity_type, points_to_add):
     """
@@ -1382,8 +1967,14 @@ def award_points_logic(entity_id, entity_type, points_to_add):
                 # Unlock the achievement
                 achievement_unlocked = ach['name']
                 db_operator.update_entity_achievements(entity_id, entity_type, ach['achievement_id'])
+                if entity_type == 'user':
+                    notifications.notify(entity_id, 'achievement_unlocked', f"¡Desbloqueaste el logro '{ach['name']}'!", "/achievements")
                 break
-        db_operator.update_entity_points(entity_id, entity_type, new_points)
+        if entity_type == 'org':
+            # Kept apart from the members' sum, so update_org_points_from_members_logic keeps them
+            db_operator.add_org_own_points(entity_id, points_to_add)
+        else:
+            db_operator.update_entity_points(entity_id, entity_type, new_points)
         response = {
             "status": "success",
             "Total points": f"Nuevos puntos totales: {new_points}",
@@ -1397,7 +1988,7 @@ def award_points_logic(entity_id, entity_type, points_to_add):
         }
 
     if entity_type == 'user':
-        update_org_points_from_members_logic(entity_id)
+        update_org_points_from_members_logic(user_id=entity_id)
      
     return response
 
@@ -1442,6 +2033,7 @@ def admin_delete_org_logic(org_id_to_delete):
     """
     success = db_operator.delete_org_by_id(org_id_to_delete)
     if success:
+        response_cache.invalidate('orgs')
         return {"status": "success", "message": f"Organización ID {org_id_to_delete} eliminada exitosamente."}
     else:
         return {"status": "error", "message": f"Error al eliminar la organización ID {org_id_to_delete}."}
@@ -1546,10 +2138,222 @@ def admin_delete_event(event_id):
     
     success = db_operator.delete_event(event_id, None, 'admin')
     if success:
+        response_cache.invalidate('events')
         return {"status": "success", "message": "Evento eliminado exitosamente."}
     else:
         return {"status": "error", "message": "Error al eliminar el evento. Puede que no exista."}
 
+def admin_get_moderation_terms_logic():
+    """
+    Admin function to list the banned terms of the moderation filter.
+
+    Returns:
+        dict: Status and data containing a list of terms
+    """
+    terms = db_operator.get_moderation_terms()
+    return {"status": "success", "data": terms}
+
+def admin_add_moderation_term_logic(term, action):
+    """
+    Allows an admin (verified in app.py) to add a banned term and hot reload the filter.
+
+    Args:
+        term (str): Word or link fragment to filter.
+        action (str): 'mask' or 'reject'.
+    """
+    if not term or not term.strip():
+        return {"status": "error", "message": "Se requiere el término."}
+    if action not in moderation.VALID_ACTIONS:
+        return {"status": "error", "message": f"Acción inválida. Debe ser una de: {', '.join(moderation.VALID_ACTIONS)}"}
+
+    normalized_term, _ = moderation.normalize_text(term.strip())
+    term_id = db_operator.add_moderation_term(normalized_term, action)
+    if term_id:
+        moderation.reload_terms()
+        return {"status": "success", "message": f"Término '{normalized_term}' agregado exitosamente."}
+    else:
+        return {"status": "error", "message": "Error al agregar el término. Puede que ya exista."}
+
+def admin_delete_moderation_term_logic(term_id):
+    """
+    Allows an admin (verified in app.py) to delete a banned term and hot reload the filter.
+
+    Args:
+        term_id (int): ID of the term to delete.
+    """
+    success = db_operator.delete_moderation_term(term_id)
+    if success:
+        moderation.reload_terms()
+        return {"status": "success", "message": "Término eliminado exitosamente."}
+    else:
+        return {"status": "error", "message": "Error al eliminar el término."}
+
+def admin_get_campus_places_logic():
+    """
+    Admin function to list the campus gazetteer used to geocode event locations.
+    """
+    return {"status": "success", "data": db_operator.get_campus_places()}
+
+def admin_import_users_logic(stream, filename):
+    """
+    Allows an admin (verified in app.py) to pre-register a cohort of students from
+    a CSV or JSON file (see user_import.py).
+
+    Args:
+        stream: Binary file object of the upload.
+        filename (str): Original file name, selects the format.
+
+    Returns:
+        dict: status, message and data {'summary': counts per status, 'report': one entry per row}.
+    """
+    if not filename:
+        return {"status": "error", "message": "Selecciona un archivo para importar."}
+
+    report = user_import.import_users(user_import.iter_rows(stream, filename))
+    summary = {'created': 0, 'duplicate': 0, 'invalid': 0, 'error': 0}
+    for entry in report:
+        summary[entry['status']] += 1
+
+    status = "success" if summary['created'] else "warning"
+    message = (f"Importación terminada: {summary['created']} creados, {summary['duplicate']} duplicados, "
+               f"{summary['invalid']} inválidos, {summary['error']} con error.")
+    return {"status": status, "message": message, "data": {"summary": summary, "report": report}}
+
+def admin_add_campus_place_logic(name, latitude, longitude):
+    """
+    Allows an admin (verified in app.py) to add a campus place and geocodes
+    the pending events that mention it.
+
+    Args:
+        name (str): Place name or building code as people write it, e.g. 'ML' or 'Plazoleta Lleras'.
+        latitude, longitude (float): Coordinates of the place.
+    """
+    normalized_name = _normalize_point_name(name)
+    if not normalized_name:
+        return {"status": "error", "message": "Se requiere el nombre del lugar."}
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "Latitud y longitud deben ser números válidos."}
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return {"status": "error", "message": "Coordenadas fuera de rango."}
+
+    place_id = db_operator.add_campus_place(name.strip(), normalized_name, latitude, longitude)
+    if not place_id:
+        return {"status": "error", "message": "Error al agregar el lugar. Puede que ya exista."}
+    geocoded = geocode_pending_events_logic()
+    return {"status": "success", "message": f"Lugar '{name.strip()}' agregado exitosamente. {geocoded['message']}"}
+
+def admin_delete_campus_place_logic(place_id):
+    """
+    Allows an admin (verified in app.py) to delete a campus place.
+    Events already geocoded with it keep their coordinates.
+    """
+    if db_operator.delete_campus_place(place_id):
+        return {"status": "success", "message": "Lugar eliminado exitosamente."}
+    else:
+        return {"status": "error", "message": "Error al eliminar el lugar."}
+
+def admin_reload_moderation_logic():
+    """
+    Recompiles the moderation filter from the database without restarting the server.
+    """
+    count = moderation.reload_terms()
+    return {"status": "success", "message": f"Filtro de moderación recargado con {count} términos."}
+
+def search_messages_logic(entity_id, entity_type, query, before_id=None, limit=20):
+    """
+    Searches the caller's private chats and org group rooms.
+    Adds to each result who the conversation is with, so the UI can link to it.
+
+    Returns:
+        dict: {"status", "message", "data": [results], "next_before_id": cursor or None}
+    """
+    query = (query or '').strip()
+    if len(query) < 2:
+        return {"status": "error", "message": "Escribe al menos 2 caracteres para buscar.", "data": [], "next_before_id": None}
+
+    result = db_operator.search_messages(entity_id, entity_type, query, limit, before_id)
+    if result['status'] != 'success':
+        return {"status": "error", "message": "Error al buscar en los mensajes.", "data": [], "next_before_id": None}
+
+    names = {}
+    def entity_name(other_id, other_type):
+        if (other_id, other_type) not in names:
+            entity = get_entity_by_id(other_id, other_type)
+            names[(other_id, other_type)] = (entity.get('data') or {}).get('name', 'Desconocido')
+        return names[(other_id, other_type)]
+
+    for message in result['data']:
+        if message['recipient_type'] == 'org':
+            message['chat_type'] = 'group'
+            message['chat_with_id'] = message['recipient_id']
+            message['chat_with_type'] = 'org'
+        else:
+            message['chat_type'] = 'private'
+            is_sender = message['sender_id'] == entity_id and message['sender_type'] == entity_type
+            message['chat_with_id'] = message['recipient_id'] if is_sender else message['sender_id']
+            message['chat_with_type'] = message['recipient_type'] if is_sender else message['sender_type']
+        message['chat_with_name'] = entity_name(message['chat_with_id'], message['chat_with_type'])
+
+    return {
+        "status": "success",
+        "message": f"{len(result['data'])} mensajes encontrados.",
+        "data": result['data'],
+        "next_before_id": result['next_before_id']
+    }
+
+# --- Notification Functions ---
+def get_notifications_logic(user_id, before_id=None, limit=20):
+    """
+    Retrieves a page of the user's notifications and the unread counter.
+    """
+    data = db_operator.get_notifications(user_id, limit, before_id)
+    return {
+        "status": "success",
+        "data": data,
+        "unread_count": db_operator.get_unread_notifications_count(user_id),
+        "next_before_id": data[-1]['notification_id'] if len(data) == limit else None
+    }
+
+def mark_notifications_read_logic(user_id, notification_ids=None):
+    """
+    Marks some (or all, if notification_ids is None) notifications as read.
+    """
+    unread_count = db_operator.mark_notifications_read(user_id, notification_ids)
+    if unread_count is None:
+        return {"status": "error", "message": "Error al actualizar las notificaciones."}
+    return {"status": "success", "message": "Notificaciones marcadas como leídas.", "unread_count": unread_count}
+
+def get_unread_notifications_count_logic(user_id):
+    return db_operator.get_unread_notifications_count(user_id)
+
+MESSAGE_ARCHIVE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_DAYS', 180))
+
+def archive_messages_logic(max_age_days=None):
+    """
+    Moves chat messages older than max_age_days (default MESSAGE_ARCHIVE_DAYS)
+    to the compressed archive db, keeping the hot messages table small.
+    """
+    if max_age_days is None:
+        max_age_days = MESSAGE_ARCHIVE_DAYS
+    try:
+        max_age_days = int(max_age_days)
+    except (TypeError, ValueError):
+        return {"status": "error", "message": "La antigüedad debe ser un número de días."}
+    if max_age_days < 1:
+        return {"status": "error", "message": "La antigüedad debe ser de al menos 1 día."}
+
+    result = db_operator.archive_old_messages(max_age_days)
+    if result['status'] != 'success':
+        return {"status": "error", "message": "Error al archivar los mensajes."}
+    return {
+        "status": "success",
+        "message": f"{result['archived']} mensajes archivados en {result['chunks']} bloques.",
+        "data": result
+    }
+
 # --- Stats Functions ---
 def get_users_count():
     """Returns the total number of users in the system."""
@@ -1603,12 +2407,211 @@ def get_top_orgs_by_points(limit=5):
     # Limit the results to the specified number
     return top_orgs[:limit] if limit and len(top_orgs) > limit else top_orgs
 
+def _admin_page(fetch, key, page_size, total, before_id=None, after_id=None):
+    """
+    One page of an admin drill-down list, newest first, by keyset on the id column `key`.
+
+    Returns:
+        dict: {'rows', 'total', 'before_id', 'after_id', 'next_before_id', 'prev_after_id'},
+              the last two are the cursors of the older / newer page (None at either end).
+              None on database error.
+    """
+    # One extra row tells whether there is another page in the direction we are moving
+    rows = fetch(page_size + 1, before_id=before_id, after_id=after_id)
+    if rows is None:
+        return None
+    if after_id is not None:
+        has_newer, has_older = len(rows) > page_size, True
+        rows = rows[-page_size:]
+    else:
+        has_newer, has_older = before_id is not None, len(rows) > page_size
+        rows = rows[:page_size]
+    return {
+        'rows': rows,
+        'total': total,
+        'before_id': before_id,
+        'after_id': after_id,
+        'next_before_id': rows[-1][key] if rows and has_older else None,
+        'prev_after_id': rows[0][key] if rows and has_newer else None
+    }
+
+def get_admin_stats_logic(top_n=10, users_before=None, users_after=None, orgs_before=None, orgs_after=None, page_size=25):
+    """
+    Admin dashboard / statistics data, read from the precomputed snapshot (see stats_snapshot.py).
+
+    Args:
+        top_n (int): Length of the top organizations and users lists.
+        users_before, users_after (int, optional): Cursor of the users list page, see _admin_page.
+        orgs_before, orgs_after (int, optional): Cursor of the organizations list page.
+        page_size (int): Rows per page of both lists.
+
+    Returns:
+        dict: status, message and data {'counts', 'top_orgs', 'top_users', 'series',
+              'refreshed_at', 'users', 'orgs'}; users / orgs are pages as returned by _admin_page.
+    """
+    stats = stats_snapshot.get(top_n=top_n)
+    if stats is None:
+        return {"status": "error", "message": "Error al cargar las estadísticas.", "data": None}
+
+    stats['users'] = _admin_page(db_operator.users_page, 'user_id', page_size, stats['counts']['users'],
+                                 users_before, users_after)
+    stats['orgs'] = _admin_page(db_operator.orgs_page, 'org_id', page_size, stats['counts']['orgs'],
+                                orgs_before, orgs_after)
+    if stats['users'] is None or stats['orgs'] is None:
+        return {"status": "error", "message": "Error al cargar las estadísticas.", "data": None}
+    return {"status": "success", "message": "Estadísticas cargadas.", "data": stats}
+
+def refresh_stats_snapshot_logic():
+    """Recomputes the dashboard top lists now instead of waiting for the periodic refresh."""
+    if not stats_snapshot.refresh():
+        return {"status": "error", "message": "Error al actualizar las estadísticas."}
+    return {"status": "success", "message": "Estadísticas actualizadas."}
+
+# --- Background Jobs (see scheduler.py) ---
+CHALLENGE_EXPIRY_INTERVAL = int(os.environ.get('CHALLENGE_EXPIRY_INTERVAL', 300))
+CHALLENGE_EXPIRY_BATCH = 500
+MAP_CLUSTERS_CHECK_INTERVAL = int(os.environ.get('MAP_CLUSTERS_CHECK_INTERVAL', 3600))
+
+def expire_challenges_logic(progress=None):
+    """
+    Marks the active user and organization challenges whose deadline passed as 'expired'.
+
+    Args:
+        progress (callable, optional): progress(done, total, message), see scheduler.py
+
+    Returns:
+        dict: status, message and the number of challenges expired per entity type.
+    """
+    expired = {'user': 0, 'org': 0}
+    for entity_type in expired:
+        while True:
+            count = db_operator.expire_challenges_batch(entity_type, CHALLENGE_EXPIRY_BATCH)
+            if count is None:
+                return {"status": "error", "message": "Error al vencer los retos.", "data": expired}
+            expired[entity_type] += count
+            if progress:
+                progress(expired['user'] + expired['org'], None, f"{entity_type}: {expired[entity_type]} retos vencidos")
+            if count < CHALLENGE_EXPIRY_BATCH:
+                break
+    return {
+        "status": "success",
+        "message": f"Retos vencidos: {expired['user']} de usuarios, {expired['org']} de organizaciones.",
+        "data": expired
+    }
+
+def _job(logic_function):
+    """Adapts a logic function returning a status dict to a scheduler job."""
+    def run(progress):
+        result = logic_function(progress=progress)
+        if result['status'] == 'error':
+            raise RuntimeError(result['message'])
+        return result['message']
+    return run
+
+def _stats_refresh_job(progress):
+    if not stats_snapshot.refresh():
+        raise RuntimeError("Error al actualizar las estadísticas.")
+    pruned = analytics.prune_hourly()
+    return f"Estadísticas actualizadas, {pruned or 0} filas horarias antiguas eliminadas."
+
+scheduler.register('org_points', _job(update_org_points_from_members_logic), ORG_POINTS_INTERVAL,
+                   "Recompute every organization's points: its own points plus its members' points.")
+scheduler.register('challenge_expiry', _job(expire_challenges_logic), CHALLENGE_EXPIRY_INTERVAL,
+                   "Mark active challenges past their deadline as expired.")
+scheduler.register('map_clusters', _job(check_map_clusters_logic), MAP_CLUSTERS_CHECK_INTERVAL,
+                   "Rebuild the map cluster pyramid if it is missing points.")
+scheduler.register('heatmap', _job(rebuild_heatmap_logic), None,
+                   "Rebuild the admin heatmap rasters of every time window.")
+scheduler.register('stats_refresh', _stats_refresh_job, stats_snapshot.STATS_REFRESH_INTERVAL,
+                   "Refresh the dashboard top lists and counters, prune old hourly rollups.")
+
+def get_jobs_logic():
+    """
+    State of the background jobs for the admin jobs page.
+
+    Returns:
+        dict: status, message and data (list of jobs, see scheduler.get_jobs).
+    """
+    jobs = scheduler.get_jobs()
+    if jobs is None:
+        return {"status": "error", "message": "Error al cargar las tareas.", "data": None}
+    return {"status": "success", "message": "Tareas cargadas.", "data": jobs}
+
+def run_job_logic(job_name):
+    """Queues a background job to run now. Returns a status message dictionary."""
+    try:
+        queued = scheduler.request_run(job_name)
+    except KeyError:
+        return {"status": "error", "message": "Tarea desconocida."}
+    if queued is None:
+        return {"status": "error", "message": "Error al programar la tarea."}
+    if not queued:
+        return {"status": "info", "message": "La tarea ya está en cola o en ejecución."}
+    return {"status": "success", "message": "Tarea en cola, se ejecutará en unos segundos."}
+
+def get_activity_analytics_logic(metric, granularity='day', days=30):
+    """
+    Time series of one community activity metric for the admin analytics charts (see analytics.py).
+
+    Args:
+        metric (str): signups, events, items_listed, items_exchanged or messages.
+        granularity (str): 'hour', 'day' or 'week'.
+        days (int): How far back.
+
+    Returns:
+        dict: status, message and data {'metric', 'granularity', 'buckets', 'series', 'total'}.
+    """
+    try:
+        data = analytics.series(metric, granularity, days)
+    except ValueError:
+        return {"status": "error", "message": "Métrica o intervalo no válido.", "data": None}
+    if data is None:
+        return {"status": "error", "message": "Error al cargar las estadísticas.", "data": None}
+    return {"status": "success", "message": "Estadísticas cargadas.", "data": data}
+
+
+def get_export_options_logic():
+    """Datasets, their columns and the formats available, for the admin export form."""
+    return {
+        "status": "success",
+        "message": "Opciones de exportación.",
+        "data": {
+            "datasets": {name: list(dataset['columns']) for name, dataset in exports.DATASETS.items()},
+            "formats": exports.available_formats()
+        }
+    }
+
+def export_dataset_logic(dataset, fmt='csv', columns=None, since=None, until=None):
+    """
+    Prepares a streamed export (see exports.py). The rows are only read while the response is sent.
+
+    Args:
+        dataset (str): users, events, participation or exchanges.
+        fmt (str): 'csv' or 'parquet'.
+        columns (list): Columns to include, empty for all.
+        since (str): First day included, 'YYYY-MM-DD'.
+        until (str): Last day included, 'YYYY-MM-DD'.
+
+    Returns:
+        dict: status, message and data {'chunks', 'mimetype', 'filename'}.
+    """
+    try:
+        chunks, mimetype, filename = exports.open_export(dataset, fmt, columns, since or None, until or None)
+    except ValueError as e:
+        return {"status": "error", "message": str(e), "data": None}
+    print(f"Export of {dataset} as {fmt} started (columns={columns or 'all'}, since={since}, until={until})")
+    return {
+        "status": "success",
+        "message": "Exportación iniciada.",
+        "data": {"chunks": chunks, "mimetype": mimetype, "filename": filename}
+    }
 
 # --- Messaging Functions ---
 
 ## SocketIO event handlers
 
 @socketio.on('connect')
+@profiling.socket_event('connect')
 def handle_connect():
     """
     Handler for the SocketIO 'connect' event.
@@ -1650,12 +2653,16 @@ def handle_connect():
             org_room = f'org_room_{org_id}'
             join_room(org_room)
             print(f"SocketIO: User {user_id} joined organization room: {org_room}")
+
+        # Anything that happened while the user was offline
+        notifications.deliver_pending(user_id)
         
     #elif with user_type == 'org' case. [TODO: Add logic for organizations]
     else: print(f"SocketIO: User not authenticated. SID: {sid} not saved.")
     # (session, request, connected_users, join_room)
 
 @socketio.on('disconnect')
+@profiling.socket_event('disconnect')
 def handle_disconnect():
     """
     Handler for the SocketIO 'disconnect' event.
@@ -1685,6 +2692,8 @@ def handle_disconnect():
             user_id_remove = value
             break
     
+    rate_limiter.forget_sid(sid)
+    
     if user_id_remove:
         try:
             del connected_users[sid]
@@ -1695,7 +2704,25 @@ def handle_disconnect():
     
     # (request, connected_users)
 
+@socketio.on('join_map')
+@profiling.socket_event('join_map')
+def handle_join_map() -> None:
+    """
+    Handler for the custom 'join_map' event, emitted by the map page.
+    Any visitor (logged in or not) can follow the map: the connection joins
+    map_live.MAP_ROOM and receives the 'map_updates' deltas.
+    """
+    join_room(map_live.MAP_ROOM)
+    print(f"SocketIO: SID {request.sid} joined the map room.")
+
+@socketio.on('leave_map')
+@profiling.socket_event('leave_map')
+def handle_leave_map() -> None:
+    """Handler for the custom 'leave_map' event, stops the map deltas for this connection."""
+    leave_room(map_live.MAP_ROOM)
+
 @socketio.on('private_message')
+@profiling.socket_event('private_message')
 def handle_private_message(data: dict) -> None:
     """
     Handler for the custom 'private_message' event.
@@ -1727,6 +2754,12 @@ def handle_private_message(data: dict) -> None:
         print("SocketIO: Sender not authenticated.")
         return
     
+    limit = rate_limiter.check('private_message', sid=request.sid, entity_type=sender_type, entity_id=sender_id)
+    if limit['status'] != 'success':
+        emit('error_message', {'message': limit['message']})
+        print(f"SocketIO: Rate limit reached for SID {request.sid}.")
+        return
+    
     recipient_id_str = data.get('recipient_id')
     recipient_type = 'user'
     content = data.get('content')
@@ -1743,6 +2776,12 @@ def handle_private_message(data: dict) -> None:
         print("SocketIO: Invalid recipient ID.")
         return
     
+    moderated = moderation.moderate_text(content)
+    if moderated['status'] != 'success':
+        emit('error_message', {'message': moderated['message']})
+        print("SocketIO: Message rejected by moderation.")
+        return
+    content = moderated['text']
     
     save_message = save_message_logic(sender_id, sender_type, recipient_id, recipient_type, content)
     
@@ -1760,6 +2799,7 @@ def handle_private_message(data: dict) -> None:
         'content': content,
         'timestamp': time_now,
         'message_id': save_message.get('message_id'),
+        'moderated': moderated['masked'],
     }
     
     recipient_room = str(recipient_id)
@@ -1768,6 +2808,7 @@ def handle_private_message(data: dict) -> None:
     # (session, data, save_message_logic, emit)
 
 @socketio.on('group_message')
+@profiling.socket_event('group_message')
 def handle_group_message(data : dict) -> None:
     """
     Handler for the custom 'group_message' event.
@@ -1801,6 +2842,12 @@ def handle_group_message(data : dict) -> None:
         print("SocketIO: Sender not authenticated.")
         return
     
+    limit = rate_limiter.check('group_message', sid=request.sid, entity_type=sender_type, entity_id=sender_id)
+    if limit['status'] != 'success':
+        emit('error_message', {'message': limit['message']})
+        print(f"SocketIO: Rate limit reached for SID {request.sid}.")
+        return
+    
     org_id_str = data.get('recipient_id')
     content = data.get('content')
     
@@ -1828,6 +2875,13 @@ def handle_group_message(data : dict) -> None:
         print("SocketIO: User is not a member of the organization.")
         return
     
+    moderated = moderation.moderate_text(content)
+    if moderated['status'] != 'success':
+        emit('error_message', {'message': moderated['message']})
+        print("SocketIO: Message rejected by moderation.")
+        return
+    content = moderated['text']
+    
     save_message = save_message_logic(sender_id, sender_type, org_id, 'org', content)
     
     if not save_message or save_message.get('status') != 'success':
@@ -1844,6 +2898,7 @@ def handle_group_message(data : dict) -> None:
         'content': content,
         'timestamp': time_now,
         'message_id': save_message.get('message_id'),
+        'moderated': moderated['masked'],
     }
     
     group_room = f'org_room_{org_id}'
@@ -1877,7 +2932,7 @@ def save_message_logic(sender_id: int, sender_type: str, recipient_id: int, reci
     
     return result
 
-def get_conversation_logic(user1_id: int, user1_type: str, user2_id: int, user2_type: str, limit) -> dict:
+def get_conversation_logic(user1_id: int, user1_type: str, user2_id: int, user2_type: str, limit, before_id=None) -> dict:
     """
     function to retrieve the message history between two specific entities.
 
@@ -1891,6 +2946,8 @@ def get_conversation_logic(user1_id: int, user1_type: str, user2_id: int, user2_
         user2_id (int): ID of the second entity.
         user2_type (str): Type of the second entity ('user' or 'org').
         limit (int): The maximum number of messages to retrieve.
+        before_id (int, optional): Load only messages older than this message_id
+            (used by "load older messages"; may reach the archive db).
 
     Returns:
         dict: A dictionary containing the result from db_operator.get_conversation,
@@ -1899,11 +2956,11 @@ def get_conversation_logic(user1_id: int, user1_type: str, user2_id: int, user2_
               or {'status': 'error', 'message': <error_msg>} on failure.
     """
     
-    result = db_operator.get_conversation(user1_id, user1_type, user2_id, user2_type, limit)
+    result = db_operator.get_conversation(user1_id, user1_type, user2_id, user2_type, limit, before_id)
     
     return result
 
-def get_group_conversation_logic(org_id: int, limit: int) -> list:
+def get_group_conversation_logic(org_id: int, limit: int, before_id=None) -> list:
     """
     function to retrieve the message history for a specific organization group chat.
 
@@ -1913,11 +2970,12 @@ def get_group_conversation_logic(org_id: int, limit: int) -> list:
     Args:
         org_id (int): The ID of the organization group.
         limit (int): The maximum number of messages to retrieve.
+        before_id (int, optional): Load only messages older than this message_id.
 
     Returns:
         dict: Result dictionary from the db_operator function, containing
               status and message data list or an error message.
     """
     
-    result = db_operator.get_group_conversation(org_id, limit)
+    result = db_operator.get_group_conversation(org_id, limit, before_id)
     return result
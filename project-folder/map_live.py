@@ -0,0 +1,84 @@
+'''Live map updates: point add/delete deltas pushed to the 'map' Socket.IO room'''
+'''
+Map viewers join MAP_ROOM (socket event 'join_map', see logic.py). Every write to
+map_points queues a delta here, and a background task flushes the queue at most
+once every FLUSH_INTERVAL seconds, so a burst of writes reaches the browsers as
+ONE 'map_updates' event and a point added and deleted in the same window only
+costs its removal.
+
+Socket payload:
+{"added": [<point>, ...], "removed": [{"id", "latitude", "longitude", "point_type"}, ...]}
+or {"reset": true} when there are more than MAX_BATCH changes (e.g. the admin
+dedupe tool), the clients then reload their viewport instead.
+
+Points have the same shape as /api/map/points, so the client renders both the same way.
+The background task is a batching.BatchingEmitter, like the one of notifications.py.
+'''
+
+import threading
+#CUSTOM MODULES
+import batching
+
+MAP_ROOM = 'map'
+FLUSH_INTERVAL = 1.0  # seconds deltas are coalesced before being pushed
+MAX_BATCH = 500       # above this a reset is cheaper than the deltas
+
+_emitter = batching.BatchingEmitter("Map live", FLUSH_INTERVAL)
+_added = {}    # point id -> point
+_removed = {}  # point id -> {id, latitude, longitude, point_type}
+_reset = False
+_lock = threading.Lock()
+
+
+def init(socketio):
+    """Wires the dispatcher to the app's SocketIO instance."""
+    _emitter.init(socketio, flush)
+
+
+def point_added(point):
+    """Queues a new point (dict as returned by db_operator.get_map_point)."""
+    if point is None:
+        return
+    with _lock:
+        _added[point['id']] = point
+    _emitter.queued()
+
+
+def point_removed(point):
+    """Queues the removal of a point, point needs id, latitude, longitude and point_type."""
+    if point is None:
+        return
+    with _lock:
+        _added.pop(point['id'], None)
+        _removed[point['id']] = {
+            'id': point['id'],
+            'latitude': point['latitude'],
+            'longitude': point['longitude'],
+            'point_type': point['point_type']
+        }
+    _emitter.queued()
+
+
+def reset():
+    """Tells the viewers to reload their viewport (bulk changes)."""
+    global _reset
+    with _lock:
+        _reset = True
+    _emitter.queued()
+
+
+def flush():
+    """Pushes the queued deltas to the map room as one event (if it fails, viewers resync on their next pan/zoom)."""
+    global _reset
+    with _lock:
+        added = list(_added.values())
+        removed = list(_removed.values())
+        reset_requested = _reset
+        _added.clear()
+        _removed.clear()
+        _reset = False
+
+    if reset_requested or len(added) + len(removed) > MAX_BATCH:
+        _emitter.socketio.emit('map_updates', {'reset': True}, to=MAP_ROOM)
+    elif added or removed:
+        _emitter.socketio.emit('map_updates', {'added': added, 'removed': removed}, to=MAP_ROOM)
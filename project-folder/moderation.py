@@ -0,0 +1,204 @@
+'''Content moderation for chat messages, items and events'''
+'''
+Banned terms are compiled once into an Aho-Corasick automaton, so checking a
+text costs O(len(text) + matches) no matter how many terms are in the list.
+
+ACTIONS (moderation_terms.action):
+mask: the term is replaced with asterisks and the content is accepted
+reject: the whole content is refused
+
+The table starts with db_conn.DEFAULT_MODERATION_TERMS and is managed by the admins.
+
+Both the terms and the text are normalized (lowercase, no accents), so
+"Estúpido" matches the term "estupido".
+'''
+
+import threading
+import time
+import unicodedata
+#CUSTOM MODULES
+import db_operator
+
+VALID_ACTIONS = ['mask', 'reject']
+REFRESH_INTERVAL = 30  # seconds between cheap checks for changes made by other workers
+
+_lock = threading.Lock()
+_automaton = None
+_signature = None
+_last_check = 0.0
+
+
+def normalize_text(text):
+    """
+    Lowercases the text and strips accents.
+
+    Returns:
+        tuple: (normalized string, list mapping each normalized char to its index in text)
+    """
+    normalized = []
+    index_map = []
+    for index, char in enumerate(text):
+        for piece in unicodedata.normalize('NFKD', char):
+            if unicodedata.combining(piece):
+                continue
+            for lowered in piece.lower():
+                normalized.append(lowered)
+                index_map.append(index)
+    return ''.join(normalized), index_map
+
+
+class TermAutomaton:
+    """
+    Aho-Corasick automaton over a fixed list of (term, action) pairs.
+    Build once, then call find() as many times as needed.
+    """
+
+    def __init__(self, terms):
+        self.goto = [{}]      # state -> {char: next_state}
+        self.fail = [0]       # state -> fallback state
+        self.output = [[]]    # state -> [(term_length, term, action), ...]
+
+        for term, action in terms:
+            normalized, _ = normalize_text(term.strip())
+            if normalized:
+                self._add(normalized, action)
+        self._build_failure_links()
+
+    def _add(self, term, action):
+        state = 0
+        for char in term:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append((len(term), term, action))
+
+    def _build_failure_links(self):
+        # Breadth-first, so the failure state of a node is always resolved before its children
+        # Children of the root always fall back to the root (fail = 0 by default)
+        queue = list(self.goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, normalized):
+        """
+        Scans an already normalized text.
+
+        Returns:
+            list: (start, end, term, action) tuples, end exclusive, for whole-word matches only.
+        """
+        matches = []
+        state = 0
+        for position, char in enumerate(normalized):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, term, action in self.output[state]:
+                start = position - length + 1
+                end = position + 1
+                if _is_boundary(normalized, start - 1) and _is_boundary(normalized, end):
+                    matches.append((start, end, term, action))
+        return matches
+
+
+def _is_boundary(text, index):
+    """True if index is outside the text or points to a non alphanumeric char."""
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+def reload_terms():
+    """
+    Recompiles the automaton from the moderation_terms table.
+    Called by the admin logic after every change (hot reload).
+
+    Returns:
+        int: Number of terms compiled.
+    """
+    global _automaton, _signature, _last_check
+    # The table is the whole list (db_conn seeds it once), an empty table means no filter
+    terms = [(row['term'], row['action']) for row in db_operator.get_moderation_terms()]
+    automaton = TermAutomaton(terms)
+    with _lock:
+        _automaton = automaton
+        _signature = db_operator.get_moderation_signature()
+        _last_check = time.monotonic()
+    print(f"Moderation: compiled {len(terms)} terms.")
+    return len(terms)
+
+
+def _get_automaton():
+    """Returns the compiled automaton, rebuilding it if another worker changed the terms."""
+    global _last_check
+    if _automaton is None:
+        reload_terms()
+    elif time.monotonic() - _last_check > REFRESH_INTERVAL:
+        _last_check = time.monotonic()
+        if db_operator.get_moderation_signature() != _signature:
+            reload_terms()
+    return _automaton
+
+
+def moderate_text(text):
+    """
+    Checks a text against the banned terms.
+
+    Returns:
+        dict: {"status": "error", "message": ...} if the text must be rejected, otherwise
+              {"status": "success", "text": <masked text>, "masked": bool, "terms": [...]}
+    """
+    if not isinstance(text, str) or not text:
+        return {"status": "success", "text": text, "masked": False, "terms": []}
+
+    normalized, index_map = normalize_text(text)
+    matches = _get_automaton().find(normalized)
+    if not matches:
+        return {"status": "success", "text": text, "masked": False, "terms": []}
+
+    rejected = sorted({term for _, _, term, action in matches if action == 'reject'})
+    if rejected:
+        return {"status": "error", "message": "El contenido contiene términos o enlaces no permitidos.", "terms": rejected}
+
+    chars = list(text)
+    for start, end, _, _ in matches:
+        for original_index in range(index_map[start], index_map[end - 1] + 1):
+            if not chars[original_index].isspace():
+                chars[original_index] = '*'
+
+    return {
+        "status": "success",
+        "text": ''.join(chars),
+        "masked": True,
+        "terms": sorted({term for _, _, term, _ in matches})
+    }
+
+
+def moderate_fields(**fields):
+    """
+    Moderates several text fields at once (e.g. name and description).
+
+    Returns:
+        dict: Error dict from the first rejected field, otherwise
+              {"status": "success", "fields": {name: masked text}, "masked": bool}
+    """
+    cleaned = {}
+    masked = False
+    for field_name, value in fields.items():
+        result = moderate_text(value)
+        if result['status'] != 'success':
+            return result
+        cleaned[field_name] = result['text']
+        masked = masked or result['masked']
+    return {"status": "success", "fields": cleaned, "masked": masked}
@@ -0,0 +1,93 @@
+'''Notifications for users: persisted outbox plus batched Socket.IO delivery'''
+'''
+notify() stores the notification first, so nothing is lost when the user is
+offline, and queues it in memory. A background task flushes the queue every
+FLUSH_INTERVAL seconds, so several events for the same user (e.g. points that
+also unlock an achievement) reach the browser as ONE 'notifications' event on
+the user's personal room (str(user_id), joined in handle_connect).
+
+Users that are not connected keep is_delivered = 0 and receive everything
+through deliver_pending() when they next connect. The background task is a
+batching.BatchingEmitter, like the one of map_live.py.
+
+Socket payload:
+{"notifications": [<notification>, ...], "unread_count": int}
+'''
+
+import threading
+#CUSTOM MODULES
+import batching
+import db_operator
+
+FLUSH_INTERVAL = 1.0  # seconds events are coalesced before being pushed
+
+_emitter = batching.BatchingEmitter("Notifications", FLUSH_INTERVAL)
+_is_online = None
+_pending = {}  # user_id -> [notification, ...]
+_lock = threading.Lock()
+
+
+def init(socketio, is_online):
+    """
+    Wires the dispatcher to the app's SocketIO instance.
+
+    Args:
+        socketio: The flask_socketio.SocketIO object.
+        is_online (callable): is_online(user_id) -> bool, True if the user has a connection.
+    """
+    global _is_online
+    _is_online = is_online
+    _emitter.init(socketio, flush)
+
+
+def notify(user_id, notification_type, message, link=None):
+    """
+    Persists a notification and queues it for the next batched push.
+
+    Returns:
+        dict: The stored notification, or None if it could not be saved.
+    """
+    notification = db_operator.create_notification(user_id, notification_type, message, link)
+    if notification is None:
+        return None
+
+    with _lock:
+        _pending.setdefault(user_id, []).append(notification)
+    _emitter.queued()
+    return notification
+
+
+def flush():
+    """
+    Pushes every queued notification, one event per user. If it fails the rows
+    stay undelivered and are sent again on connect.
+    """
+    with _lock:
+        batches = dict(_pending)
+        _pending.clear()
+
+    for user_id, notifications in batches.items():
+        # Offline users keep is_delivered = 0 and get them in deliver_pending()
+        if _is_online is not None and _is_online(user_id):
+            _emit(user_id, notifications)
+
+
+def _emit(user_id, notifications):
+    _emitter.socketio.emit('notifications', {
+        'notifications': notifications,
+        'unread_count': db_operator.get_unread_notifications_count(user_id)
+    }, to=str(user_id))
+    db_operator.mark_notifications_delivered([n['notification_id'] for n in notifications])
+
+
+def deliver_pending(user_id):
+    """
+    Sends the user everything stored while they were offline, plus the unread count.
+    Called when the user connects.
+    """
+    if _emitter.socketio is None:
+        return
+    with _lock:
+        # Already in the database as undelivered, avoid sending them twice
+        _pending.pop(user_id, None)
+    _emit(user_id, db_operator.get_undelivered_notifications(user_id))
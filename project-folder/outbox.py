@@ -0,0 +1,171 @@
+'''Outgoing mail: persistent outbox sent in batches by a background task'''
+'''
+Request handlers never talk to SMTP. enqueue() inserts a row in email_outbox
+(one quick INSERT) and wakes the sender. The sender is a Socket.IO background
+task in every worker; each pass claims up to OUTBOX_BATCH_SIZE due emails with
+a single UPDATE (db_operator.claim_outbox_batch, so two workers never send the
+same message) and sends them all over ONE SMTP connection (Flask-Mail).
+
+A message that fails is retried with exponential backoff:
+OUTBOX_BACKOFF * 2 ** attempts seconds, at most 6 hours, and is marked 'failed'
+after OUTBOX_MAX_ATTEMPTS tries. If the server can't be reached at all, the
+whole batch is rescheduled the same way. Mail survives restarts: it is only
+marked sent once the server accepted it.
+
+SMTP settings come from the usual Flask-Mail variables (MAIL_SERVER, MAIL_PORT,
+MAIL_USE_TLS, MAIL_USE_SSL, MAIL_USERNAME, MAIL_PASSWORD, MAIL_DEFAULT_SENDER),
+read from the environment. For local testing run a debugging SMTP server that
+prints every message instead of delivering it:
+
+    pip install aiosmtpd
+    python -m aiosmtpd -n -l localhost:1025
+    MAIL_PORT=1025 python app.py
+
+OUTBOX_SENDER=off keeps queuing but starts no background sender; send_pending()
+then sends the queue by hand (e.g. from a cron job or a shell).
+'''
+
+import os
+import secrets
+import smtplib
+import threading
+import time
+from flask_mail import Mail, Message
+#CUSTOM MODULES
+import db_operator
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 15))  # seconds between passes when idle
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+OUTBOX_BACKOFF = float(os.environ.get('OUTBOX_BACKOFF', 60))              # first retry delay, doubled each attempt
+MAX_BACKOFF = 6 * 3600
+STALE_CLAIM_SECONDS = 600  # a batch still 'sending' after this belonged to a dead sender
+WAKE_DELAY = 1.0           # after an enqueue, wait this long so a burst goes out in one batch
+
+_app = None
+_mail = None
+_socketio = None
+_wake = threading.Event()
+_lock = threading.Lock()
+_worker_started = False
+
+
+def init_app(app, socketio):
+    """Configures Flask-Mail from the environment and starts the background sender."""
+    global _app, _mail, _socketio
+    app.config.setdefault('MAIL_SERVER', os.environ.get('MAIL_SERVER', 'localhost'))
+    app.config.setdefault('MAIL_PORT', int(os.environ.get('MAIL_PORT', 25)))
+    app.config.setdefault('MAIL_USE_TLS', os.environ.get('MAIL_USE_TLS', 'false').lower() == 'true')
+    app.config.setdefault('MAIL_USE_SSL', os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true')
+    app.config.setdefault('MAIL_USERNAME', os.environ.get('MAIL_USERNAME'))
+    app.config.setdefault('MAIL_PASSWORD', os.environ.get('MAIL_PASSWORD'))
+    app.config.setdefault('MAIL_DEFAULT_SENDER', os.environ.get('MAIL_DEFAULT_SENDER', 'Parche Verde <no-reply@parcheverde.local>'))
+    _app = app
+    _mail = Mail(app)
+    _socketio = socketio
+    # Also drains what was queued before a restart
+    _ensure_worker()
+
+
+def enqueue(recipient, subject, body, html=None):
+    """
+    Queues an email. This is all the request path does.
+
+    Returns:
+        int: The email_id, or None on database error.
+    """
+    email_id = db_operator.enqueue_email(recipient, subject, body, html)
+    if email_id is not None:
+        _wake.set()
+        _ensure_worker()
+    return email_id
+
+
+def _ensure_worker():
+    global _worker_started
+    if _socketio is None or os.environ.get('OUTBOX_SENDER', 'on') == 'off':
+        return
+    with _lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    _socketio.start_background_task(_send_loop)
+
+
+def _send_loop():
+    idle = 0.0
+    while True:
+        _socketio.sleep(WAKE_DELAY)
+        idle += WAKE_DELAY
+        if not _wake.is_set() and idle < OUTBOX_POLL_INTERVAL:
+            continue
+        _wake.clear()
+        idle = 0.0
+        try:
+            send_pending()
+        except Exception as e:
+            # Keep the sender alive, the claimed batch is picked up again once stale
+            print(f"Outbox: error sending mail: {e}")
+
+
+def _backoff(attempts):
+    return min(MAX_BACKOFF, OUTBOX_BACKOFF * 2 ** attempts)
+
+
+def _retry(email, error):
+    attempts = email['attempts'] + 1
+    give_up = attempts >= OUTBOX_MAX_ATTEMPTS
+    db_operator.reschedule_email(email['email_id'], error, _backoff(email['attempts']), give_up)
+    return 'failed' if give_up else 'retried'
+
+
+def _send_batch(batch, counts):
+    """Sends one claimed batch over a single SMTP connection."""
+    sent_ids = []
+    remaining = list(batch)
+    try:
+        with _app.app_context(), _mail.connect() as connection:
+            while remaining:
+                email = remaining[0]
+                message = Message(email['subject'], recipients=[email['recipient']], body=email['body'], html=email['html'])
+                try:
+                    connection.send(message)
+                    sent_ids.append(email['email_id'])
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    # This message only, the connection is still usable
+                    counts[_retry(email, e)] += 1
+                remaining.pop(0)
+    except (smtplib.SMTPException, OSError) as e:
+        # Server unreachable or connection lost: back off everything not sent yet
+        print(f"Outbox: SMTP connection failed: {e}")
+        for email in remaining:
+            counts[_retry(email, e)] += 1
+    finally:
+        if sent_ids:
+            db_operator.mark_emails_sent(sent_ids)
+            counts['sent'] += len(sent_ids)
+
+
+def send_pending():
+    """
+    Sends every due email, batch by batch.
+
+    Returns:
+        dict: {'sent', 'retried', 'failed'} counts of this run.
+    """
+    counts = {'sent': 0, 'retried': 0, 'failed': 0}
+    if _mail is None:
+        print("Outbox: init_app was not called, nothing sent")
+        return counts
+    claim_token = secrets.token_hex(8)
+    while True:
+        batch = db_operator.claim_outbox_batch(claim_token, OUTBOX_BATCH_SIZE, STALE_CLAIM_SECONDS)
+        if not batch:
+            break
+        started = time.time()
+        _send_batch(batch, counts)
+        print(f"Outbox: batch of {len(batch)} processed in {time.time() - started:.2f}s {counts}")
+        if counts['retried'] or counts['failed']:
+            # The server is having trouble, leave the rest for the next pass
+            break
+    return counts
@@ -0,0 +1,257 @@
+'''Password hashing and verification in a bounded process pool'''
+'''
+bcrypt is deliberately slow (about 0.25s at cost 12) and holds the CPU while it
+runs, so a burst of registrations or logins would freeze every request and
+Socket.IO connection served by the same worker. hash_password / verify_password
+send the work to a small ProcessPoolExecutor instead and wait for the result.
+
+The pool is bounded: at most PASSWORD_POOL_MAX_PENDING operations are queued or
+running per worker process. A caller that can't get a slot within
+PASSWORD_POOL_TIMEOUT seconds gets PasswordPoolBusy, which logic.py turns into
+a "try again" message instead of piling up requests.
+
+BCRYPT_ROUNDS is the target cost for new hashes. needs_rehash tells whether a
+stored hash was made with another cost, login rehashes it while it still has
+the plain password (see logic.login).
+
+ENV:
+BCRYPT_ROUNDS: work factor of new hashes (default 12, bcrypt's default)
+PASSWORD_POOL_WORKERS: processes (default: CPU count, max 4); 0 hashes inline
+PASSWORD_POOL_MAX_PENDING: queued + running operations (default 8 per process)
+PASSWORD_POOL_TIMEOUT: seconds to wait for a slot (default 5)
+
+stats() returns queue wait and run time metrics, shown at /admin/api/password-pool.
+'''
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+MAX_PENDING = int(os.environ.get('PASSWORD_POOL_MAX_PENDING', max(1, POOL_WORKERS) * 8))
+SLOT_TIMEOUT = float(os.environ.get('PASSWORD_POOL_TIMEOUT', 5))
+RECENT_SAMPLES = 500  # queue waits kept for the percentiles
+
+
+class PasswordPoolBusy(RuntimeError):
+    """Raised when every slot of the pool stays taken for PASSWORD_POOL_TIMEOUT seconds."""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_stats_lock = threading.Lock()
+_stats = {
+    'submitted': 0,
+    'completed': 0,
+    'rejected': 0,
+    'failed': 0,
+    'pending': 0,
+    'queue_wait_total': 0.0,
+    'queue_wait_max': 0.0,
+    'run_total': 0.0,
+}
+_recent_waits = deque(maxlen=RECENT_SAMPLES)
+
+
+# --- Work done in the pool processes (module level so it can be pickled) ---
+
+def _hash_job(password_bytes, rounds):
+    started = time.time()
+    return bcrypt.hashpw(password_bytes, bcrypt.gensalt(rounds=rounds)), started
+
+def _check_job(password_bytes, stored_hash):
+    started = time.time()
+    return bcrypt.checkpw(password_bytes, stored_hash), started
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and POOL_WORKERS > 0:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drops a broken pool (a worker was killed), the next call starts a new one."""
+    global _pool
+    if pool is None:
+        return
+    with _pool_lock:
+        # Another thread may already have replaced it with a healthy pool, leave that one alone
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _finished(future, submitted):
+    """Done callback: frees the slot and records how long the job waited for a process."""
+    finished = time.time()
+    with _stats_lock:
+        _stats['pending'] -= 1
+        if future.cancelled() or future.exception() is not None:
+            _stats['failed'] += 1
+        else:
+            started = future.result()[1]
+            wait = max(0.0, started - submitted)
+            _stats['completed'] += 1
+            _stats['queue_wait_total'] += wait
+            _stats['queue_wait_max'] = max(_stats['queue_wait_max'], wait)
+            _stats['run_total'] += finished - started
+            _recent_waits.append(wait)
+    _slots.release()
+
+
+def _submit(job, *args):
+    """Queues a job once a slot is free. Returns a Future of (result, started)."""
+    if not _slots.acquire(timeout=SLOT_TIMEOUT):
+        with _stats_lock:
+            _stats['rejected'] += 1
+        raise PasswordPoolBusy("Password hashing pool is full")
+
+    submitted = time.time()
+    with _stats_lock:
+        _stats['submitted'] += 1
+        _stats['pending'] += 1
+
+    handed_over = False  # once True, _finished frees the slot
+    try:
+        pool = _get_pool()
+        if pool is not None:
+            try:
+                future = pool.submit(job, *args)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # RuntimeError: shut down by another thread that found it broken
+                print(f"Password pool unusable, running inline: {e}")
+                _discard_pool(pool)
+            else:
+                handed_over = True
+                future.pool = pool  # for _result, to discard this pool and not a newer one
+                future.add_done_callback(lambda done: _finished(done, submitted))
+                return future
+
+        future = Future()
+        try:
+            future.set_result(job(*args))
+        except Exception as e:
+            future.set_exception(e)
+        handed_over = True
+        _finished(future, submitted)
+        return future
+    finally:
+        if not handed_over:
+            with _stats_lock:
+                _stats['pending'] -= 1
+                _stats['failed'] += 1
+            _slots.release()
+
+
+def _result(future, job, *args):
+    """Result of a submitted job, run inline if its worker process died."""
+    try:
+        return future.result()[0]
+    except BrokenProcessPool as e:
+        print(f"Password pool broken, running inline: {e}")
+        _discard_pool(getattr(future, 'pool', None))
+        return job(*args)[0]
+
+
+def _run(job, *args):
+    """Runs one job in the pool and waits for it."""
+    return _result(_submit(job, *args), job, *args)
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def hash_password(password):
+    """
+    Hashes a password at the BCRYPT_ROUNDS cost.
+
+    Returns:
+        bytes: The bcrypt hash to store.
+
+    Raises:
+        PasswordPoolBusy: If the pool stays full.
+    """
+    return _run(_hash_job, password.encode('utf-8'), BCRYPT_ROUNDS)
+
+
+def hash_passwords(plain_passwords):
+    """
+    Hashes many passwords at once (bulk imports), spread over every process of the pool.
+    At most half of the slots are used, so logins keep getting their turn meanwhile.
+
+    Returns:
+        list: The bcrypt hashes, in the same order.
+
+    Raises:
+        PasswordPoolBusy: If the pool stays full.
+    """
+    window = max(1, MAX_PENDING // 2)
+    jobs = [(password.encode('utf-8'), BCRYPT_ROUNDS) for password in plain_passwords]
+    hashes = []
+    in_flight = deque()
+    for args in jobs:
+        if len(in_flight) >= window:
+            hashes.append(_result(*in_flight.popleft()))
+        in_flight.append((_submit(_hash_job, *args), _hash_job) + args)
+    while in_flight:
+        hashes.append(_result(*in_flight.popleft()))
+    return hashes
+
+
+def verify_password(password, stored_hash):
+    """
+    Checks a password against a stored bcrypt hash (bytes or str).
+
+    Returns:
+        bool: True if it matches, False otherwise (also for a malformed hash).
+
+    Raises:
+        PasswordPoolBusy: If the pool stays full.
+    """
+    if not password or not stored_hash:
+        return False
+    try:
+        return _run(_check_job, password.encode('utf-8'), _as_bytes(stored_hash))
+    except ValueError as e:
+        print(f"Invalid stored password hash: {e}")
+        return False
+
+
+def hash_cost(stored_hash):
+    """Work factor of a bcrypt hash ("$2b$12$..." -> 12), None if it can't be read."""
+    try:
+        return int(_as_bytes(stored_hash).split(b'$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(stored_hash):
+    """True if the hash was made with another cost than BCRYPT_ROUNDS."""
+    return hash_cost(stored_hash) != BCRYPT_ROUNDS
+
+
+def stats():
+    """Pool configuration and queue wait / run time metrics (seconds)."""
+    with _stats_lock:
+        data = dict(_stats)
+        waits = sorted(_recent_waits)
+    completed = data['completed']
+    data.update({
+        'workers': POOL_WORKERS,
+        'max_pending': MAX_PENDING,
+        'bcrypt_rounds': BCRYPT_ROUNDS,
+        'queue_wait_avg': data['queue_wait_total'] / completed if completed else 0.0,
+        'queue_wait_p95': waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        'run_avg': data['run_total'] / completed if completed else 0.0,
+    })
+    return data
@@ -0,0 +1,302 @@
+'''Per-request profiling: wall time, DB time, connections, statements, slow-query log'''
+'''
+Every Flask request and every Socket.IO event handler gets a profile:
+
+- wall time of the whole handler,
+- DB time: connecting plus every execute / executemany / executescript /
+  fetch* / commit on connections from db_conn.create_connection,
+- connections opened,
+- statements executed, counted by a sqlite3 trace callback (so implicit
+  BEGIN / COMMIT, each row of an executemany and statements run by triggers
+  count too).
+
+Responses to admin sessions, or to everyone when SERVER_TIMING=on, carry the
+numbers in a Server-Timing header, shown by the browser's developer tools
+(Network > Timing):
+
+    Server-Timing: total;dur=84.2, db;dur=61.0, sql;desc="112 statements", conn;desc="38 connections"
+
+It tells whoever reads it how much database work a page costs, so it is not
+sent to regular visitors by default.
+
+Requests slower than SLOW_REQUEST_MS are also printed as one line.
+
+The slow-query log (SLOW_QUERY_LOG, JSON lines) gets:
+
+- 'slow': a statement whose execute + fetch took SLOW_QUERY_MS or more,
+- 'repeated': a statement run REPEATED_QUERY_THRESHOLD times or more in one
+  request or event, which is how N+1 loops show up.
+
+SQL is normalized (literals and IN lists replaced by ?) so one line stands for
+every call of the same statement. The first occurrence of each statement is
+always written, later ones with probability SLOW_QUERY_SAMPLE; 'count' says how
+many occurrences the line stands for.
+
+DB work outside a request (background tasks, the body of a streamed response)
+still lands in the slow-query log, under the context '-'. Rows read by
+iterating the cursor directly are not timed, only fetchone / fetchmany / fetchall.
+
+PROFILING=off turns all of it off (plain sqlite3 connections, no header, no log).
+'''
+
+import functools
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from flask import request, session
+
+PROFILING = os.environ.get('PROFILING', 'on') != 'off'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'off') == 'on'  # header for every client, not only admins
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+REPEATED_QUERY_THRESHOLD = int(os.environ.get('REPEATED_QUERY_THRESHOLD', 20))
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', 0.1))
+SLOW_QUERY_LOG = os.environ.get(
+    'SLOW_QUERY_LOG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slow_queries.log')
+)
+MAX_SQL_LENGTH = 1000
+
+_local = threading.local()
+_log_lock = threading.Lock()
+_unlogged = defaultdict(int)  # (kind, context, sql): occurrences since the last line written
+
+
+class Profile:
+    """What one request or event handler did."""
+
+    def __init__(self, context):
+        self.context = context
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        self.db_time = 0.0
+        self.connections = 0
+        self.statements = 0
+        self.queries = defaultdict(lambda: [0, 0.0])  # normalized sql: [count, seconds]
+
+
+def current():
+    """The profile of the request or event being handled, None outside of one."""
+    return getattr(_local, 'profile', None)
+
+
+def start(context):
+    """Starts profiling the current request or event. Returns the Profile."""
+    profile = Profile(context)
+    _local.profile = profile
+    return profile
+
+
+def finish():
+    """Stops profiling, logs repeated statements and returns the Profile (None if none started)."""
+    profile = current()
+    if profile is None:
+        return None
+    _local.profile = None
+    profile.wall = time.perf_counter() - profile.started
+    for sql, (count, seconds) in profile.queries.items():
+        if count >= REPEATED_QUERY_THRESHOLD:
+            _log('repeated', profile.context, sql, seconds, count)
+    if profile.wall * 1000 >= SLOW_REQUEST_MS:
+        print(f"Profiling: slow {profile.context}: {profile.wall * 1000:.0f} ms, DB {profile.db_time * 1000:.0f} ms, "
+              f"{profile.statements} statements, {profile.connections} connections")
+    return profile
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """SQL with literals and IN lists replaced by ?, comments dropped, whitespace collapsed."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'--[^\n]*', '', sql)
+    sql = re.sub(r'(?<![\w.])-?\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+    return ' '.join(sql.split())[:MAX_SQL_LENGTH]
+
+
+def _log(kind, context, sql, seconds, count=1):
+    """Writes one line of the slow-query log, sampled."""
+    key = (kind, context, sql)
+    with _log_lock:
+        first = key not in _unlogged
+        _unlogged[key] += count
+        if not first and random.random() >= SLOW_QUERY_SAMPLE:
+            return
+        represented = _unlogged[key]
+        _unlogged[key] = 0
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'kind': kind,
+            'context': context,
+            'ms': round(seconds * 1000, 2),
+            'count': represented,
+            'sql': sql,
+        }
+        try:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"Profiling: could not write the slow-query log: {e}")
+
+
+def _add_db_time(seconds):
+    profile = current()
+    if profile is not None:
+        profile.db_time += seconds
+
+
+def _trace(statement):
+    # Trigger bodies are reported as '-- TRIGGER name' before their statements
+    profile = current()
+    if profile is not None and not statement.startswith('--'):
+        profile.statements += 1
+
+
+class Cursor(sqlite3.Cursor):
+    """Times what it runs and reads, per normalized statement."""
+
+    _sql = None
+    _elapsed = 0.0
+    _logged = False
+
+    def _begin(self, sql):
+        self._sql = normalize_sql(sql)
+        self._elapsed = 0.0
+        self._logged = False
+
+    def _spent(self, seconds, calls=0):
+        self._elapsed += seconds
+        _add_db_time(seconds)
+        profile = current()
+        if profile is not None:
+            stats = profile.queries[self._sql]
+            stats[0] += calls
+            stats[1] += seconds
+        if not self._logged and self._elapsed * 1000 >= SLOW_QUERY_MS:
+            self._logged = True
+            _log('slow', profile.context if profile is not None else '-', self._sql, self._elapsed)
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._spent(time.perf_counter() - started, calls=1)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._spent(time.perf_counter() - started, calls=1)
+
+    def executescript(self, sql_script):
+        self._begin(sql_script)
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._spent(time.perf_counter() - started, calls=1)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._spent(time.perf_counter() - started)
+            else:
+                _add_db_time(time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+
+class Connection(sqlite3.Connection):
+    """
+    sqlite3 connection factory used by db_conn.create_connection: counts itself
+    and its statements in the current profile and hands out timed cursors.
+    """
+
+    def __init__(self, *args, **kwargs):
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        if not PROFILING:
+            return
+        self.set_trace_callback(_trace)
+        profile = current()
+        if profile is not None:
+            profile.connections += 1
+        _add_db_time(time.perf_counter() - started)
+
+    def cursor(self, factory=None):
+        # Connection.execute() goes through here as well
+        if factory is None:
+            factory = Cursor if PROFILING else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _add_db_time(time.perf_counter() - started)
+
+
+def server_timing(profile):
+    """Server-Timing header value for a finished profile."""
+    return (f'total;dur={profile.wall * 1000:.1f}, db;dur={profile.db_time * 1000:.1f}, '
+            f'sql;desc="{profile.statements} statements", conn;desc="{profile.connections} connections"')
+
+
+def init_app(app):
+    """Profiles every request of a Flask app and adds the Server-Timing header where allowed."""
+    if not PROFILING:
+        return
+
+    @app.before_request
+    def _start_profile():
+        start(request.endpoint or request.path)
+
+    @app.after_request
+    def _finish_profile(response):
+        profile = finish()
+        # The slow-query log is written by finish() either way
+        if profile is not None and (SERVER_TIMING or session.get('entity_type') == 'admin'):
+            response.headers['Server-Timing'] = server_timing(profile)
+        return response
+
+    @app.teardown_request
+    def _drop_profile(error=None):
+        # after_request does not run when the view raised
+        if current() is not None:
+            finish()
+
+
+def socket_event(name):
+    """Decorator for Socket.IO handlers, under the @socketio.on(...) line."""
+    def decorator(handler):
+        if not PROFILING:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start(f"socket:{name}")
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                finish()
+        return wrapper
+    return decorator
@@ -0,0 +1,206 @@
+'''Token bucket rate limiting for Socket.IO events and POST routes'''
+'''
+Every limited action has a bucket per identity (connection sid, user or
+organization id, or remote address). A bucket holds up to "capacity" tokens and refills at
+"capacity / seconds" tokens per second; each request takes one token.
+When a bucket is empty the caller is rejected before any DB work runs.
+
+BACKENDS (env RATE_LIMIT_BACKEND):
+memory: per-process dictionary (default)
+sqlite: shared between workers through a separate file (env RATE_LIMIT_DB),
+        so the main comunidad_verde.db writer is never touched
+
+LIMITS can be overridden with env RATE_LIMITS, e.g.
+RATE_LIMITS="private_message=20/10,save_map_point=3/60"  (capacity/seconds)
+'''
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# name: (capacity, seconds to refill the whole bucket)
+LIMITS = {
+    'private_message': (10, 10),
+    'group_message': (10, 10),
+    'event_register': (5, 60),
+    'item_request': (5, 60),
+    'save_map_point': (3, 60),
+    'verification_resend': (3, 600),
+}
+
+MAX_MEMORY_KEYS = 10000  # prune idle buckets above this size
+
+
+class MemoryBackend:
+    """Buckets held in this process only."""
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, last_update)
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Takes one token. Returns the seconds to wait (0 if the request is allowed)."""
+        with self._lock:
+            tokens, last_update = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last_update) * refill_rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / refill_rate
+
+            if len(self._buckets) > MAX_MEMORY_KEYS:
+                self._prune(now)
+        return wait
+
+    def forget(self, keys):
+        """Drops the given buckets (e.g. those of a disconnected sid)."""
+        with self._lock:
+            for key in keys:
+                self._buckets.pop(key, None)
+
+    def _prune(self, now):
+        # A bucket idle for longer than the slowest full refill is back at capacity,
+        # so dropping it changes nothing
+        max_idle = max(seconds for _, seconds in LIMITS.values())
+        for key in [k for k, (_, last) in self._buckets.items() if now - last > max_idle]:
+            del self._buckets[key]
+
+
+class SQLiteBackend:
+    """Buckets shared by every worker on the host through a small SQLite file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                bucket_key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                last_update REAL NOT NULL
+            )
+            ''')
+        finally:
+            conn.close()
+
+    def consume(self, key, capacity, refill_rate, now):
+        """Takes one token. Returns the seconds to wait (0 if the request is allowed)."""
+        wait = 0
+        conn = sqlite3.connect(self.db_path, timeout=1, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, last_update FROM rate_limit_buckets WHERE bucket_key = ?", (key,)).fetchone()
+            tokens, last_update = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - last_update) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / refill_rate
+            conn.execute('''
+                INSERT INTO rate_limit_buckets (bucket_key, tokens, last_update) VALUES (?, ?, ?)
+                ON CONFLICT(bucket_key) DO UPDATE SET tokens = excluded.tokens, last_update = excluded.last_update
+            ''', (key, tokens, now))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # Fail open: the limiter must never take the app down
+            print(f"Error in shared rate limiter: {e}")
+            wait = 0
+        finally:
+            conn.close()
+        return wait
+
+    def forget(self, keys):
+        """Drops the given buckets (e.g. those of a disconnected sid)."""
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.executemany("DELETE FROM rate_limit_buckets WHERE bucket_key = ?", [(key,) for key in keys])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error cleaning shared rate limiter: {e}")
+        finally:
+            conn.close()
+
+
+def _load_env_limits():
+    """Applies the RATE_LIMITS env override on top of the defaults."""
+    for entry in os.environ.get('RATE_LIMITS', '').split(','):
+        if '=' not in entry:
+            continue
+        name, value = entry.split('=', 1)
+        try:
+            capacity, seconds = value.split('/')
+            configure_limit(name.strip(), int(capacity), float(seconds))
+        except ValueError:
+            print(f"Rate limiter: ignoring invalid limit '{entry}'")
+
+
+def configure_limit(name, capacity, seconds):
+    """Sets (or adds) the limit for an event type or route."""
+    if capacity < 1 or seconds <= 0:
+        raise ValueError("capacity must be >= 1 and seconds > 0")
+    LIMITS[name] = (capacity, seconds)
+
+
+def _create_backend():
+    if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'sqlite':
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_limits.db')
+        return SQLiteBackend(os.environ.get('RATE_LIMIT_DB', default_path))
+    return MemoryBackend()
+
+
+backend = _create_backend()
+_load_env_limits()
+
+
+def check(limit_name, sid=None, entity_type=None, entity_id=None, remote_addr=None):
+    """
+    Takes a token from every bucket that applies to the caller.
+
+    Args:
+        limit_name (str): Key of LIMITS ('private_message', 'event_register', ...).
+        sid (str, optional): Socket.IO connection id.
+        entity_type (str, optional): 'user' or 'organization', ids of both overlap.
+        entity_id (int, optional): Logged-in user or org id.
+        remote_addr (str, optional): Client address, used for anonymous requests.
+
+    Returns:
+        dict: {"status": "success"} or
+              {"status": "error", "message": ..., "retry_after": seconds}
+    """
+    if limit_name not in LIMITS:
+        return {"status": "success"}
+
+    capacity, seconds = LIMITS[limit_name]
+    refill_rate = capacity / seconds
+    now = time.time()
+
+    identities = []
+    if sid:
+        identities.append(f"sid:{sid}")
+    if entity_id:
+        identities.append(f"entity:{entity_type}:{entity_id}")
+    if not identities and remote_addr:
+        identities.append(f"addr:{remote_addr}")
+
+    wait = 0
+    for identity in identities:
+        wait = max(wait, backend.consume(f"{limit_name}:{identity}", capacity, refill_rate, now))
+
+    if wait > 0:
+        retry_after = math.ceil(wait)
+        return {
+            "status": "error",
+            "message": f"Demasiadas solicitudes. Intenta de nuevo en {retry_after} segundos.",
+            "retry_after": retry_after
+        }
+    return {"status": "success"}
+
+
+def forget_sid(sid):
+    """Releases the buckets of a closed Socket.IO connection."""
+    backend.forget([f"{limit_name}:sid:{sid}" for limit_name in LIMITS])
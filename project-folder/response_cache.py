@@ -0,0 +1,225 @@
+'''Response cache for the public pages browsed anonymously'''
+'''
+Rendered pages are stored under a key made of the endpoint, its URL arguments,
+the normalized query string (sorted, blank values dropped, so "?q=&type=x" and
+"?type=x" share an entry) and the auth state of the visitor.
+
+Entries expire after their TTL, and every write path that changes what a page
+shows calls invalidate(tag) (see logic.py). Invalidation does not delete
+anything: each tag has a generation number that is part of the key, bumping
+it makes the old entries unreachable and the LRU / expiry drops them later.
+
+Tags: orgs, events, items
+
+BACKENDS (env RESPONSE_CACHE_BACKEND):
+memory: per-process LRU (default), RESPONSE_CACHE_MAX_ENTRIES entries
+sqlite: shared between workers through a separate file (env RESPONSE_CACHE_DB),
+        an invalidation in one worker is seen by all of them
+RESPONSE_CACHE_TTL: default seconds an entry is served (60)
+RESPONSE_CACHE=off disables the cache.
+'''
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+ENABLED = os.environ.get('RESPONSE_CACHE', 'on') != 'off'
+DEFAULT_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 60))
+MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+
+
+class MemoryBackend:
+    """LRU of entries held in this process only."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, entry)
+        self._generations = {}         # tag -> int
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            if cached[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return cached[1]
+
+    def set(self, key, entry, expires):
+        with self._lock:
+            self._entries[key] = (expires, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generations(self, tags):
+        with self._lock:
+            return [self._generations.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Entries and generations shared by every worker on the host through a small SQLite file."""
+
+    def __init__(self, db_path, max_entries):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._writes = 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                expires REAL NOT NULL,
+                entry TEXT NOT NULL -- JSON: status, content_type, body
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache_generations (
+                tag TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )
+            ''')
+        finally:
+            conn.close()
+
+    def get(self, key, now):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            row = conn.execute("SELECT expires, entry FROM response_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row and row[0] > now:
+                return json.loads(row[1])
+        except sqlite3.Error as e:
+            # Fail open: a broken cache only means rendering the page
+            print(f"Error reading shared response cache: {e}")
+        finally:
+            conn.close()
+        return None
+
+    def set(self, key, entry, expires):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute('''
+                INSERT INTO response_cache (cache_key, expires, entry) VALUES (?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET expires = excluded.expires, entry = excluded.entry
+            ''', (key, expires, json.dumps(entry)))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                # Expired first, then the entries closest to expiring above the size limit
+                conn.execute("DELETE FROM response_cache WHERE expires <= ?", (time.time(),))
+                conn.execute('''
+                    DELETE FROM response_cache WHERE cache_key IN (
+                        SELECT cache_key FROM response_cache ORDER BY expires DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_entries,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing shared response cache: {e}")
+        finally:
+            conn.close()
+
+    def generations(self, tags):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            placeholders = ', '.join('?' * len(tags))
+            rows = dict(conn.execute(
+                f"SELECT tag, generation FROM response_cache_generations WHERE tag IN ({placeholders})", tags
+            ).fetchall())
+            return [rows.get(tag, 0) for tag in tags]
+        except sqlite3.Error as e:
+            print(f"Error reading shared response cache: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def bump(self, tags):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.executemany('''
+                INSERT INTO response_cache_generations (tag, generation) VALUES (?, 1)
+                ON CONFLICT(tag) DO UPDATE SET generation = generation + 1
+            ''', [(tag,) for tag in tags])
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error invalidating shared response cache: {e}")
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute("DELETE FROM response_cache")
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error clearing shared response cache: {e}")
+        finally:
+            conn.close()
+
+
+def _create_backend():
+    if os.environ.get('RESPONSE_CACHE_BACKEND', 'memory') == 'sqlite':
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'response_cache.db')
+        return SQLiteBackend(os.environ.get('RESPONSE_CACHE_DB', default_path), MAX_ENTRIES)
+    return MemoryBackend(MAX_ENTRIES)
+
+
+backend = _create_backend()
+
+
+def make_key(endpoint, view_args, query_items, auth_state, tags=()):
+    """
+    Builds the cache key of a request.
+
+    Args:
+        endpoint (str): Flask endpoint name.
+        view_args (dict): URL arguments, e.g. {'event_id': 3}.
+        query_items (iterable): (name, value) pairs of the query string.
+        auth_state (str): 'anonymous' or the session entity_type.
+        tags (tuple): Invalidation tags of the page.
+
+    Returns:
+        str: The key, or None if the generations could not be read (do not cache).
+    """
+    generations = backend.generations(list(tags)) if tags else []
+    if generations is None:
+        return None
+    query = sorted((name, value.strip()) for name, value in query_items if value.strip())
+    parts = [endpoint, sorted(view_args.items()), query, auth_state, list(zip(tags, generations))]
+    return hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def get(key):
+    """Returns the cached entry {'status', 'content_type', 'body'} or None."""
+    return backend.get(key, time.time())
+
+
+def put(key, entry, ttl=None):
+    """Stores an entry for ttl seconds (DEFAULT_TTL by default)."""
+    backend.set(key, entry, time.time() + (DEFAULT_TTL if ttl is None else ttl))
+
+
+def invalidate(*tags):
+    """Makes every cached page with one of these tags stale. Called from the write paths."""
+    if ENABLED and tags:
+        backend.bump(list(tags))
+
+
+def clear():
+    """Drops every entry."""
+    backend.clear()
@@ -0,0 +1,199 @@
+'''Background jobs: periodic and one-off, run by one worker at a time'''
+'''
+Slow maintenance work (recomputing every organization's points, expiring
+challenges, refreshing the dashboard snapshot) used to run inside a request, or
+in its own ad hoc loop. Jobs are registered here instead and run by a Socket.IO
+background task in every worker:
+
+    scheduler.register('org_points', org_points_job, interval=3600,
+                       description="Recompute organization points")
+
+A job is a function taking a `progress` callable and returning a short message:
+
+    def job(progress):
+        progress(done, total, "message")   # as often as convenient, it is throttled
+        return "42 organizations updated"
+
+State lives in the scheduled_jobs table, so it is shared by every worker and
+survives restarts: next run, status, progress, last result. Each pass the runner
+reads which of its jobs are due and claims them with one conditional UPDATE
+(db_operator.claim_scheduled_job). The claim is a lease of JOB_LEASE_SECONDS,
+renewed by every progress() call; a worker that dies mid-job loses it and
+another worker runs the job again once it expires. If a lease is taken over,
+progress() raises JobCancelled in the old runner so it stops.
+
+- Periodic jobs (interval in seconds) run again `interval` seconds after they finish.
+- One-off jobs (interval None) only run when requested: request_run(name),
+  e.g. the "Run now" button of /admin/jobs. Periodic jobs can be requested too.
+
+SCHEDULER=off starts no runner in that worker (jobs still get requested and
+are run by the workers that do have one); run_pending() runs what's due by hand.
+'''
+
+import os
+import secrets
+import socket
+import threading
+import time
+#CUSTOM MODULES
+import db_operator
+
+SCHEDULER_POLL_INTERVAL = float(os.environ.get('SCHEDULER_POLL_INTERVAL', 10))  # seconds between passes when idle
+JOB_LEASE_SECONDS = 300       # a running job that reports no progress for this long is considered dead
+PROGRESS_MIN_INTERVAL = 1.0   # at most one progress write per second
+WAKE_DELAY = 1.0
+
+_jobs = {}
+_socketio = None
+_owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+_wake = threading.Event()
+_lock = threading.Lock()
+_worker_started = False
+
+
+class JobCancelled(Exception):
+    """Raised by progress() when another worker took over the job's lease."""
+
+
+def register(name, func, interval=None, description=''):
+    """
+    Declares a job. Call at import time; the row is created by init().
+
+    Args:
+        name (str): Unique job name.
+        func (callable): func(progress) -> message.
+        interval (int): Seconds between runs, None for a one-off job.
+        description (str): Shown on the admin jobs page.
+    """
+    _jobs[name] = {'func': func, 'interval': int(interval) if interval else None, 'description': description}
+
+
+def init(socketio):
+    """Creates the rows of the registered jobs and starts the runner."""
+    global _socketio
+    _socketio = socketio
+    for name, job in _jobs.items():
+        db_operator.register_scheduled_job(name, job['interval'])
+    _ensure_worker()
+
+
+def _ensure_worker():
+    global _worker_started
+    if _socketio is None or os.environ.get('SCHEDULER', 'on') == 'off':
+        return
+    with _lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    _socketio.start_background_task(_run_loop)
+
+
+def _run_loop():
+    idle = SCHEDULER_POLL_INTERVAL  # first pass right away
+    while True:
+        if _wake.is_set() or idle >= SCHEDULER_POLL_INTERVAL:
+            _wake.clear()
+            idle = 0.0
+            try:
+                run_pending()
+            except Exception as e:
+                # Keep the runner alive, a job left claimed is taken again once its lease expires
+                print(f"Scheduler: error running jobs: {e}")
+        _socketio.sleep(WAKE_DELAY)
+        idle += WAKE_DELAY
+
+
+def request_run(name):
+    """
+    Queues a job to run as soon as possible.
+
+    Returns:
+        bool: True if queued, False if it was already queued or running. None on database error.
+
+    Raises:
+        KeyError: If no job has that name.
+    """
+    if name not in _jobs:
+        raise KeyError(name)
+    queued = db_operator.request_scheduled_job_run(name)
+    if queued:
+        _wake.set()
+    return queued
+
+
+def _make_progress(name):
+    state = {'last_write': 0.0, 'pending': None}
+
+    def write(done, total, message):
+        state['last_write'] = time.monotonic()
+        state['pending'] = None
+        if not db_operator.update_scheduled_job_progress(name, _owner, done, total, message, JOB_LEASE_SECONDS):
+            raise JobCancelled(name)
+
+    def progress(done, total=None, message=None):
+        if time.monotonic() - state['last_write'] < PROGRESS_MIN_INTERVAL:
+            state['pending'] = (done, total, message)  # written by flush() if nothing follows
+            return
+        write(done, total, message)
+
+    def flush():
+        if state['pending'] is not None:
+            write(*state['pending'])
+
+    progress.flush = flush
+    return progress
+
+
+def run_job(name):
+    """Runs one claimed job and records its result. Returns True if it succeeded."""
+    progress = _make_progress(name)
+    started = time.time()
+    try:
+        message = _jobs[name]['func'](progress)
+        progress.flush()
+    except JobCancelled:
+        print(f"Scheduler: job {name} was taken over by another worker, stopped")
+        return False
+    except Exception as e:
+        print(f"Scheduler: job {name} failed after {time.time() - started:.2f}s: {e}")
+        db_operator.finish_scheduled_job(name, _owner, 'error', e)
+        return False
+    print(f"Scheduler: job {name} done in {time.time() - started:.2f}s: {message}")
+    db_operator.finish_scheduled_job(name, _owner, 'success', message)
+    return True
+
+
+def run_pending():
+    """
+    Runs every due job this worker manages to claim, one after the other.
+
+    Returns:
+        list: Names of the jobs run.
+    """
+    ran = []
+    for name in db_operator.get_due_jobs(list(_jobs)) or []:
+        if db_operator.claim_scheduled_job(name, _owner, JOB_LEASE_SECONDS):
+            run_job(name)
+            ran.append(name)
+    return ran
+
+
+def get_jobs():
+    """
+    Registered jobs with their state, for the admin page.
+
+    Returns:
+        list: Dicts with the scheduled_jobs columns plus 'description' and 'periodic', None on error.
+    """
+    rows = db_operator.get_scheduled_jobs()
+    if rows is None:
+        return None
+    jobs = []
+    for row in rows:
+        job = _jobs.get(row['job_name'])
+        if job is None:
+            continue  # no longer registered
+        row['description'] = job['description']
+        row['periodic'] = job['interval'] is not None
+        jobs.append(row)
+    return jobs
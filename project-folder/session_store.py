@@ -0,0 +1,209 @@
+'''Server-side sessions: the cookie only carries an opaque session id'''
+'''
+Flask's default session serializes the whole dict into a signed cookie, which
+the browser uploads and the app verifies on every request. With this interface
+the data stays on the server and the cookie holds a random id
+(secrets.token_urlsafe). The store is keyed by a SHA-256 of the id, so a copy
+of the store does not contain usable cookies.
+
+The session only keeps what identifies the visitor (entity_id, entity_type,
+admin_id, flashes). Profile data (name, points, photo...) is read through the
+entity cache (db_operator.get_user_by_id / get_org_by_id), so it is never stale.
+
+Sessions expire after app.permanent_session_lifetime without activity; the
+expiry is pushed back at most once every SESSION_TOUCH_INTERVAL seconds, so a
+plain page view does not write to the store. Call session.rotate() when the
+visitor logs in, so an id known before the login becomes useless.
+
+BACKENDS (env SESSION_BACKEND):
+sqlite: shared between workers and restarts through a separate file (env SESSION_DB) (default)
+memory: per-process dictionary, sessions are lost on restart (development, single worker)
+'''
+
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_TOUCH_INTERVAL = float(os.environ.get('SESSION_TOUCH_INTERVAL', 3600))
+MAX_MEMORY_SESSIONS = 10000  # prune expired sessions above this size
+
+serializer = TaggedJSONSerializer()  # same format as Flask's cookie (tuples, Markup, datetimes...)
+
+
+class MemoryBackend:
+    """Sessions held in this process only."""
+
+    def __init__(self):
+        self._sessions = {}  # key -> (expires, data)
+        self._lock = threading.Lock()
+
+    def load(self, key, now):
+        """Returns (data, expires) of a live session, or None."""
+        with self._lock:
+            stored = self._sessions.get(key)
+            if stored is None or stored[0] <= now:
+                return None
+            return stored[1], stored[0]
+
+    def save(self, key, data, expires):
+        with self._lock:
+            self._sessions[key] = (expires, data)
+            if len(self._sessions) > MAX_MEMORY_SESSIONS:
+                now = time.time()
+                for expired in [k for k, (exp, _) in self._sessions.items() if exp <= now]:
+                    del self._sessions[expired]
+
+    def delete(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+
+class SQLiteBackend:
+    """Sessions shared by every worker on the host through a small SQLite file."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._writes = 0
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_key TEXT PRIMARY KEY, -- sha256 of the cookie id
+                expires REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+            ''')
+        finally:
+            conn.close()
+
+    def load(self, key, now):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            row = conn.execute("SELECT data, expires FROM sessions WHERE session_key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                return row
+        except sqlite3.Error as e:
+            # Treated as a new session: the visitor has to log in again
+            print(f"Error reading session store: {e}")
+        finally:
+            conn.close()
+        return None
+
+    def save(self, key, data, expires):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute('''
+                INSERT INTO sessions (session_key, expires, data) VALUES (?, ?, ?)
+                ON CONFLICT(session_key) DO UPDATE SET expires = excluded.expires, data = excluded.data
+            ''', (key, expires, data))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                conn.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error writing session store: {e}")
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute("DELETE FROM sessions WHERE session_key = ?", (key,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error deleting from session store: {e}")
+        finally:
+            conn.close()
+
+
+def _create_backend():
+    if os.environ.get('SESSION_BACKEND', 'sqlite') == 'memory':
+        return MemoryBackend()
+    default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db')
+    return SQLiteBackend(os.environ.get('SESSION_DB', default_path))
+
+
+def _store_key(sid):
+    return hashlib.sha256(sid.encode('utf-8')).hexdigest()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed."""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.new = sid is None
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.expires = expires
+        self.previous_sid = None
+        self.modified = False
+
+    def rotate(self):
+        """Moves the data to a new id (call on login), the old one is deleted on save."""
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by the session_store backends."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or _create_backend()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.backend.load(_store_key(sid), time.time())
+            if stored is not None:
+                data, expires = stored
+                try:
+                    return ServerSideSession(serializer.loads(data), sid=sid, expires=expires)
+                except ValueError as e:
+                    print(f"Error decoding stored session: {e}")
+        # Unknown or expired ids are never adopted, a fresh one is issued when needed
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.backend.delete(_store_key(session.previous_sid))
+
+        if not session:
+            # Logged out (or never logged in): nothing to store
+            if not session.new and session.modified:
+                self.backend.delete(_store_key(session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        touch_due = session.expires is None or session.expires - now < lifetime - SESSION_TOUCH_INTERVAL
+        if session.modified or touch_due:
+            self.backend.save(_store_key(session.sid), serializer.dumps(dict(session)), now + lifetime)
+
+        if session.new or session.previous_sid or self.should_set_cookie(app, session):
+            response.vary.add('Cookie')
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
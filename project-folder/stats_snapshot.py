@@ -0,0 +1,83 @@
+'''Precomputed numbers for the admin dashboard and /admin/stats'''
+'''
+The dashboard used to count four tables and load every user and organization
+on each view. It now reads small tables instead:
+
+- stats_counters: users / orgs / events / items totals, kept exact by triggers
+  on every insert and delete (see db_conn.setup_database).
+- the daily activity rollups (analytics.py) for the new records per day.
+- stats_snapshot: top-N organizations and users by points. Points change on
+  almost every action, so these lists are rewritten every STATS_REFRESH_INTERVAL
+  seconds by the 'stats_refresh' scheduled job instead (and on demand from the
+  dashboard). The same refresh realigns stats_counters with the tables; the job
+  also prunes the old hourly rollups.
+
+The user and organization lists are paginated by id (db_operator.users_page /
+orgs_page), so no view ever loads a whole table.
+'''
+
+import os
+#CUSTOM MODULES
+import analytics
+import db_operator
+
+STATS_TOP_N = 10                 # longest top list shown (dashboard shows the first 5)
+STATS_SERIES_DAYS = 30           # days of the registrations chart
+STATS_REFRESH_INTERVAL = float(os.environ.get('STATS_REFRESH_INTERVAL', 300))
+METRICS = ('users', 'orgs', 'events', 'items')
+
+
+def refresh():
+    """Rewrites the top lists and realigns the counters. Returns True on success."""
+    return db_operator.refresh_stats_snapshot(STATS_TOP_N)
+
+
+def _daily_series(days):
+    """New records per day of the last `days` days, zero-filled, None on error."""
+    daily = {metric: analytics.series(metric, 'day', days) for metric in ('signups', 'events', 'items_listed')}
+    if any(result is None for result in daily.values()):
+        return None
+
+    def totals(metric, dimension=None):
+        columns = [entry['values'] for entry in daily[metric]['series'] if dimension in (None, entry['dimension'])]
+        return [sum(column) for column in zip(*columns)] if columns else [0] * len(daily[metric]['buckets'])
+
+    return {
+        'days': daily['signups']['buckets'],
+        'users': totals('signups', 'user'),
+        'orgs': totals('signups', 'org'),
+        'events': totals('events'),
+        'items': totals('items_listed'),
+    }
+
+
+def get(top_n=STATS_TOP_N, series_days=STATS_SERIES_DAYS):
+    """
+    Everything the admin dashboard shows, read from the snapshot tables.
+
+    Returns:
+        dict: {'counts': {metric: int}, 'top_orgs', 'top_users': lists of dicts,
+               'series': {'days': [...], metric: [...]}, 'refreshed_at': str or None},
+              or None on database error.
+    """
+    counts = db_operator.get_stats_counters()
+    snapshot = db_operator.get_stats_snapshot()
+    if counts is None or snapshot is None:
+        return None
+    if not snapshot and refresh():
+        # First view after a fresh install, before the refresher's first pass
+        snapshot = db_operator.get_stats_snapshot() or {}
+
+    series = _daily_series(series_days)
+    if series is None:
+        return None
+
+    top_orgs = snapshot.get('top_orgs', {})
+    top_users = snapshot.get('top_users', {})
+    return {
+        'counts': {metric: counts.get(metric, 0) for metric in METRICS},
+        'top_orgs': top_orgs.get('data', [])[:top_n],
+        'top_users': top_users.get('data', [])[:top_n],
+        'series': series,
+        'refreshed_at': top_orgs.get('refreshed_at'),
+    }
@@ -0,0 +1,56 @@
+'''Activity rollup triggers (db_conn.setup_database, read by analytics.py)'''
+
+import os
+import sys
+import tempfile
+import unittest
+
+# db_conn creates its database on import, point it to a throwaway file first
+_tmp_dir = tempfile.mkdtemp()
+os.environ['COMUNIDAD_VERDE_DB'] = os.path.join(_tmp_dir, 'test.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+#CUSTOM MODULES
+import db_conn
+
+
+class MessageRollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = db_conn.create_connection()
+        self.conn.execute("DELETE FROM messages")
+        self.conn.execute("DELETE FROM activity_rollup_daily WHERE metric = 'messages'")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _messages_per_org(self):
+        rows = self.conn.execute('''
+            SELECT dimension, SUM(value) FROM activity_rollup_daily
+            WHERE metric = 'messages' GROUP BY dimension
+        ''').fetchall()
+        return dict(rows)
+
+    def _send(self, sender_id, sender_type, recipient_id, recipient_type):
+        self.conn.execute('''
+            INSERT INTO messages (sender_id, sender_type, recipient_id, recipient_type, content)
+            VALUES (?, ?, ?, ?, 'hola')
+        ''', (sender_id, sender_type, recipient_id, recipient_type))
+        self.conn.commit()
+
+    def test_private_message_sent_by_organization_is_counted(self):
+        # Organization sessions send with sender_type 'organization'
+        self._send(5, 'organization', 7, 'user')
+        self.assertEqual(self._messages_per_org(), {'5': 1})
+
+    def test_group_message_counts_for_the_room_org(self):
+        self._send(7, 'user', 9, 'org')
+        self.assertEqual(self._messages_per_org(), {'9': 1})
+
+    def test_private_message_between_users_is_not_counted(self):
+        self._send(7, 'user', 8, 'user')
+        self.assertEqual(self._messages_per_org(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+'''Bulk onboarding of students from a CSV or JSON file (admin import)'''
+'''
+Clubs and courses hand over a cohort of several hundred students at once.
+Registering them one by one through logic.register_user costs an existence
+check, an INSERT and a bcrypt hash each, all in series. The import instead:
+
+1. streams the file row by row (CSV or JSON Lines; a JSON array is parsed whole),
+2. validates each row like register_user does and drops duplicates inside the file,
+3. per chunk of IMPORT_CHUNK_SIZE rows, finds the emails / student codes already
+   registered with a single query (db_operator.get_existing_user_keys),
+4. hashes the chunk's passwords across the password pool (passwords.hash_passwords),
+5. inserts the chunk with one executemany (db_operator.register_users_bulk).
+
+Every row gets a report entry: created, duplicate, invalid or error.
+
+Columns / keys: name, email, student_code, password (required),
+nickname (defaults to the first name), career, interests, photo.
+'''
+
+import csv
+import io
+import json
+#CUSTOM MODULES
+import db_operator
+import passwords
+
+IMPORT_CHUNK_SIZE = 200
+IMPORT_MAX_ROWS = 5000
+EMAIL_DOMAIN = '@uniandes.edu.co'
+REQUIRED_FIELDS = ('name', 'email', 'student_code', 'password')
+OPTIONAL_FIELDS = ('nickname', 'career', 'interests', 'photo')
+
+
+def iter_rows(stream, filename):
+    """
+    Reads an uploaded file row by row.
+
+    Args:
+        stream: Binary file object of the upload.
+        filename (str): Used to pick the format (.csv, .json, .jsonl / .ndjson).
+
+    Yields:
+        tuple: (row number, dict of the row), or (row number, str error) for an unreadable row.
+    """
+    row_number = 0
+    try:
+        for row_number, row in _parse(stream, filename):
+            yield row_number, row
+    except (UnicodeDecodeError, csv.Error) as e:
+        # The rest of the file can't be read, the rows before it are still imported
+        yield row_number + 1, f"No se pudo leer el archivo desde esta fila: {e}"
+
+
+def _parse(stream, filename):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+    if extension == 'csv':
+        # Row 1 is the header
+        for row_number, row in enumerate(csv.DictReader(text), start=2):
+            yield row_number, row
+        return
+
+    if extension == 'json':
+        first = text.read(1)
+        while first and first.isspace():
+            first = text.read(1)
+        if first == '[':
+            # A JSON array can only be parsed whole, use JSON Lines for very large cohorts
+            try:
+                rows = json.loads(first + text.read())
+            except ValueError as e:
+                yield 1, f"JSON inválido: {e}"
+                return
+            for row_number, row in enumerate(rows, start=1):
+                yield row_number, row if isinstance(row, dict) else "La fila no es un objeto JSON."
+            return
+        lines = _prepend(first, text)
+    elif extension in ('jsonl', 'ndjson'):
+        lines = text
+    else:
+        yield 1, "Formato no soportado. Usa un archivo .csv, .json o .jsonl."
+        return
+
+    for row_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, f"JSON inválido: {e}"
+            continue
+        yield row_number, row if isinstance(row, dict) else "La fila no es un objeto JSON."
+
+
+def _prepend(first_char, text):
+    """Lines of a text stream whose first character was already read."""
+    first_line = first_char + text.readline()
+    yield first_line
+    yield from text
+
+
+def _clean(row):
+    """Validates one row. Returns (user dict, None) or (None, error message)."""
+    user = {}
+    for field in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        value = row.get(field)
+        user[field] = str(value).strip() if value not in (None, '') else None
+
+    missing = [field for field in REQUIRED_FIELDS if not user[field]]
+    if missing:
+        return None, f"Faltan campos obligatorios: {', '.join(missing)}."
+    if not user['email'].endswith(EMAIL_DOMAIN):
+        return None, f"El correo electrónico debe terminar con {EMAIL_DOMAIN}."
+    if user['student_code'] == 'admin':
+        return None, "No se pueden importar cuentas de administrador."
+    if not user['nickname']:
+        user['nickname'] = user['name'].split()[0]
+    return user, None
+
+
+def _entry(row_number, user, status, message, row=None):
+    source = user or (row if isinstance(row, dict) else {})
+    return {
+        'row': row_number,
+        'student_code': source.get('student_code'),
+        'email': source.get('email'),
+        'status': status,
+        'message': message,
+    }
+
+
+def _import_chunk(chunk, report):
+    """Deduplicates against the database, hashes and inserts one chunk of valid rows."""
+    existing = db_operator.get_existing_user_keys(
+        [user['email'] for _, user in chunk], [user['student_code'] for _, user in chunk])
+    if existing is None:
+        report.extend(_entry(n, user, 'error', "Error en la base de datos.") for n, user in chunk)
+        return
+    taken_emails, taken_codes = existing
+
+    new_users = []
+    for row_number, user in chunk:
+        if user['email'] in taken_emails or user['student_code'] in taken_codes:
+            report.append(_entry(row_number, user, 'duplicate', "El correo electrónico o código de estudiante ya existe."))
+        else:
+            new_users.append((row_number, user))
+    if not new_users:
+        return
+
+    try:
+        hashes = passwords.hash_passwords([user['password'] for _, user in new_users])
+    except passwords.PasswordPoolBusy:
+        report.extend(_entry(n, user, 'error', "Servidor ocupado, vuelve a importar esta fila.") for n, user in new_users)
+        return
+
+    inserted = db_operator.register_users_bulk([
+        ('user', user['student_code'], hashed, user['name'], user['nickname'], user['email'],
+         user['career'], user['interests'], user['photo'])
+        for (_, user), hashed in zip(new_users, hashes)
+    ])
+    for (row_number, user), ok in zip(new_users, inserted):
+        if ok:
+            report.append(_entry(row_number, user, 'created', "Usuario registrado."))
+        else:
+            report.append(_entry(row_number, user, 'error', "No se pudo registrar (¿ya existe?)."))
+
+
+def import_users(rows):
+    """
+    Runs the import over the rows of iter_rows.
+
+    Returns:
+        list: Report entries {'row', 'student_code', 'email', 'status', 'message'} sorted by row.
+    """
+    report = []
+    seen_emails, seen_codes = set(), set()
+    chunk = []
+    for count, (row_number, row) in enumerate(rows, start=1):
+        if count > IMPORT_MAX_ROWS:
+            report.append(_entry(row_number, None, 'invalid', f"Se superó el máximo de {IMPORT_MAX_ROWS} filas, el resto no se importó."))
+            break
+        if isinstance(row, str):
+            report.append(_entry(row_number, None, 'invalid', row))
+            continue
+
+        user, error = _clean(row)
+        if error:
+            report.append(_entry(row_number, None, 'invalid', error, row))
+            continue
+        if user['email'] in seen_emails or user['student_code'] in seen_codes:
+            report.append(_entry(row_number, user, 'duplicate', "Repetido dentro del archivo."))
+            continue
+        seen_emails.add(user['email'])
+        seen_codes.add(user['student_code'])
+
+        chunk.append((row_number, user))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            _import_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        _import_chunk(chunk, report)
+
+    report.sort(key=lambda entry: entry['row'])
+    return report